@@ -0,0 +1,113 @@
+"""cache.py: Module for an optional, compressed on-disk cache of HTTP responses keyed by URL."""
+
+import os
+import re
+import gzip
+import time
+import struct
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Optional
+from . import extract
+
+MODULE_DIR = Path(__file__).parent
+CACHE_DIR = MODULE_DIR / 'http_cache'  # default cache directory
+
+DEFAULT_TTL = 60 * 60  # seconds
+IN_PROGRESS_TTL = 60  # seconds, for game pages that are not final yet
+TTL_RULES = (
+    # (url pattern, ttl in seconds or None to never expire), first match wins
+    (re.compile(r'/player/_/id/'), None),  # player bios
+    (re.compile(r'/(?:playbyplay|boxscore|game|recap)/_/gameId/'), None),  # only once the game is final
+    (re.compile(r'/scoreboard/'), 5 * 60),
+    (re.compile(r'/team/schedule/'), 60 * 60),
+    (re.compile(r'/standings/'), 60 * 60),
+    (re.compile(r'/team/_/id/'), 24 * 60 * 60),
+)
+RE_GAME_URL = TTL_RULES[1][0]
+
+_HEADER = struct.Struct('>d')  # expiry timestamp, 0 if the entry never expires
+
+_cache: Optional['ResponseCache'] = None  # singular global cache, disabled unless enabled
+
+
+def ttl_for(url: str, content: bytes) -> float | None:
+    """Determines how long a response may be cached for, or None if it never expires."""
+    for pattern, ttl in TTL_RULES:
+        if pattern.search(url):
+            if pattern is RE_GAME_URL and not extract.is_final(content):
+                return IN_PROGRESS_TTL
+            return ttl
+    return DEFAULT_TTL
+
+
+class ResponseCache:
+    def __init__(self, directory: str | Path = CACHE_DIR):
+        self._dir = Path(directory)
+        self._dir.mkdir(parents=True, exist_ok=True)
+
+    def __repr__(self):
+        return f'ResponseCache(directory={self._dir})'
+
+    def _path(self, url: str) -> Path:
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return self._dir / key[:2] / f'{key}.gz'
+
+    def get(self, url: str) -> bytes | None:
+        """Returns the cached body for a URL, or None if it is missing or expired."""
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as fp:
+                raw = fp.read()
+        except FileNotFoundError:
+            return None
+        expiry, = _HEADER.unpack_from(raw)
+        if expiry and expiry < time.time():
+            return None
+        try:
+            return gzip.decompress(raw[_HEADER.size:])
+        except (OSError, EOFError) as e:
+            logging.warning(f'Discarding corrupt cache entry for {url}: {e}')
+            return None
+
+    def put(self, url: str, content: bytes):
+        """Stores a response body, replacing any existing entry atomically."""
+        ttl = ttl_for(url, content)
+        expiry = 0. if ttl is None else time.time() + ttl
+        path = self._path(url)
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(_HEADER.pack(expiry))
+            fp.write(gzip.compress(content, compresslevel=6))
+        os.replace(tmp, path)
+
+    def clear(self):
+        """Removes every cached entry."""
+        for path in self._dir.glob('*/*.gz'):
+            path.unlink(missing_ok=True)
+
+
+def enable(directory: str | Path = CACHE_DIR) -> ResponseCache:
+    """Turns on the global response cache used by all page fetches."""
+    global _cache
+    _cache = ResponseCache(directory)
+    return _cache
+
+
+def disable():
+    global _cache
+    _cache = None
+
+
+def get(url: str) -> bytes | None:
+    if _cache is None:
+        return None
+    return _cache.get(url)
+
+
+def put(url: str, content: bytes):
+    if _cache is not None:
+        _cache.put(url, content)
@@ -0,0 +1,49 @@
+"""classify.py: Module for classifying play descriptions into play types."""
+
+import re
+
+RE_PLAY_TYPES = (
+    ('SHT',
+     r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+(made|missed)\s+(Three Point Jumper|Jumper|Layup|Dunk|Free Throw|Hook Shot|Two Point Tip Shot)?\.?(?:\s+Assisted by\s+((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\.)?"),
+    ('REB', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+(Offensive|Defensive|Deadball Team)\s+Rebound\."),
+    ('FL', r"(Technical )?Foul on\s+((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\."),
+    ('TOV', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+Turnover\."),
+    ('STL', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+Steal\."),
+    ('BLK', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+Block\."),
+    ('TO', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+Timeout"),
+    ('JMP', r"Jump Ball won by\s+((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)"),
+    ('EOP', r"End of\s+[A-Za-z0-9]+"),
+    ('INV', r".*")
+)
+
+# literal cues that a description must contain for a play type's pattern to be able to match
+PLAY_TYPE_CUES = {
+    'SHT': ('made', 'missed'),
+    'REB': ('Rebound.',),
+    'FL': ('Foul on',),
+    'TOV': ('Turnover.',),
+    'STL': ('Steal.',),
+    'BLK': ('Block.',),
+    'TO': ('Timeout',),
+    'JMP': ('Jump Ball won by',),
+    'EOP': ('End of',),
+    'INV': ('',),
+}
+
+# (type, compiled pattern, cues) in the same priority order as RE_PLAY_TYPES
+_DISPATCH = tuple((t, re.compile(r), PLAY_TYPE_CUES[t]) for t, r in RE_PLAY_TYPES)
+
+
+def classify(desc: str) -> tuple[str, tuple]:
+    """
+    Classifies a play description, returning its play type and the groups matched by the type's pattern.
+
+    Results are identical to searching every pattern of `RE_PLAY_TYPES` in order, but a pattern is only run
+    when the description contains one of its cues, so most plays run a single regex.
+    """
+    for t, pattern, cues in _DISPATCH:
+        if any(cue in desc for cue in cues):
+            m = pattern.search(desc)
+            if m is not None:
+                return t, m.groups()
+    return 'INV', ()
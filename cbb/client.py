@@ -0,0 +1,353 @@
+"""client.py: Module with the shared, pooled keep-alive HTTP clients used for every page fetch."""
+
+import ssl
+import time
+import gzip
+import zlib
+import queue
+import asyncio
+import logging
+import threading
+import weakref
+import http.client
+import urllib.parse
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Mapping
+from . import instrument, throttle
+
+try:
+    import brotli  # optional, enables `br` content encoding
+except ImportError:
+    brotli = None
+
+MAX_CONNECTIONS_PER_HOST = 8
+MAX_REDIRECTS = 5
+TIMEOUT = 30  # seconds
+KEEPALIVE_TIMEOUT = 30  # seconds an idle async connection is kept open
+ACCEPT_ENCODING = 'gzip, deflate' + (', br' if brotli is not None else '')
+DEFAULT_HEADERS = {
+    'Accept-Encoding': ACCEPT_ENCODING,
+    'Connection': 'keep-alive',
+    'User-Agent': 'Mozilla/5.0 (compatible; cbb)',
+}
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+CHUNK_SIZE = 16 * 1024  # bytes read at a time from a streamed body
+
+Until = Callable[[bytes], bool]  # whether a decoded prefix of a body holds everything needed of it
+
+
+class Response:
+    """
+    A read response with its body decoded, whose headers are looked up case-insensitively.
+
+    The body is only a prefix of the document if it was `truncated`, i.e., read until a predicate held (see `get`).
+    """
+
+    def __init__(self, url: str, status: int, reason: str, headers: Mapping[str, str], content: bytes,
+                 truncated: bool = False):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.truncated = truncated
+
+    def __repr__(self):
+        return f'Response(url={self.url}, status={self.status}, bytes={len(self.content)}' + \
+            (', truncated=True)' if self.truncated else ')')
+
+    def read(self) -> bytes:
+        return self.content
+
+
+def decode(content: bytes, encoding: str | None) -> bytes:
+    """Decodes a response body according to its Content-Encoding header."""
+    match (encoding or '').strip().lower():
+        case '' | 'identity':
+            return content
+        case 'gzip' | 'x-gzip':
+            return gzip.decompress(content)
+        case 'deflate':
+            try:
+                return zlib.decompress(content)
+            except zlib.error:
+                return zlib.decompress(content, -zlib.MAX_WBITS)  # raw deflate without a zlib header
+        case 'br' if brotli is not None:
+            return brotli.decompress(content)
+    raise ValueError(f'unsupported content encoding {encoding!r}')
+
+
+def _inflate(wbits: int) -> Callable[[bytes], Iterator[bytes]]:
+    d = zlib.decompressobj(wbits)
+
+    def decompress(chunk: bytes) -> Iterator[bytes]:
+        while chunk:
+            yield d.decompress(chunk, CHUNK_SIZE)
+            chunk = d.unconsumed_tail
+    return decompress
+
+
+def decompressor(encoding: str | None) -> Callable[[bytes], Iterator[bytes]]:
+    """
+    An incremental `decode` for a body read chunk by chunk, yielding the decoded bytes of each chunk (zlib-encoded
+    ones up to `CHUNK_SIZE` at a time, since a small compressed chunk can decode to many times its size).
+    """
+    match (encoding or '').strip().lower():
+        case '' | 'identity':
+            return lambda chunk: iter((chunk,))
+        case 'gzip' | 'x-gzip':
+            return _inflate(16 + zlib.MAX_WBITS)
+        case 'deflate':
+            inflate = None
+
+            def decompress(chunk: bytes) -> Iterator[bytes]:
+                nonlocal inflate
+                if inflate is None:  # raw deflate unless the first chunk has a zlib header
+                    zlib_header = len(chunk) >= 2 and chunk[0] & 0x0f == 8 and (chunk[0] << 8 | chunk[1]) % 31 == 0
+                    inflate = _inflate(zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS)
+                return inflate(chunk)
+            return decompress
+        case 'br' if brotli is not None:
+            d = brotli.Decompressor()
+            return lambda chunk: iter((d.process(chunk),))
+    raise ValueError(f'unsupported content encoding {encoding!r}')
+
+
+def _read_until(read: Callable[[int], bytes], encoding: str | None, until: Until) -> tuple[bytes, bool]:
+    """
+    Reads and decodes a body chunk by chunk until `until` holds for what was decoded so far, returning it and
+    whether the rest of the body was left unread.
+    """
+    decompress = decompressor(encoding)
+    body = bytearray()
+    while chunk := read(CHUNK_SIZE):
+        for part in decompress(chunk):
+            body += part
+            if until(body):
+                return bytes(body), True
+    return bytes(body), False
+
+
+def _record(host: str, resp: Response | None, seconds: float, attempt: int):
+    """Instruments a request attempt, given its response or None if it failed to connect"""
+    instrument.observe('http_request_seconds', seconds, host=host)
+    instrument.inc('http_responses_total', host=host, status=resp.status if resp is not None else 'error')
+    if attempt:
+        instrument.inc('http_retries_total', host=host)
+    if resp is not None:
+        instrument.inc('http_bytes_total', len(resp.content), host=host)
+        if resp.truncated:
+            instrument.inc('http_truncated_total', host=host)
+        if resp.status in throttle.THROTTLE_STATUSES:
+            instrument.inc('http_throttled_total', host=host)
+
+
+class SyncClient:
+    """Thread-safe HTTP/1.1 client that keeps a pool of keep-alive connections per host."""
+
+    def __init__(self, per_host: int = MAX_CONNECTIONS_PER_HOST, timeout: float = TIMEOUT):
+        self.per_host = per_host
+        self.timeout = timeout
+        self._idle: dict[tuple, queue.LifoQueue] = dict()
+        self._slots: dict[tuple, threading.BoundedSemaphore] = dict()
+        self._lock = threading.Lock()
+        self._ssl = ssl.create_default_context()
+
+    def __repr__(self):
+        return f'SyncClient(per_host={self.per_host}, hosts={len(self._idle)})'
+
+    def _pool(self, key: tuple) -> tuple[queue.LifoQueue, threading.BoundedSemaphore]:
+        with self._lock:
+            if key not in self._idle:
+                self._idle[key] = queue.LifoQueue()
+                self._slots[key] = threading.BoundedSemaphore(self.per_host)
+            return self._idle[key], self._slots[key]
+
+    def _connect(self, key: tuple) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    @contextmanager
+    def _connection(self, key: tuple):
+        """Checks out an idle connection to a host (or opens one), waiting while the host is at its limit."""
+        idle, slots = self._pool(key)
+        with slots:
+            try:
+                c = idle.get_nowait()
+            except queue.Empty:
+                c = self._connect(key)
+            reusable = [True]
+            try:
+                yield c, reusable
+            except BaseException:
+                c.close()
+                raise
+            if reusable[0]:
+                idle.put(c)
+            else:
+                c.close()
+
+    def _request(self, url: str, headers: dict | None,
+                 until: Until | None = None) -> tuple[http.client.HTTPResponse, bytes, bool]:
+        """Requests a URL over a pooled connection, returning the response, its decoded body and if it was truncated"""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        with self._connection(key) as (c, reusable):
+            for attempt in range(2):
+                try:
+                    c.request('GET', target, headers={**DEFAULT_HEADERS, **(headers or {})})
+                    resp = c.getresponse()
+                    encoding = resp.getheader('Content-Encoding')
+                    if until is not None and resp.status == 200:
+                        body, truncated = _read_until(resp.read1, encoding, until)
+                    else:
+                        body, truncated = decode(resp.read(), encoding), False
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    # the server closed an idle keep-alive connection, retry once on a fresh one
+                    c.close()
+                    if attempt:
+                        raise
+            reusable[0] = not (resp.will_close or truncated)  # the unread rest of a body is dropped with its socket
+        return resp, body, truncated
+
+    def _get(self, url: str, headers: dict | None, until: Until | None) -> Response:
+        for _ in range(MAX_REDIRECTS + 1):
+            resp, body, truncated = self._request(url, headers, until)
+            if resp.status in REDIRECT_CODES and resp.getheader('Location'):
+                url = urllib.parse.urljoin(url, resp.getheader('Location'))
+                continue
+            return Response(url, resp.status, resp.reason, resp.headers, body, truncated)
+        raise http.client.HTTPException(f'too many redirects for {url}')
+
+    def get(self, url: str, headers: dict | None = None, until: Until | None = None) -> Response:
+        """
+        GETs a URL through the rate limiter, following redirects and decoding compressed bodies.
+
+        Throttled, failed and unavailable requests are retried with backoff (see `throttle`), and the last response
+        is returned once out of tries. Given `until`, a successful body is streamed and decoded chunk by chunk, and
+        the connection is closed as soon as `until` holds for the prefix read so far, which is all that is returned.
+        """
+        host = throttle.limiter().host(url)
+        for attempt in range(throttle.MAX_TRIES):
+            host.acquire()
+            start = time.perf_counter()
+            try:
+                resp = self._get(url, headers, until)
+            except (http.client.HTTPException, OSError) as e:
+                host.release(None)
+                _record(host.host, None, time.perf_counter() - start, attempt)
+                if attempt == throttle.MAX_TRIES - 1:
+                    raise
+                logging.info(f'Request to {url} failed ({e!r}), retrying')
+                time.sleep(throttle.backoff(attempt))
+                continue
+            wait = throttle.retry_after(resp.headers.get('Retry-After'))
+            host.release(resp.status, wait)
+            _record(host.host, resp, time.perf_counter() - start, attempt)
+            if resp.status not in throttle.RETRY_STATUSES or attempt == throttle.MAX_TRIES - 1:
+                return resp
+            time.sleep(throttle.backoff(attempt, wait))
+
+    def get_many(self, urls: Iterable[str], headers: dict | None = None) -> list[Response]:
+        """GETs many URLs concurrently over the pooled connections, in order."""
+        urls = list(urls)
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.per_host, len(urls))) as executor:
+            return list(executor.map(lambda url: self.get(url, headers), urls))
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                while not idle.empty():
+                    idle.get_nowait().close()
+
+
+_client: SyncClient | None = None  # singular global sync client
+_client_lock = threading.Lock()
+_sessions: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]' = weakref.WeakKeyDictionary()
+
+
+def client() -> SyncClient:
+    """The shared sync client."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = SyncClient()
+        return _client
+
+
+def get(url: str, headers: dict | None = None, until: Until | None = None) -> Response:
+    return client().get(url, headers, until)
+
+
+def async_session() -> aiohttp.ClientSession:
+    """The shared async session of the running event loop, pooled per host like the sync client."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=MAX_CONNECTIONS_PER_HOST,
+                                         keepalive_timeout=KEEPALIVE_TIMEOUT)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+                                        headers={k: v for k, v in DEFAULT_HEADERS.items() if k != 'Connection'})
+        _sessions[loop] = session
+    return session
+
+
+async def close_async_session():
+    """Closes the running event loop's shared session, if any."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+        logging.debug('Closed shared async session')
+
+
+async def _read_until_async(r: aiohttp.ClientResponse, until: Until) -> tuple[bytes, bool]:
+    """`_read_until` for an async response, whose body the session already decodes"""
+    body = bytearray()
+    async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+        body += chunk
+        if until(body):
+            r.close()  # drops the connection instead of draining the rest of the body
+            return bytes(body), True
+    return bytes(body), False
+
+
+async def fetch(url: str, session: aiohttp.ClientSession | None = None,
+                headers: Mapping[str, str] | None = None, until: Until | None = None) -> Response:
+    """
+    Asynchronously GETs a URL through the rate limiter and the shared session by default, retrying and streaming
+    the body up to `until` like `get`.
+    """
+    session = session or async_session()
+    host = throttle.limiter().host(url)
+    for attempt in range(throttle.MAX_TRIES):
+        await host.acquire_async()
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as r:
+                if until is not None and r.status == 200:
+                    content, truncated = await _read_until_async(r, until)
+                else:
+                    content, truncated = await r.read(), False
+                resp = Response(str(r.url), r.status, r.reason, r.headers.copy(), content, truncated)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            host.release(None)
+            _record(host.host, None, time.perf_counter() - start, attempt)
+            if attempt == throttle.MAX_TRIES - 1:
+                raise
+            logging.info(f'Request to {url} failed ({e!r}), retrying')
+            await asyncio.sleep(throttle.backoff(attempt))
+            continue
+        wait = throttle.retry_after(resp.headers.get('Retry-After'))
+        host.release(resp.status, wait)
+        _record(host.host, resp, time.perf_counter() - start, attempt)
+        if resp.status not in throttle.RETRY_STATUSES or attempt == throttle.MAX_TRIES - 1:
+            return resp
+        await asyncio.sleep(throttle.backoff(attempt, wait))
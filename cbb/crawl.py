@@ -0,0 +1,201 @@
+"""crawl.py: Module for concurrently crawling and ingesting many games."""
+
+import os
+import asyncio
+import logging
+import multiprocessing
+import time
+import aiohttp
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Union
+from .webscraper import ByteBudget, registry
+from . import client, database, instrument, jobs, metadata, pbp
+
+DEFAULT_CONCURRENCY = 8  # number of games fetched at once
+PROGRESS_INTERVAL = 10  # seconds between progress reports
+DEFAULT_WORKERS = os.cpu_count() or 1  # parsing processes
+POOL_START_METHOD = 'spawn'  # forking the running event loop's threads is unsafe
+DEFAULT_MAX_INFLIGHT_BYTES = 64 * 1024 * 1024  # of game pages held by the fetchers at once
+
+
+class CrawlStats:
+    """Running counters for a crawl, reported as progress while games are ingested."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.ingested = 0
+        self.committed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    def __repr__(self):
+        return (f'CrawlStats(done={self.done}/{self.total}, ingested={self.ingested}, committed={self.committed}, '
+                f'skipped={self.skipped}, failed={self.failed}, rate={self.rate:.1f} games/min)')
+
+    @property
+    def done(self) -> int:
+        return self.ingested + self.skipped + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    @property
+    def rate(self) -> float:
+        """Throughput in games per minute"""
+        elapsed = self.elapsed
+        return 60 * self.done / elapsed if elapsed > 0 else 0.
+
+
+async def _fetcher(session: aiohttp.ClientSession, pool: Executor | None, budget: ByteBudget, gids: asyncio.Queue,
+                   games: asyncio.Queue, stats: CrawlStats):
+    while True:
+        gid = await gids.get()
+        try:
+            try:
+                fetched = await pbp.fetch_game(gid, session, pool, budget)
+            except Exception as e:
+                logging.error(f'Fetching {gid=} failed: {e!r}')
+                jobs.fail(gid, e)
+                fetched = None
+            if fetched is None:
+                stats.failed += 1
+                instrument.inc('games_total', result='failed')
+                continue
+            await games.put((gid, *fetched))
+        finally:
+            gids.task_done()
+
+
+async def _writer(writer: database.Writer, games: asyncio.Queue, stats: CrawlStats,
+                  progress: Callable[[CrawlStats], None]):
+    """Single consumer that inserts the rows of parsed games"""
+    last_report = time.perf_counter()
+    while True:
+        gid, parsed, team_pages = await games.get()
+        try:
+            with writer.game():
+                pbp.write_game(parsed, gid)
+            for page in team_pages:  # only needed until the game's teams are registered
+                page.release()
+        except Exception as e:
+            logging.error(f'Ingesting {gid=} failed: {e!r}')
+            jobs.fail(gid, e)  # outside the rolled back game, so it is committed with the next batch
+            stats.failed += 1
+            instrument.inc('games_total', result='failed')
+        else:
+            stats.ingested += 1
+            instrument.inc('games_total', result='ingested')
+            if writer.pending == 0:
+                stats.committed = stats.ingested
+        finally:
+            games.task_done()
+        if time.perf_counter() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.perf_counter()
+            progress(stats)
+
+
+def _log_progress(stats: CrawlStats):
+    logging.info(repr(stats))
+
+
+def _exporting(progress: Callable[[CrawlStats], None], metrics_file: str | Path) -> Callable[[CrawlStats], None]:
+    def _progress(stats: CrawlStats):
+        progress(stats)
+        instrument.write(metrics_file)
+
+    return _progress
+
+
+async def crawl_async(gids: Iterable[Union[str, int]], concurrency: int = DEFAULT_CONCURRENCY,
+                      assume_gid_from_pbp: bool = False,
+                      progress: Callable[[CrawlStats], None] = _log_progress,
+                      batch_games: int = database.DEFAULT_BATCH_GAMES,
+                      batch_seconds: float = database.DEFAULT_BATCH_SECONDS,
+                      workers: int = DEFAULT_WORKERS, metrics_file: str | Path | None = None,
+                      max_inflight_bytes: int | None = DEFAULT_MAX_INFLIGHT_BYTES) -> CrawlStats:
+    """
+    Fetches the pages for many games concurrently and ingests them through a single writer.
+
+    At most `concurrency` games are fetched at once, as long as their pages fit in `max_inflight_bytes` (see
+    `ByteBudget`), and at most `concurrency` fetched games wait on the writer. Pages are released as soon as they
+    are parsed, so memory stays bounded by these limits however many games are crawled.
+    Pages are parsed into rows by a pool of `workers` processes (or threads of this process if 0), so only the
+    writer, which commits games in groups of `batch_games` or every `batch_seconds`, runs in this process.
+
+    The pipeline's metrics (see `instrument`) are written to `metrics_file` with every progress report, as a JSON
+    snapshot if it ends in `.json` or as Prometheus text otherwise.
+
+    Every gid is tracked by an ingest job (see `jobs`), committed along with the game's rows, and games whose job is
+    already committed are skipped if `assume_gid_from_pbp`.
+    """
+    gids = list(dict.fromkeys(str(gid) for gid in gids))  # deduplicate while keeping order
+    stats = CrawlStats(len(gids))
+    if metrics_file is not None:
+        progress = _exporting(progress, metrics_file)
+    gid_queue = asyncio.Queue()
+    game_queue = asyncio.Queue(maxsize=concurrency)
+    budget = ByteBudget(max_inflight_bytes)
+
+    with registry(), database.Writer(batch_games, batch_seconds) as writer:
+        jobs.discover(gids)
+        writer.commit()  # so that an interrupted crawl can be resumed
+        done = jobs.committed() if assume_gid_from_pbp else set()
+        for gid in gids:
+            if int(gid) in done:
+                stats.skipped += 1
+                instrument.inc('games_total', result='skipped')
+            else:
+                gid_queue.put_nowait(gid)
+        metadata.warm()  # resolve known teams and rosters without SQL from here on
+        session = client.async_session()
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(POOL_START_METHOD)) \
+            if workers else None
+        try:
+            fetchers = [asyncio.create_task(_fetcher(session, pool, budget, gid_queue, game_queue, stats))
+                        for _ in range(concurrency)]
+            consumer = asyncio.create_task(_writer(writer, game_queue, stats, progress))
+            await gid_queue.join()
+            await game_queue.join()
+            for task in (*fetchers, consumer):
+                task.cancel()
+            await asyncio.gather(*fetchers, consumer, return_exceptions=True)
+        finally:
+            await client.close_async_session()
+            if pool is not None:
+                pool.shutdown()
+    stats.committed = stats.ingested
+    logging.info(f'At most {budget.peak} bytes of game pages were held at once')
+
+    progress(stats)
+    return stats
+
+
+def crawl(gids: Iterable[Union[str, int]], concurrency: int = DEFAULT_CONCURRENCY,
+          assume_gid_from_pbp: bool = False,
+          progress: Callable[[CrawlStats], None] = _log_progress,
+          batch_games: int = database.DEFAULT_BATCH_GAMES,
+          batch_seconds: float = database.DEFAULT_BATCH_SECONDS,
+          workers: int = DEFAULT_WORKERS, metrics_file: str | Path | None = None,
+          max_inflight_bytes: int | None = DEFAULT_MAX_INFLIGHT_BYTES) -> CrawlStats:
+    """Synchronous entry point for `crawl_async`."""
+    return asyncio.run(crawl_async(gids, concurrency, assume_gid_from_pbp, progress, batch_games, batch_seconds,
+                                   workers, metrics_file, max_inflight_bytes))
+
+
+def resume(concurrency: int = DEFAULT_CONCURRENCY, max_attempts: int | None = None,
+           progress: Callable[[CrawlStats], None] = _log_progress, workers: int = DEFAULT_WORKERS) -> CrawlStats:
+    """
+    Crawls the games whose ingest job is not committed, i.e., those an interrupted crawl left behind and those that
+    failed (if tried fewer than `max_attempts` times).
+    """
+    gids = jobs.incomplete(max_attempts)
+    logging.info(f'Resuming {len(gids)} incomplete ingest jobs')
+    return crawl(gids, concurrency, progress=progress, workers=workers)
+
+
+if __name__ == '__main__':
+    print(jobs.summary())
+    print(resume())
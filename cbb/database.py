@@ -1,80 +1,352 @@
-import sqlite3
-import os
-import logging
-import math
-from typing import Optional
-from contextlib import contextmanager
-from pathlib import Path
-
-MODULE_DIR = Path(__file__).parent
-SCHEMA_FILE = MODULE_DIR / 'cbb.sqlite'  # schema initialization file
-DB_FILE = MODULE_DIR / 'CBB.db'  # database file
-
-_conn: Optional[sqlite3.Connection] = None  # singular global database connection
-
-
-def delete_db(force=False) -> bool:
-    """Delete the database file."""
-    if _conn is not None:
-        _conn.rollback()
-    if not os.path.exists(DB_FILE):
-        print('Database file does not exist.')
-        return False
-    ans = 'y' if force else input('Are you sure you want to delete the existing database? [y/N]').lower().startswith('y')
-    res = ans == 'y'
-    if res:
-        try:
-            print(f'Deleting {DB_FILE}...', end='')
-            os.remove(DB_FILE)
-            print('deleted.')
-        except OSError as e:
-            print(f'Something went wrong while deleting the DB file: {e}')
-            return False
-    else:
-        print('Canceled deleting database.')
-    return res
-
-
-def init_schema() -> bool:
-    """Initialize the schema to the appropriate `db` file."""
-    with (
-        open(SCHEMA_FILE, 'r') as fp,
-        conn() as c
-    ):
-        if c is None:
-            logging.warning('connection could not be established')
-            return False
-        cursor = c.cursor()
-        cursor.executescript(fp.read())
-        c.commit()
-    return True
-
-
-@contextmanager
-def conn(path: str = DB_FILE):
-    global _conn
-    if _conn is None:
-        _conn = sqlite3.connect(path)
-        _conn.row_factory = sqlite3.Row  # dict-like results from SELECT statements
-        _conn.create_function('sqrt', 1, math.sqrt)
-    try:
-        yield _conn
-    except Exception as e:
-        logging.critical('error encountered, rolling back')
-        _conn.rollback()
-        raise e
-    else:
-        _conn.commit()
-    # finally:
-    # for now, we won't worry about explicitly closing the connection
-    # (see https://stackoverflow.com/questions/9561832/what-if-i-dont-close-the-database-connection-in-python-sqlite)
-    #     _conn.close()
-
-
-def with_cursor(func):
-    def _with_cursor(*args, **kwargs):
-        with conn() as c:
-            res = func(c.cursor(), *args, **kwargs)
-        return res
-
-    return _with_cursor
+import sqlite3
+import os
+import logging
+import math
+import threading
+import time
+from typing import Callable, Optional
+from contextlib import contextmanager
+from pathlib import Path
+from . import instrument
+
+MODULE_DIR = Path(__file__).parent
+SCHEMA_FILE = MODULE_DIR / 'cbb.sqlite'  # schema initialization file
+INDEX_FILE = MODULE_DIR / 'indexes.sqlite'  # secondary index initialization file
+DB_FILE = MODULE_DIR / 'CBB.db'  # database file
+
+PRAGMAS = (
+    ('journal_mode', 'WAL'),  # readers do not block the writer and commits append to the log
+    ('synchronous', 'NORMAL'),  # with WAL, only checkpoints fsync
+    ('cache_size', -64000),  # negative values are in KiB, i.e., 64MB
+    ('temp_store', 'MEMORY'),
+)
+DEFAULT_BATCH_GAMES = 50  # games per commit for the ingest writer
+DEFAULT_BATCH_SECONDS = 5.  # max seconds between commits for the ingest writer
+
+_rollback_hooks: list[Callable[[], None]] = []  # called whenever written rows may have been discarded
+
+
+def on_rollback(hook: Callable[[], None]):
+    """Registers a function to call after every rollback (e.g., to invalidate caches of written rows)."""
+    _rollback_hooks.append(hook)
+
+
+def _rolled_back():
+    for hook in _rollback_hooks:
+        hook()
+
+
+def delete_db(force=False) -> bool:
+    """Delete the database file."""
+    _connections.close()
+    _rolled_back()
+    if not os.path.exists(DB_FILE):
+        print('Database file does not exist.')
+        return False
+    ans = 'y' if force else input('Are you sure you want to delete the existing database? [y/N]').lower().startswith('y')
+    res = ans == 'y'
+    if res:
+        try:
+            print(f'Deleting {DB_FILE}...', end='')
+            os.remove(DB_FILE)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(f'{DB_FILE}{suffix}'):
+                    os.remove(f'{DB_FILE}{suffix}')
+            print('deleted.')
+        except OSError as e:
+            print(f'Something went wrong while deleting the DB file: {e}')
+            return False
+    else:
+        print('Canceled deleting database.')
+    return res
+
+
+def init_schema() -> bool:
+    """Initialize the schema and its indexes to the appropriate `db` file."""
+    with (
+        open(SCHEMA_FILE, 'r') as fp,
+        conn() as c
+    ):
+        if c is None:
+            logging.warning('connection could not be established')
+            return False
+        cursor = c.cursor()
+        cursor.executescript(fp.read())
+        c.commit()
+    return create_indexes()
+
+
+def create_indexes() -> bool:
+    """Creates the managed secondary indexes and refreshes the query planner statistics."""
+    with (
+        open(INDEX_FILE, 'r') as fp,
+        conn() as c
+    ):
+        if c is None:
+            logging.warning('connection could not be established')
+            return False
+        cursor = c.cursor()
+        cursor.executescript(fp.read())
+        cursor.execute('ANALYZE')
+        c.commit()
+    return True
+
+
+def drop_indexes() -> list[str]:
+    """Drops the managed secondary indexes (e.g., ahead of a bulk load), returning their names."""
+    with conn() as c:
+        names = [row['name'] for row in c.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx\\_%' ESCAPE '\\'")]
+        for name in names:
+            c.execute(f'DROP INDEX IF EXISTS {name}')
+    return names
+
+
+def connect(path: str = DB_FILE, readonly: bool = False) -> sqlite3.Connection:
+    """Opens a new connection with the module's row factory, functions and pragmas, read-only if `readonly`."""
+    if readonly:
+        c = sqlite3.connect(f'{Path(path).resolve().as_uri()}?mode=ro', uri=True, check_same_thread=False)
+    else:
+        c = sqlite3.connect(path, check_same_thread=False)
+    c.row_factory = sqlite3.Row  # dict-like results from SELECT statements
+    c.create_function('sqrt', 1, math.sqrt, deterministic=True)
+    for pragma, value in PRAGMAS:
+        if readonly and pragma == 'journal_mode':
+            continue  # set by the writer, and kept by the file
+        c.execute(f'PRAGMA {pragma}={value}')
+    return c
+
+
+class Connections:
+    """
+    Connections to the database file: one writer connection, which threads take turns on one transaction at a time
+    (see `write_lock`), and a read-only connection per thread, which reads the latest commit under WAL without
+    waiting for the writer.
+
+    Connections are opened on first use. A thread only ever uses its own read-only connection, and those of threads
+    that have ended are closed whenever another thread opens one.
+    """
+
+    def __init__(self, path: str | Path = DB_FILE):
+        self.path = str(path)
+        self.write_lock = threading.RLock()  # held by the thread in a write transaction or with a writer open
+        self._writer: Optional[sqlite3.Connection] = None
+        self._readers: dict[threading.Thread, sqlite3.Connection] = dict()
+        self._lock = threading.Lock()  # guards opening and closing connections
+
+    def __repr__(self):
+        return f'Connections(path={self.path!r}, readers={len(self._readers)})'
+
+    def writer(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._writer is None:
+                self._writer = connect(self.path)
+            return self._writer
+
+    def reader(self) -> sqlite3.Connection:
+        """The current thread's read-only connection"""
+        thread = threading.current_thread()
+        c = self._readers.get(thread)
+        if c is None:
+            self.writer()  # creates the file and switches it to WAL, which a read-only connection cannot
+            with self._lock:
+                for t in [t for t in self._readers if not t.is_alive()]:
+                    self._readers.pop(t).close()
+                c = self._readers[thread] = connect(self.path, readonly=True)
+        return c
+
+    def close(self):
+        """Closes every connection, discarding what was not committed"""
+        with self.write_lock, self._lock:
+            for c in (self._writer, *self._readers.values()):
+                if c is not None:
+                    c.close()
+            self._writer, self._readers = None, dict()
+
+    def open(self, path: str | Path):
+        """Points the connections at another database file, closing the current ones"""
+        with self.write_lock:
+            self.close()
+            self.path = str(path)
+
+
+class _Depth(threading.local):
+    """Nesting depths of the current thread's `conn` contexts"""
+    write = 0  # only the outermost write context commits, and none while the thread has a writer open
+    read = 0  # only the outermost read context ends its snapshot
+
+
+_connections = Connections()  # singular global database connections
+_depth = _Depth()
+_writer: Optional['Writer'] = None  # active ingest writer, which decides when to commit instead
+
+
+def connections() -> Connections:
+    return _connections
+
+
+def open_db(path: str | Path) -> sqlite3.Connection:
+    """Points the module connections at another database file (e.g., a shard), closing the current ones."""
+    if _writer is not None:
+        raise RuntimeError('cannot switch databases while a writer is open')
+    _connections.open(path)
+    _rolled_back()  # caches of rows written to the previous database no longer apply
+    return _connections.writer()
+
+
+@contextmanager
+def _read():
+    c = _connections.reader()
+    outermost = _depth.read == 0
+    if outermost:
+        c.execute('BEGIN')  # every statement of the context reads the same snapshot
+    _depth.read += 1
+    try:
+        yield c
+    finally:
+        _depth.read -= 1
+        if outermost:
+            c.rollback()
+
+
+@contextmanager
+def conn(*, write: bool = True):
+    """
+    The writer connection, whose transaction is committed by the thread's outermost context (or rolled back on
+    error), or with `write=False`, the thread's read-only connection, which neither waits for nor holds up writes.
+    Reads inside a write transaction use the writer connection, so that they see its uncommitted rows.
+    """
+    if not write and _depth.write == 0:
+        with _read() as c:
+            yield c
+        return
+    with _connections.write_lock:  # other threads' writes wait for the transaction to end
+        c = _connections.writer()
+        # nested contexts (e.g., `with_cursor` functions calling each other) share the outermost transaction
+        outermost = _depth.write == 0
+        _depth.write += 1
+        try:
+            yield c
+        except Exception as e:
+            if outermost:
+                logging.critical('error encountered, rolling back')
+                c.rollback()
+                _rolled_back()
+            raise e
+        else:
+            if outermost:
+                c.commit()
+        finally:
+            _depth.write -= 1
+
+
+class Writer:
+    """
+    Ingest writer that owns the writer connection while open, grouping many games into each commit.
+
+    Each game is written inside `game()`, which rolls back only that game on error. Pending games are committed
+    once `batch_games` have accumulated or `batch_seconds` have passed since the last commit. While a writer is
+    open, `conn` contexts (and thus `with_cursor` functions) in its thread write into its transaction without
+    committing, and writes from other threads wait for it to close.
+    """
+
+    def __init__(self, batch_games: int = DEFAULT_BATCH_GAMES, batch_seconds: float = DEFAULT_BATCH_SECONDS):
+        self.batch_games = batch_games
+        self.batch_seconds = batch_seconds
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending = 0
+        self._last_commit = time.perf_counter()
+
+    def __repr__(self):
+        return f'Writer(batch_games={self.batch_games}, batch_seconds={self.batch_seconds}, pending={self._pending})'
+
+    def __enter__(self):
+        global _writer
+        _connections.write_lock.acquire()
+        if _writer is not None:
+            _connections.write_lock.release()
+            raise RuntimeError('another writer is already open')
+        self._conn = _connections.writer()
+        _writer = self
+        _depth.write += 1
+        self._last_commit = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _writer
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                logging.critical('error encountered, rolling back uncommitted games')
+                self._conn.rollback()
+                _rolled_back()
+        finally:
+            _depth.write -= 1
+            _writer = None
+            _connections.write_lock.release()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        return self._conn
+
+    @property
+    def pending(self) -> int:
+        """Number of games written since the last commit"""
+        return self._pending
+
+    @contextmanager
+    def game(self):
+        """Writes one game inside a savepoint, so that a failure only discards that game's rows."""
+        if not self._conn.in_transaction:
+            self._conn.execute('BEGIN')  # otherwise releasing the savepoint would commit
+        self._conn.execute('SAVEPOINT game')
+        try:
+            yield self._conn.cursor()
+        except BaseException:
+            self._conn.execute('ROLLBACK TO game')
+            self._conn.execute('RELEASE game')
+            _rolled_back()
+            raise
+        else:
+            self._conn.execute('RELEASE game')
+            self._pending += 1
+            if (self._pending >= self.batch_games
+                    or time.perf_counter() - self._last_commit >= self.batch_seconds):
+                self.commit()
+
+    def insert(self, table: str, rows: list[dict]):
+        """Inserts a batch of rows with identical keys into a table, ignoring rows that already exist."""
+        if not rows:
+            return
+        cols = list(rows[0])
+        with instrument.timed('db_write_seconds', table=table):
+            n = self._conn.executemany(f'INSERT INTO {table} ({", ".join(cols)}) '
+                                       f'VALUES ({", ".join(":" + c for c in cols)}) ON CONFLICT DO NOTHING',
+                                       rows).rowcount
+        instrument.rows(table, n)
+
+    def commit(self) -> int:
+        """Commits every pending game, returning how many were committed."""
+        committed = self._pending
+        with instrument.timed('db_commit_seconds'):
+            self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.perf_counter()
+        return committed
+
+
+def with_cursor(func=None, *, write: bool = True):
+    """
+    Passes a cursor to the decorated function as its first argument, in a `conn` context of the given intent, i.e.,
+    `@with_cursor` for functions that write and `@with_cursor(write=False)` for those that only read.
+    """
+    if func is None:
+        return lambda f: with_cursor(f, write=write)
+
+    def _with_cursor(*args, **kwargs):
+        with conn(write=write) as c:
+            res = func(c.cursor(), *args, **kwargs)
+        return res
+
+    return _with_cursor
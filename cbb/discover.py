@@ -0,0 +1,83 @@
+"""discover.py: Module for discovering every game of a season from the scoreboard, one page per date."""
+
+import asyncio
+import logging
+import sqlite3
+from datetime import date, timedelta
+from typing import Iterable
+from .database import with_cursor
+from .webscraper import get_page, registry
+from . import client, crawl, extract, instrument, jobs, parse, pbp
+
+SEASON_START = (11, 1)  # month and day of the first scoreboard date, in the fall before the season's year
+SEASON_END = (4, 10)  # month and day of the last, after the national championship
+DIVISION_I = 50  # scoreboard group of every Division I game
+
+
+def season_dates(season: int) -> list[date]:
+    """Every scoreboard date of a season, e.g., of 2024 from November 2023 through April 2024"""
+    start, end = date(season - 1, *SEASON_START), date(season, *SEASON_END)
+    return [start + timedelta(days=n) for n in range((end - start).days + 1)]
+
+
+def _scoreboard_url(day: date, group: int) -> str:
+    return f'{pbp.ESPN_HOME}/scoreboard/_/date/{day:%Y%m%d}/group/{group}'
+
+
+async def season_games_async(season: int, group: int = DIVISION_I) -> dict[int, dict]:
+    """
+    Fetches the scoreboard for every date of a season concurrently (bounded by the shared session's per-host limit
+    and rate limiter), returning each game once by gid, as a Games row with its status `state` (see
+    `parse.scoreboard_games`).
+    """
+    async def scoreboard(day: date) -> list[dict]:
+        page = get_page(_scoreboard_url(day, group))
+        content = await page.fetch()
+        page.release()
+        games = parse.scoreboard_games(content) if content is not None else None
+        if games is None:
+            logging.warning(f'No scoreboard for {day}')
+        return games or []
+
+    games = dict()
+    with registry():
+        try:
+            for day_games in await asyncio.gather(*map(scoreboard, season_dates(season))):
+                for game in day_games:
+                    games.setdefault(game['gid'], game)  # a game late at night is on the next date in UTC too
+        finally:
+            await client.close_async_session()
+    instrument.inc('games_discovered_total', len(games))
+    logging.info(f'Discovered {len(games)} games of the {season} season')
+    return games
+
+
+def season_games(season: int, group: int = DIVISION_I) -> dict[int, dict]:
+    """Synchronous entry point for `season_games_async`."""
+    return asyncio.run(season_games_async(season, group))
+
+
+@with_cursor
+def prefill(cursor: sqlite3.Cursor, games: Iterable[dict]) -> list[int]:
+    """
+    Registers the final games among those discovered in Games, ahead of ingesting them, returning their gid's.
+
+    Their ingest jobs are registered first, so that they are not taken for ingested games. Games that have not ended
+    are left out, as every game in Games is taken to have been played. This only seeds the job manifest and lets the
+    season's games be queried before their plays are in: ingesting a game still fetches every one of its pages and
+    rewrites its row from the game strip.
+    """
+    games = [game for game in games if game['state'] == extract.FINAL_STATE]
+    jobs.discover(game['gid'] for game in games)
+    with instrument.timed('db_write_seconds', table='Games'):
+        cursor.executemany('''INSERT INTO Games (gid, neutral, isconf, home, away, season, date)
+                              VALUES (:gid, :neutral, :isconf, :home, :away, :season, :date) ON CONFLICT DO NOTHING''',
+                           games)
+    instrument.rows('Games', cursor.rowcount)
+    return [game['gid'] for game in games]
+
+
+def crawl_season(season: int, group: int = DIVISION_I, **kwargs) -> crawl.CrawlStats:
+    """Discovers a season's games, prefills Games with the final ones and crawls those not ingested yet."""
+    gids = prefill(season_games(season, group).values())
+    return crawl.crawl(gids, assume_gid_from_pbp=True, **kwargs)
@@ -0,0 +1,194 @@
+"""export.py: Module for exporting tables to columnar `.npy` files partitioned by season, and memory-mapping them."""
+
+import json
+import shutil
+import sqlite3
+import numpy as np
+from pathlib import Path
+from .database import MODULE_DIR, conn
+
+EXPORT_DIR = MODULE_DIR / 'columns'  # default export directory
+DICTIONARY_FILE = 'dictionaries.json'
+CATEGORICAL = ('type', 'subtype')  # dictionary-encoded columns, code 0 is NULL
+
+# (column, dtype) per table; NULLs in integer columns are stored as the dtype's minimum (see `null_of`)
+PLAYS_COLUMNS = (
+    ('plyid', np.int32), ('gid', np.int32), ('tid', np.int32), ('period', np.int8), ('time_min', np.int8),
+    ('time_sec', np.int8), ('type', np.uint8), ('subtype', np.uint8), ('away_score', np.int16),
+    ('home_score', np.int16), ('pts_scored', np.int8), ('plyr', np.int32), ('plyr_ast', np.int32),
+    ('rel_ply', np.int32), ('x_coord', np.int32), ('y_coord', np.int32),
+)
+GAMES_COLUMNS = (
+    ('gid', np.int32), ('neutral', np.int8), ('isconf', np.int8), ('home', np.int32), ('away', np.int32),
+    ('date', 'datetime64[D]'), ('season', np.int16),
+)
+PLAYERS_COLUMNS = (
+    ('pid', np.int32), ('fname', str), ('lname', str), ('pos', str), ('htft', np.int8), ('htin', np.int8),
+    ('wt', np.int16),
+)
+TEAMS_COLUMNS = (
+    ('tid', np.int32), ('cid', np.int32), ('name', str), ('mascot', str),
+)
+
+
+def null_of(dtype) -> int | None:
+    """The sentinel that stands in for NULL in an integer column."""
+    dtype = np.dtype(dtype)
+    return int(np.iinfo(dtype).min) if dtype.kind == 'i' else None
+
+
+def _season_dir(directory: Path, season: int) -> Path:
+    return directory / f'season={season}'
+
+
+def _load_dictionaries(directory: Path) -> dict[str, list]:
+    path = directory / DICTIONARY_FILE
+    if not path.exists():
+        return {col: [None] for col in CATEGORICAL}
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def _to_array(values: tuple, dtype, dictionary: list | None = None) -> np.ndarray:
+    if dictionary is not None:
+        codes = {v: i for i, v in enumerate(dictionary)}
+        for v in values:
+            if v not in codes:
+                codes[v] = len(dictionary)
+                dictionary.append(v)
+        return np.fromiter((codes[v] for v in values), dtype=dtype, count=len(values))
+    null = null_of(dtype)
+    if null is not None:
+        return np.fromiter((null if v is None else v for v in values), dtype=dtype, count=len(values))
+    if dtype is str:
+        return np.array(['' if v is None else v for v in values], dtype=str)
+    return np.array(values, dtype=dtype)
+
+
+def _columns(cursor: sqlite3.Cursor, sql: str, params, columns: tuple, dictionaries: dict) -> dict[str, np.ndarray]:
+    rows = cursor.execute(sql, params).fetchall()
+    values = tuple(zip(*rows)) if rows else tuple(() for _ in columns)
+    return {col: _to_array(v, dtype, dictionaries.get(col)) for (col, dtype), v in zip(columns, values)}
+
+
+def _write_table(path: Path, arrays: dict[str, np.ndarray]):
+    path.mkdir(parents=True, exist_ok=True)
+    for col, arr in arrays.items():
+        np.save(path / f'{col}.npy', arr, allow_pickle=False)
+
+
+def _replace_dir(tmp: Path, dest: Path):
+    """Swaps a fully written directory into place, so readers never see a partial partition."""
+    old = dest.with_name(dest.name + '.old')
+    if dest.exists():
+        dest.rename(old)
+    tmp.rename(dest)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _signatures(games: dict[str, np.ndarray], plays: dict[str, np.ndarray]) -> dict[int, tuple[int, int]]:
+    """The number of plays and the last plyid of every exported game, which change whenever plays are added"""
+    signatures = dict.fromkeys(games['gid'].tolist(), (0, 0))
+    order = np.argsort(plays['gid'], kind='stable')
+    gids, starts, counts = np.unique(plays['gid'][order], return_index=True, return_counts=True)
+    if len(gids):
+        last = np.maximum.reduceat(plays['plyid'][order], starts)
+        signatures.update(zip(gids.tolist(), zip(counts.tolist(), last.tolist())))
+    return signatures
+
+
+def export(directory: str | Path = EXPORT_DIR) -> dict[int, int]:
+    """
+    Exports every game not exported yet or whose plays changed since (e.g., a game prefilled from the scoreboard
+    or ingested while in progress), returning the number of games exported per season.
+
+    Only seasons with such games are rewritten, and only those games' rows are read from the database. Players and
+    Teams are small and are rewritten in full.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    dictionaries = _load_dictionaries(directory)
+    exported = dict()
+    with conn(write=False) as c:
+        cursor = c.cursor()
+        cursor.row_factory = None  # plain tuples
+        seasons = [s for s, in cursor.execute('SELECT DISTINCT season FROM Games ORDER BY season')]
+        for season in seasons:
+            path = _season_dir(directory, season)
+            old = load_season(season, ('games', 'plays'), directory) if path.exists() else None
+            done = _signatures(old['games'], old['plays']) if old is not None else dict()
+            new = [gid for gid, *signature in cursor.execute('''SELECT G.gid, count(P.plyid), ifnull(max(P.plyid), 0)
+                                                               FROM Games G LEFT JOIN Plays P ON P.gid = G.gid
+                                                               WHERE G.season = ? GROUP BY G.gid''', (season,))
+                   if done.get(gid) != tuple(signature)]
+            if not new:
+                continue
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS ExportGids (gid INTEGER PRIMARY KEY)')
+            cursor.execute('DELETE FROM ExportGids')
+            cursor.executemany('INSERT INTO ExportGids (gid) VALUES (?)', ((gid,) for gid in new))
+            games = _columns(cursor, f'''SELECT {', '.join(f'G.{col}' for col, _ in GAMES_COLUMNS)}
+                                         FROM Games G JOIN ExportGids E ON G.gid = E.gid ORDER BY G.gid''',
+                             (), GAMES_COLUMNS, dictionaries)
+            plays = _columns(cursor, f'''SELECT {', '.join(f'P.{col}' for col, _ in PLAYS_COLUMNS)}
+                                         FROM Plays P JOIN ExportGids E ON P.gid = E.gid ORDER BY P.gid, P.plyid''',
+                             (), PLAYS_COLUMNS, dictionaries)
+            if old is not None:
+                # the rows of games exported again replace those exported before
+                keep_games, keep_plays = (~np.isin(old[table]['gid'], new) for table in ('games', 'plays'))
+                games = {col: np.concatenate((old['games'][col][keep_games], arr)) for col, arr in games.items()}
+                plays = {col: np.concatenate((old['plays'][col][keep_plays], arr)) for col, arr in plays.items()}
+                del old  # release the memory maps before replacing their files
+            tmp = path.with_name(path.name + '.tmp')
+            shutil.rmtree(tmp, ignore_errors=True)
+            _write_table(tmp / 'games', games)
+            _write_table(tmp / 'plays', plays)
+            _replace_dir(tmp, path)
+            exported[season] = len(new)
+        cursor.execute('DROP TABLE IF EXISTS temp.ExportGids')
+
+        for name, columns in (('players', PLAYERS_COLUMNS), ('teams', TEAMS_COLUMNS)):
+            arrays = _columns(cursor, f'SELECT {", ".join(col for col, _ in columns)} FROM {name.title()}',
+                              (), columns, dictionaries)
+            tmp = directory / f'{name}.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            _write_table(tmp, arrays)
+            _replace_dir(tmp, directory / name)
+
+    # dictionaries only ever grow, so partitions written before stay valid
+    with open(directory / DICTIONARY_FILE, 'w') as fp:
+        json.dump(dictionaries, fp)
+    return exported
+
+
+def _load_table(path: Path, mmap: bool = True) -> dict[str, np.ndarray]:
+    return {f.stem: np.load(f, mmap_mode='r' if mmap else None, allow_pickle=False) for f in sorted(path.glob('*.npy'))}
+
+
+def load_season(season: int, tables: tuple[str, ...] = ('games', 'plays'),
+                directory: str | Path = EXPORT_DIR) -> dict[str, dict[str, np.ndarray]]:
+    """Memory-maps the columns of a season's exported tables, without reading them into memory."""
+    path = _season_dir(Path(directory), season)
+    if not path.exists():
+        raise FileNotFoundError(f'season {season} has not been exported to {directory}')
+    return {table: _load_table(path / table) for table in tables}
+
+
+def load_table(name: str, directory: str | Path = EXPORT_DIR) -> dict[str, np.ndarray]:
+    """Loads an exported table that is not partitioned by season (`players` or `teams`)."""
+    return _load_table(Path(directory) / name, mmap=False)
+
+
+def exported_seasons(directory: str | Path = EXPORT_DIR) -> list[int]:
+    return sorted(int(p.name.removeprefix('season=')) for p in Path(directory).glob('season=*')
+                  if p.name.removeprefix('season=').isdigit())
+
+
+def dictionary(column: str, directory: str | Path = EXPORT_DIR) -> list:
+    """The values of a dictionary-encoded column, indexed by code."""
+    return _load_dictionaries(Path(directory))[column]
+
+
+def code(column: str, value: str | None, directory: str | Path = EXPORT_DIR) -> int:
+    """The code of a value in a dictionary-encoded column, or -1 if the value never occurs."""
+    values = dictionary(column, directory)
+    return values.index(value) if value in values else -1
@@ -0,0 +1,138 @@
+"""extract.py: Module for extracting the page-state JSON that ESPN embeds in its pages."""
+
+import json
+import logging
+from typing import Any
+from . import instrument
+
+STATE_MARKER = b"window['__espnfitt__']="  # assignment of the page-state document in an inline script
+STATE_END = b';</script>'
+FINAL_STATE = 'post'  # status state of a game strip once the game has ended
+
+_decoder = json.JSONDecoder()
+
+
+def page_state(content: bytes) -> dict | None:
+    """Finds the embedded page-state document in the raw page bytes and decodes it once."""
+    start = content.find(STATE_MARKER)
+    if start < 0:
+        return None
+    start += len(STATE_MARKER)
+    end = content.find(STATE_END, start)
+    try:
+        with instrument.timed('extract_seconds', what='state'):
+            return json.loads(content[start:end if end >= 0 else None])
+    except json.JSONDecodeError as e:
+        logging.warning(f'Embedded page state could not be decoded: {e}')
+        return None
+
+
+def find(doc: Any, key: str) -> Any:
+    """Returns the value of the first occurrence of `key` in a decoded document (depth-first), if any."""
+    stack = [doc]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if key in node:
+                return node[key]
+            stack.extend(reversed(node.values()))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+    return None
+
+
+def _raw_find(content: bytes, key: str) -> Any:
+    """Decodes only the JSON value following the first `"key":`, e.g., for pages without a page-state assignment."""
+    start = content.find(f'"{key}":'.encode())
+    if start < 0:
+        return None
+    text = content[start + len(key) + 3:].decode(errors='replace').lstrip()
+    try:
+        return _decoder.raw_decode(text)[0]
+    except json.JSONDecodeError:
+        return None
+
+
+def game_package(content: bytes) -> dict | None:
+    """
+    Retrieves the game package of a game page, which holds (among others) the keys:
+
+        gmStrp: game strip, with the date, venue flags and both teams
+        pbp: play-by-play, with the plays grouped by period under `playGrps`
+        shtChrt: shot chart, with the coordinates of each shot under `plays`
+    """
+    state = page_state(content)
+    if state is not None:
+        pkg = state.get('page', {}).get('content', {}).get('gamepackage')
+        if pkg is None:
+            pkg = find(state, 'gamepackage')
+        return pkg
+    pkg = {key: _raw_find(content, key) for key in ('gmStrp', 'pbp', 'shtChrt')}
+    return pkg if pkg['gmStrp'] is not None else None
+
+
+def strip_state(gm_strp: dict) -> str | None:
+    """The status state of a game strip, `pre`, `in` or `post` once final, or None if it has none"""
+    status = gm_strp.get('status')
+    return status.get('state') if isinstance(status, dict) else None
+
+
+def game_state(content: bytes) -> str | None:
+    """
+    The status state of a game page's game strip (see `strip_state`), decoding only the strip rather than the whole
+    page state, e.g., for the response cache to tell whether a page can expire as it stores it
+    """
+    gm_strp = _raw_find(content, 'gmStrp')
+    return strip_state(gm_strp) if isinstance(gm_strp, dict) else None
+
+
+def is_final(content: bytes) -> bool:
+    """Whether a game page is of a game that has ended"""
+    return game_state(content) == FINAL_STATE
+
+
+def game_tids(gm_strp: dict) -> list[str]:
+    """Retrieves the tid's for the away[0] and home[1] teams from the game strip, if both have team pages"""
+    tids = {}
+    for tm in gm_strp.get('tms', []):
+        # teams without an ESPN team page (e.g., non-DI teams) are not linked
+        if '/team/_/id/' in str(tm.get('links', '')):
+            tids['home' if tm.get('isHome') else 'away'] = str(tm['id'])
+    if len(tids) < 2:
+        return []
+    return [tids['away'], tids['home']]
+
+
+def scoreboard_events(content: bytes) -> list[dict] | None:
+    """
+    Retrieves the events (i.e., games) of a scoreboard page, each of which holds (among others) the keys:
+
+        id: the gid
+        date: the start time in UTC
+        competitors: both teams, with their id and whether they are home
+        status: with its state, `pre`, `in` or `post` once final
+        neutralSite, isConferenceGame: the venue flags, as in the game strip
+    """
+    state = page_state(content)
+    if state is None:
+        return None
+    sb = state.get('page', {}).get('content', {}).get('scoreboard')
+    evts = sb.get('evts') if isinstance(sb, dict) else find(state, 'evts')
+    return evts if isinstance(evts, list) else None
+
+
+def player_header(content: bytes) -> dict | None:
+    """
+    Retrieves the athlete data from the header of a player page.
+
+    Only the header is decoded, rather than the whole page state, so a prefix of the page holding it is enough.
+    """
+    hdr = _raw_find(content, 'plyrHdr')
+    if hdr is None:
+        return None
+    return hdr.get('ath')
+
+
+def has_player_header(content: bytes) -> bool:
+    """Whether a prefix of a player page holds its whole header, after which the rest of the page need not be read"""
+    return _raw_find(content, 'plyrHdr') is not None
@@ -0,0 +1,163 @@
+"""instrument.py: Module with the in-process counters and latency histograms of the ingest pipeline."""
+
+import json
+import bisect
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+PREFIX = 'cbb_'  # of every exported metric name
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.)  # seconds
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """Counts of observations at or below each bucket bound, with their sum, as exported by Prometheus."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.sum = 0.
+        self.count = 0
+
+    def __repr__(self):
+        return f'Histogram(count={self.count}, sum={self.sum:.3f})'
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """The count of observations at or below each bound, as (le, count)"""
+        out, total = [], 0
+        for bound, n in zip((*map(repr, self.buckets), '+Inf'), self.counts):
+            total += n
+            out.append((bound, total))
+        return out
+
+
+class Instruments:
+    """
+    Counters and histograms by name and labels.
+
+    Recording takes a lock and a dict lookup, a few microseconds at most, and is only done per request, page, game
+    or statement, so it is negligible next to what it measures. Histograms have fixed buckets, so memory does not
+    grow with the number of observations either. Metrics recorded in worker processes (e.g., while parsing in a
+    crawl's pool) stay in those processes, so what they measure is sent back with their results and recorded here
+    (see `parse.record_plays`).
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.counters: dict[str, dict[Labels, float]] = dict()
+        self.histograms: dict[str, dict[Labels, Histogram]] = dict()
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'Instruments(counters={len(self.counters)}, histograms={len(self.histograms)})'
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.histograms.setdefault(name, dict())
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters, self.histograms = dict(), dict()
+            self.started = time.time()
+
+    def snapshot(self) -> dict:
+        """Every metric as plain JSON-serializable data"""
+        with self._lock:
+            return {
+                'started': self.started,
+                'time': time.time(),
+                'counters': {name: [{'labels': dict(key), 'value': value} for key, value in series.items()]
+                             for name, series in self.counters.items()},
+                'histograms': {name: [{'labels': dict(key), 'count': h.count, 'sum': h.sum,
+                                       'buckets': dict(h.cumulative())} for key, h in series.items()]
+                               for name, series in self.histograms.items()},
+            }
+
+    def prometheus(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f'# TYPE {PREFIX}{name} counter')
+                lines.extend(f'{PREFIX}{name}{_labels(key)} {value}' for key, value in series.items())
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f'# TYPE {PREFIX}{name} histogram')
+                for key, h in series.items():
+                    lines.extend(f'{PREFIX}{name}_bucket{_labels(key + (("le", le),))} {n}'
+                                 for le, n in h.cumulative())
+                    lines.append(f'{PREFIX}{name}_sum{_labels(key)} {h.sum}')
+                    lines.append(f'{PREFIX}{name}_count{_labels(key)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str | Path):
+        """Writes every metric to a file, as a JSON snapshot if it ends in `.json` or as Prometheus text otherwise."""
+        path = Path(path)
+        text = json.dumps(self.snapshot(), indent=2) if path.suffix == '.json' else self.prometheus()
+        tmp = path.with_name(f'{path.name}.tmp')
+        tmp.write_text(text)
+        tmp.replace(path)  # so that a scraper never reads a partial file
+
+
+def _labels(key: Labels) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in key) + '}'
+
+
+_instruments = Instruments()  # singular global instruments
+
+
+def instruments() -> Instruments:
+    return _instruments
+
+
+def inc(name: str, amount: float = 1, **labels):
+    _instruments.inc(name, amount, **labels)
+
+
+def observe(name: str, value: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels):
+    _instruments.observe(name, value, buckets, **labels)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """Observes how long the block takes in a latency histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _instruments.observe(name, time.perf_counter() - start, **labels)
+
+
+def rows(table: str, n: int):
+    """Counts rows written to a table (negative counts, e.g., of a statement without a row count, are skipped)"""
+    if n > 0:
+        _instruments.inc('db_rows_total', n, table=table)
+
+
+def write(path: str | Path):
+    _instruments.write(path)
@@ -0,0 +1,87 @@
+"""jobs.py: Module with the ingest job manifest, tracking every gid from discovery to its committed rows."""
+
+import sqlite3
+from typing import Iterable
+from .database import with_cursor
+
+# states of an ingest job, in the order a successful ingest moves through them
+DISCOVERED = 'discovered'
+FETCHED = 'fetched'
+PARSED = 'parsed'
+COMMITTED = 'committed'
+FAILED = 'failed'
+STATES = (DISCOVERED, FETCHED, PARSED, COMMITTED, FAILED)
+
+MAX_ERROR_LENGTH = 500  # characters of an error kept with a failed job
+
+
+@with_cursor
+def discover(cursor: sqlite3.Cursor, gids: Iterable[int]) -> int:
+    """
+    Registers jobs for the gids that have none yet, returning how many were new.
+
+    Games stored before jobs were tracked are registered as committed.
+    """
+    before = cursor.connection.total_changes
+    cursor.executemany(f'''INSERT INTO IngestJobs (gid, state)
+                           SELECT :gid, CASE WHEN EXISTS(SELECT 1 FROM Games WHERE gid = :gid)
+                                             THEN '{COMMITTED}' ELSE '{DISCOVERED}' END
+                           WHERE true -- disambiguates the upsert clause from a join constraint
+                           ON CONFLICT DO NOTHING''',
+                       ({'gid': int(gid)} for gid in gids))
+    return cursor.connection.total_changes - before
+
+
+@with_cursor
+def mark(cursor: sqlite3.Cursor, gid: int, state: str, error: str | BaseException | None = None):
+    """
+    Moves a job to a state, recording the error of a failure.
+
+    A job moving on from any state but fetched or parsed starts a new attempt, so `attempts` counts every time the
+    game was tried, whether it failed while fetching, parsing or writing.
+    """
+    if state not in STATES:
+        raise ValueError(f'unknown state {state!r}, expected one of {STATES}')
+    if isinstance(error, BaseException):
+        error = repr(error)
+    cursor.execute(f'''INSERT INTO IngestJobs (gid, state, attempts, error)
+                       VALUES (:gid, :state, :state != '{DISCOVERED}', :error)
+                       ON CONFLICT (gid) DO UPDATE
+                       SET attempts = attempts + (state NOT IN ('{FETCHED}', '{PARSED}')),
+                           state = excluded.state, error = excluded.error, updated = datetime('now')''',
+                   {'gid': int(gid), 'state': state, 'error': error[:MAX_ERROR_LENGTH] if error else None})
+
+
+def fail(gid: int, error: str | BaseException):
+    mark(gid, FAILED, error)
+
+
+@with_cursor(write=False)
+def state(cursor: sqlite3.Cursor, gid: int) -> str | None:
+    row = cursor.execute('SELECT state FROM IngestJobs WHERE gid = :gid', {'gid': int(gid)}).fetchone()
+    return row['state'] if row is not None else None
+
+
+@with_cursor(write=False)
+def committed(cursor: sqlite3.Cursor) -> set[int]:
+    """The gids of every committed job"""
+    return {row['gid'] for row in cursor.execute('SELECT gid FROM IngestJobs WHERE state = :state',
+                                                 {'state': COMMITTED})}
+
+
+@with_cursor(write=False)
+def incomplete(cursor: sqlite3.Cursor, max_attempts: int | None = None) -> list[int]:
+    """The gids of every job not committed yet, optionally only those tried fewer than `max_attempts` times"""
+    return [row['gid'] for row in cursor.execute('''SELECT gid FROM IngestJobs
+                                                     WHERE state != :state AND (:max IS NULL OR attempts < :max)
+                                                     ORDER BY gid''',
+                                                 {'state': COMMITTED, 'max': max_attempts})]
+
+
+@with_cursor(write=False)
+def summary(cursor: sqlite3.Cursor) -> dict[str, int]:
+    """The number of jobs in each state"""
+    counts = dict.fromkeys(STATES, 0)
+    for row in cursor.execute('SELECT state, count(*) AS n FROM IngestJobs GROUP BY state'):
+        counts[row['state']] = row['n']
+    return counts
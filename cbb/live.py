@@ -0,0 +1,146 @@
+"""live.py: Module for following games in progress, appending their new plays as they happen."""
+
+import random
+import asyncio
+import logging
+import aiohttp
+from typing import Iterable, Union
+from .webscraper import GamePage, registry
+from . import client, jobs, pbp, parse
+
+POLL_INTERVAL = 15.  # seconds between polls of a game
+POLL_JITTER = 0.2  # fraction of the interval each poll is moved by at random, so polls of many games spread out
+
+
+class LiveGame:
+    """
+    A game being followed: the validators of the last play-by-play page seen, so that unchanged pages are answered
+    with 304 Not Modified, and the parsing state after its stored plays, so that only newer plays are parsed.
+
+    The first poll is unconditional, and finds the game final if it already was.
+    """
+
+    def __init__(self, gid: Union[str, int]):
+        self.gid = int(gid)
+        self.etag: str | None = None
+        self.last_modified: str | None = None
+        self.state: parse.PlayState | None = None
+        self.context: tuple[dict[str, dict], dict[int, dict[str, int]]] | None = None
+        self.final = False
+        self.polls = 0
+        self.inserted = 0
+
+    def __repr__(self):
+        return (f'LiveGame(gid={self.gid}, plyid={self.state.plyid if self.state else None}, '
+                f'inserted={self.inserted}, final={self.final})')
+
+    @property
+    def url(self) -> str:
+        return GamePage.URL_TEMPLATE.format('playbyplay', self.gid)
+
+    def _validate(self, resp: client.Response):
+        self.etag = resp.headers.get('ETag')
+        self.last_modified = resp.headers.get('Last-Modified')
+
+    def _conditional_headers(self) -> dict[str, str]:
+        headers = dict()
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def _resume(self) -> bool:
+        """Picks up from the plays stored for the game, returning whether its teams are registered"""
+        self.context = pbp.game_context(self.gid)
+        self.state = pbp.play_state(self.gid)
+        return self.context is not None
+
+    async def start(self, session: aiohttp.ClientSession | None = None) -> bool:
+        """
+        Ingests the game so far if it is not stored yet, returning whether it can be followed.
+
+        The game's ingest job stays parsed while it is in progress, and is committed once it is final (see `poll`),
+        so that a game no longer followed before it ends is picked up by `crawl.resume`.
+        """
+        jobs.discover([self.gid])
+        if jobs.state(self.gid) != jobs.COMMITTED:  # rather than whether it is in Games, which may be prefilled
+            fetched = await pbp.fetch_game(self.gid, session)
+            if fetched is None:
+                return False
+            pbp.write_game(fetched[0], self.gid)
+            self.final = fetched[0]['final']
+        if not self._resume():
+            logging.warning(f'Teams for {self.gid=} are not registered, can\'t follow it')
+            return False
+        return True
+
+    async def poll(self, session: aiohttp.ClientSession | None = None) -> int:
+        """Fetches the play-by-play page if it changed and appends its new plays, returning how many were stored."""
+        self.polls += 1
+        resp = await client.fetch(self.url, session, self._conditional_headers())
+        if resp.status == 304:
+            return 0
+        if resp.status != 200:
+            logging.warning(f'Polling {self.gid=} failed ({resp.status}: {resp.reason})')
+            return 0
+        self._validate(resp)
+        loop = asyncio.get_running_loop()
+        parsed = await loop.run_in_executor(None, parse.parse_plays, self.gid, resp.content, self.state)
+        if parsed is None:
+            logging.warning(f'Play by play data is not available for {self.gid=}')
+            return 0  # polled again rather than committed without its last plays
+        plays, self.final = parsed
+        inserted = 0
+        if plays:
+            try:
+                inserted = pbp.append_plays(self.gid, plays, self.context)  # one transaction per poll
+            except Exception:
+                # the state already moved past the plays that were rolled back
+                self.etag, self.last_modified = None, None
+                self.final = False
+                self._resume()
+                raise
+            self.inserted += inserted
+        if self.final and jobs.state(self.gid) != jobs.COMMITTED:
+            jobs.mark(self.gid, jobs.COMMITTED)  # every play of the game is stored
+        return inserted
+
+
+async def _follow(game: LiveGame, session: aiohttp.ClientSession, interval: float):
+    await asyncio.sleep(random.uniform(0, interval))  # spread the first polls over the interval
+    while not game.final:
+        try:
+            inserted = await game.poll(session)
+        except Exception as e:
+            logging.error(f'Polling {game.gid=} failed: {e!r}')
+        else:
+            if inserted:
+                logging.info(f'Appended {inserted} plays to {game.gid=}')
+        if not game.final:
+            await asyncio.sleep(interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER))
+    logging.info(f'Finished following {game}')
+
+
+async def watch_async(gids: Iterable[Union[str, int]], interval: float = POLL_INTERVAL) -> list[LiveGame]:
+    """
+    Follows games until they are final, polling each every `interval` seconds and appending their new plays.
+
+    Games not yet stored are ingested first. Every poll is a conditional request, so games without new plays cost
+    a 304 and no parsing, and all games share one session and rate limiter, so one process can follow hundreds.
+    """
+    games = [LiveGame(gid) for gid in dict.fromkeys(str(gid) for gid in gids)]
+    with registry():
+        session = client.async_session()
+        try:
+            started = await asyncio.gather(*(game.start(session) for game in games))
+            await asyncio.gather(*(_follow(game, session, interval)
+                                   for game, ok in zip(games, started) if ok and not game.final))
+        finally:
+            await client.close_async_session()
+    return games
+
+
+def watch(gids: Iterable[Union[str, int]], interval: float = POLL_INTERVAL) -> list[LiveGame]:
+    """Synchronous entry point for `watch_async`."""
+    return asyncio.run(watch_async(gids, interval))
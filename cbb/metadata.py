@@ -0,0 +1,113 @@
+"""metadata.py: Module with the in-process cache of teams, conferences and rosters, warmed from the database."""
+
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable, TypeVar
+from . import database
+
+T = TypeVar('T')
+
+
+class MetadataCache:
+    """
+    Teams, conferences and roster ids, loaded once from the database and then kept up to date by the code that
+    inserts them (write-through), so resolving a known team costs no SQL or HTTP.
+
+    Lookups of the same missing key made concurrently are collapsed by `once`, and the cache is cleared whenever
+    the database rolls back, since rolled back rows (and their autoincremented ids) may be gone.
+    """
+
+    def __init__(self):
+        self.teams: dict[int, dict] = dict()
+        self.conferences: dict[int, dict] = dict()
+        self.rosters: dict[tuple[int, int], int] = dict()
+        self.warm = False
+        self._lock = threading.Lock()
+        self._inflight: dict[Hashable, Future] = dict()
+
+    def __repr__(self):
+        return (f'MetadataCache(teams={len(self.teams)}, conferences={len(self.conferences)}, '
+                f'rosters={len(self.rosters)}, warm={self.warm})')
+
+    def load(self, cursor: sqlite3.Cursor):
+        """Loads every team, conference and roster from the database."""
+        teams = {row['tid']: dict(row) for row in cursor.execute('SELECT tid, cid, name, mascot FROM Teams')}
+        conferences = {row['cid']: dict(row) for row in cursor.execute('SELECT cid, name, abbrev FROM Conferences')}
+        rosters = {(row['tid'], row['season']): row['rid']
+                   for row in cursor.execute('SELECT rid, tid, season FROM Rosters')}
+        with self._lock:
+            self.teams, self.conferences, self.rosters = teams, conferences, rosters
+            self.warm = True
+        logging.info(f'Warmed {self}')
+
+    def warmed(self, cursor: sqlite3.Cursor) -> 'MetadataCache':
+        """The cache, loading it first if it is cold."""
+        if not self.warm:
+            self.load(cursor)
+        return self
+
+    def clear(self):
+        with self._lock:
+            self.teams, self.conferences, self.rosters = dict(), dict(), dict()
+            self.warm = False
+
+    def team(self, tid: int) -> dict | None:
+        return self.teams.get(int(tid))
+
+    def put_team(self, team: dict):
+        self.teams[int(team['tid'])] = team
+
+    def conference(self, cid: int) -> dict | None:
+        return self.conferences.get(int(cid))
+
+    def put_conference(self, conference: dict):
+        self.conferences[int(conference['cid'])] = conference
+
+    def rid(self, tid: int, season: int) -> int | None:
+        return self.rosters.get((int(tid), int(season)))
+
+    def put_rid(self, tid: int, season: int, rid: int):
+        self.rosters[(int(tid), int(season))] = rid
+
+    def once(self, key: Hashable, func: Callable[[], T]) -> T:
+        """Runs `func` for a key, or waits on the call already running for it and shares its result."""
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            res = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(res)
+            return res
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+_metadata = MetadataCache()  # singular global metadata cache
+database.on_rollback(_metadata.clear)
+
+
+def metadata() -> MetadataCache:
+    return _metadata
+
+
+def warmed(cursor: sqlite3.Cursor) -> MetadataCache:
+    """The global cache, loaded from the database on first use."""
+    return _metadata.warmed(cursor)
+
+
+@database.with_cursor
+def warm(cursor: sqlite3.Cursor) -> MetadataCache:
+    """(Re)loads the metadata cache from the database, e.g., at the start of a crawl."""
+    _metadata.load(cursor)
+    return _metadata
@@ -0,0 +1,216 @@
+"""metrics.py: Module for computing advanced team and player metrics over a season with vectorized array operations."""
+
+import numpy as np
+from pathlib import Path
+from .database import conn
+from . import export
+
+FT_POSS_FACTOR = 0.475  # share of free throw attempts that end a possession in college basketball
+REGULATION_MINUTES = 40
+OT_MINUTES = 5
+_KEY_BASE = 1_000_000  # tid's are below this, so gid * _KEY_BASE + tid identifies a team in a game
+
+THREE_SUBTYPES = ('3PJ', '3FG')
+PLAY_COLUMNS = ('gid', 'tid', 'period', 'type', 'subtype', 'pts_scored', 'plyr', 'plyr_ast')
+
+
+def _is(arr: np.ndarray, values: tuple, dictionary: list | None) -> np.ndarray:
+    """Vectorized membership test for a (possibly dictionary-encoded) categorical column."""
+    if dictionary is not None:
+        values = [dictionary.index(v) for v in values if v in dictionary]
+    return np.isin(arr, values)
+
+
+def _from_db(season: int) -> tuple[dict, dict, dict]:
+    with conn(write=False) as c:
+        cursor = c.cursor()
+        cursor.row_factory = None  # plain tuples
+        rows = cursor.execute('''SELECT P.gid, ifnull(P.tid, -1), P.period, P.type, ifnull(P.subtype, ''),
+                                        ifnull(P.pts_scored, 0), ifnull(P.plyr, -1), ifnull(P.plyr_ast, -1)
+                                 FROM Plays P JOIN Games G ON P.gid = G.gid
+                                 WHERE G.season = ?''', (season,)).fetchall()
+        games = cursor.execute('SELECT gid, home, away FROM Games WHERE season = ? ORDER BY gid', (season,)).fetchall()
+    cols = tuple(zip(*rows)) if rows else tuple(() for _ in PLAY_COLUMNS)
+    plays = {col: np.array(v, dtype='U3' if col in export.CATEGORICAL else np.int64)
+             for col, v in zip(PLAY_COLUMNS, cols)}
+    cols = tuple(zip(*games)) if games else ((), (), ())
+    games = {col: np.array(v, dtype=np.int64) for col, v in zip(('gid', 'home', 'away'), cols)}
+    return plays, games, {col: None for col in export.CATEGORICAL}
+
+
+def _from_export(season: int, directory: str | Path) -> tuple[dict, dict, dict]:
+    data = export.load_season(season, ('games', 'plays'), directory)
+    plays = dict()
+    for col in PLAY_COLUMNS:
+        arr = data['plays'][col]
+        if col in export.CATEGORICAL:
+            plays[col] = np.asarray(arr)
+        else:
+            null = export.null_of(arr.dtype)
+            arr = np.asarray(arr, dtype=np.int64)
+            plays[col] = np.where(arr == null, 0 if col == 'pts_scored' else -1, arr)
+    order = np.argsort(data['games']['gid'])
+    games = {col: np.asarray(data['games'][col], dtype=np.int64)[order] for col in ('gid', 'home', 'away')}
+    dictionaries = {col: export.dictionary(col, directory) for col in export.CATEGORICAL}
+    return plays, games, dictionaries
+
+
+def load(season: int, source: str = 'db', directory: str | Path = export.EXPORT_DIR) -> tuple[dict, dict, dict]:
+    """
+    Loads a season's plays and games into arrays from the database (`source='db'`) or a columnar export
+    (`source='export'`), returning the plays, the games and the dictionaries of the categorical columns.
+
+    NULL ids are loaded as -1 and NULL points as 0.
+    """
+    match source:
+        case 'db':
+            return _from_db(season)
+        case 'export':
+            return _from_export(season, directory)
+    raise ValueError(f'unknown source {source!r}, expected "db" or "export"')
+
+
+def _counts(plays: dict, dictionaries: dict) -> dict[str, np.ndarray]:
+    """Per-play indicator columns for every counted event."""
+    type_, subtype, pts = plays['type'], plays['subtype'], plays['pts_scored']
+    sht = _is(type_, ('SHT',), dictionaries['type'])
+    ft = sht & _is(subtype, ('1FT',), dictionaries['subtype'])
+    fg = sht & ~ft
+    reb = _is(type_, ('REB',), dictionaries['type'])
+    return {
+        'pts': np.where(sht, pts, 0),
+        'fga': fg,
+        'fgm': fg & (pts > 0),
+        'fg3m': fg & (pts > 0) & _is(subtype, THREE_SUBTYPES, dictionaries['subtype']),
+        'fta': ft,
+        'ftm': ft & (pts > 0),
+        'oreb': reb & _is(subtype, ('OFF',), dictionaries['subtype']),
+        'dreb': reb & _is(subtype, ('DEF',), dictionaries['subtype']),
+        'tov': _is(type_, ('TOV',), dictionaries['type']),
+    }
+
+
+def _sum_by(inv: np.ndarray, n: int, counts: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    return {k: np.bincount(inv, weights=v, minlength=n) for k, v in counts.items()}
+
+
+def _possessions(box: dict) -> np.ndarray:
+    return box['fga'] - box['oreb'] + box['tov'] + FT_POSS_FACTOR * box['fta']
+
+
+def _ratio(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, num / den, np.nan)
+
+
+def team_games(plays: dict, games: dict, dictionaries: dict) -> dict[str, np.ndarray]:
+    """Box score, possessions and opponent box score of every team in every game."""
+    counted = plays['tid'] >= 0
+    gid, tid = plays['gid'][counted], plays['tid'][counted]
+    keys, inv = np.unique(gid * _KEY_BASE + tid, return_inverse=True)
+    box = _sum_by(inv, len(keys), {k: v[counted] for k, v in _counts(plays, dictionaries).items()})
+    tg = {'gid': keys // _KEY_BASE, 'tid': keys % _KEY_BASE, **box}
+
+    # minutes from the last period played in each game
+    g_keys, g_inv = np.unique(plays['gid'], return_inverse=True)
+    last_period = np.zeros(len(g_keys), dtype=np.int64)
+    np.maximum.at(last_period, g_inv, plays['period'])
+    minutes = REGULATION_MINUTES + OT_MINUTES * np.maximum(last_period - 2, 0)
+    tg['minutes'] = minutes[np.searchsorted(g_keys, tg['gid'])]
+
+    # opponent via the game's home and away teams
+    game_idx = np.searchsorted(games['gid'], tg['gid'])
+    game_idx = np.minimum(game_idx, len(games['gid']) - 1)
+    opp = games['home'][game_idx] + games['away'][game_idx] - tg['tid']
+    opp_idx = np.searchsorted(keys, tg['gid'] * _KEY_BASE + opp)
+    opp_idx = np.minimum(opp_idx, len(keys) - 1)
+    has_opp = (keys[opp_idx] == tg['gid'] * _KEY_BASE + opp) & (games['gid'][game_idx] == tg['gid'])
+    tg['poss'] = _possessions(box)
+    for k in ('pts', 'oreb', 'dreb', 'poss'):
+        tg[f'opp_{k}'] = np.where(has_opp, tg[k][opp_idx], 0)
+    tg['has_opp'] = has_opp
+    tg['game_poss'] = np.where(has_opp, (tg['poss'] + tg['opp_poss']) / 2, tg['poss'])
+    return tg
+
+
+def _team_rates(box: dict) -> dict[str, np.ndarray]:
+    return {
+        'efg': _ratio(box['fgm'] + 0.5 * box['fg3m'], box['fga']),
+        'tov_pct': _ratio(box['tov'], box['poss']),
+        'orb_pct': _ratio(box['oreb'], box['oreb'] + box['opp_dreb']),
+        'ft_rate': _ratio(box['fta'], box['fga']),
+        'ortg': 100 * _ratio(box['pts'], box['game_poss']),
+        'drtg': 100 * _ratio(box['opp_pts'], box['game_poss']),
+        'pace': REGULATION_MINUTES * _ratio(box['game_poss'], box['minutes']),
+    }
+
+
+def team_metrics(season: int, source: str = 'db', directory: str | Path = export.EXPORT_DIR) -> dict[str, np.ndarray]:
+    """
+    Computes season totals and advanced metrics for every team:
+
+        poss: possessions (FGA - OREB + TOV + 0.475 FTA)
+        efg: effective field goal percentage, (FGM + 0.5 3PM) / FGA
+        tov_pct: turnovers per possession
+        orb_pct: share of offensive rebound chances grabbed, OREB / (OREB + opponent DREB)
+        ft_rate: free throw attempts per field goal attempt
+        ortg, drtg: points scored and allowed per 100 possessions (averaged with the opponent's)
+        pace: possessions per 40 minutes
+    """
+    plays, games, dictionaries = load(season, source, directory)
+    tg = team_games(plays, games, dictionaries)
+    tids, inv = np.unique(tg['tid'], return_inverse=True)
+    sums = _sum_by(inv, len(tids), {k: v for k, v in tg.items() if k not in ('gid', 'tid', 'has_opp')})
+    sums['games'] = np.bincount(inv, minlength=len(tids))
+    return {'tid': tids, **sums, **_team_rates(sums)}
+
+
+def player_metrics(season: int, source: str = 'db', directory: str | Path = export.EXPORT_DIR) -> dict[str, np.ndarray]:
+    """
+    Computes season totals and advanced metrics for every player credited with a play.
+
+    Without minutes played, team-dependent metrics are taken over the games a player appears in:
+
+        poss: individual possessions used (FGA + 0.475 FTA + TOV)
+        efg, ft_rate: as for teams
+        tov_pct: turnovers per individual possession
+        orb_pct: OREB / (team OREB + opponent DREB) in the player's games
+        ortg: points per 100 individual possessions
+        drtg, pace: the team's, over the player's games
+    """
+    plays, games, dictionaries = load(season, source, directory)
+    tg = team_games(plays, games, dictionaries)
+    counts = _counts(plays, dictionaries)
+
+    credited = plays['plyr'] >= 0
+    pids, inv = np.unique(plays['plyr'][credited], return_inverse=True)
+    box = _sum_by(inv, len(pids), {k: v[credited] for k, v in counts.items()})
+    ast_pids = plays['plyr_ast'][plays['plyr_ast'] >= 0]
+    ast_idx = np.searchsorted(pids, ast_pids)
+    known = (ast_idx < len(pids)) & (pids[np.minimum(ast_idx, len(pids) - 1)] == ast_pids)
+    box['ast'] = np.bincount(ast_idx[known], minlength=len(pids))
+    box['poss'] = box['fga'] + FT_POSS_FACTOR * box['fta'] + box['tov']
+
+    # team context over each player's appearances (unique player and team-game)
+    in_team = credited & (plays['tid'] >= 0)
+    tg_keys = tg['gid'] * _KEY_BASE + tg['tid']
+    tg_idx = np.searchsorted(tg_keys, plays['gid'][in_team] * _KEY_BASE + plays['tid'][in_team])
+    app = np.unique(plays['plyr'][in_team] * len(tg_keys) + tg_idx)
+    app_pid = np.searchsorted(pids, app // len(tg_keys))
+    app_tg = app % len(tg_keys)
+    ctx = _sum_by(app_pid, len(pids),
+                  {k: tg[k][app_tg] for k in ('oreb', 'opp_dreb', 'opp_pts', 'game_poss', 'minutes')})
+    games_played = np.bincount(app_pid, minlength=len(pids))
+
+    return {
+        'pid': pids,
+        'games': games_played,
+        **box,
+        'efg': _ratio(box['fgm'] + 0.5 * box['fg3m'], box['fga']),
+        'tov_pct': _ratio(box['tov'], box['poss']),
+        'orb_pct': _ratio(box['oreb'], ctx['oreb'] + ctx['opp_dreb']),
+        'ft_rate': _ratio(box['fta'], box['fga']),
+        'ortg': 100 * _ratio(box['pts'], box['poss']),
+        'drtg': 100 * _ratio(ctx['opp_pts'], ctx['game_poss']),
+        'pace': REGULATION_MINUTES * _ratio(ctx['game_poss'], ctx['minutes']),
+    }
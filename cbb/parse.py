@@ -0,0 +1,345 @@
+"""parse.py: Module with pure functions from raw page bytes to row dicts, safe to run in worker processes."""
+
+import re
+import time
+from datetime import datetime
+from bs4 import BeautifulSoup
+from .classify import classify
+from . import extract, instrument
+
+ABBREV_SHOT_SUBTYPES = (
+    ('3PJ', 'Three Point Jumper'),
+    ('3FG', ''),  # fall-through for generic 3-pointer
+    ('2PJ', 'Jumper'),
+    ('2PL', 'Layup'),
+    ('2PD', 'Dunk'),
+    ('2PT', 'Two Point Tip Shot'),
+    ('2PH', 'Hook Shot'),
+    ('2FG', ''),  # fall-through for generic 2-pointer
+    ('1FT', 'Free Throw'),
+)
+
+ABBREV_REB_SUBTYPES = (
+    ('OFF', 'Offensive'),
+    ('DEF', 'Defensive'),
+    ('DBT', 'Deadball Team')
+)
+
+ABBREV_POS = (
+    ('G', 'Guard'),
+    ('F', 'Forward'),
+    ('C', 'Center')
+)
+
+
+def _get_abb(table, value) -> str | None:
+    for abb, l in table:
+        if value == l:
+            return abb
+
+
+def box_pids(content: bytes) -> dict[str, list[int]]:
+    """Retrieves the pid's of the away and home athletes from a game's box score page"""
+    # TODO: while almost all box score participants also appear in the play-by-play,
+    #       it is possible for players to be parsed here without ever appearing in
+    #       Plays, making it impossible to reliably determine whether a player played
+    #       in a game and how many they've played in only from play-by-play
+    #
+    #       Ideally, we should also grab their minutes played from here and probably
+    #       cache the box score data somewhere
+    team_pids_raw = []
+    for tab in BeautifulSoup(content, 'html.parser').select('tbody[class="Table__TBODY"]'):
+        box_dumps = tab.select('a[class="AnchorLink truncate db Boxscore__AthleteName"][data-player-uid]')
+        if box_dumps:
+            team_pids_raw.append([int(re.search(r'.*:(\d+)', dump['data-player-uid'])[1]) for dump in box_dumps])
+    return {
+        'away': team_pids_raw[0],
+        'home': team_pids_raw[1]
+    }
+
+
+def player_row(pid: int, html: bytes) -> dict | None:
+    """Parses a Players row from a player page"""
+    j2 = extract.player_header(html)
+    if j2 is None:
+        return None
+    fname = j2['fNm']
+    lname = j2['lNm']
+    pos = j2.get('posAbv', None)  # TODO: may need to test this for possible multiple position listing
+    if pos is not None:
+        pos = pos[-1]  # remove any leading characters (e.g., SG, SF, PF)
+    htft, htin, wt = None, None, None
+    htwt_raw = j2.get('htwt', None)
+    if htwt_raw is not None:
+        htft, htin, wt = re.search(r'''(\d+)' (\d+)", (\d+) lbs''', htwt_raw).groups()
+    # brthpl = j2.get('brthpl', None)
+
+    return {
+        'pid': pid,
+        'fname': fname,
+        'lname': lname,
+        'pos': pos,
+        'htft': htft,
+        'htin': htin,
+        'wt': wt,
+    }
+
+
+def _get_pts_scored(away_score: int, home_score: int, last_play: dict) -> int:
+    if last_play['away_score'] != away_score:
+        # away team scored
+        return away_score - last_play['away_score']
+    else:
+        # home team scored
+        return home_score - last_play['home_score']
+
+
+class PlayState:
+    """What parsing a play takes from the plays before it, carried over between calls to `parse_plays`."""
+
+    def __init__(self, prev: dict | None = None, last: dict[str, int] | None = None):
+        self.prev = prev  # last play parsed, with at least its plyid and scores
+        self.last = last if last is not None else dict()  # plyid of the last play of each type
+
+    def __repr__(self):
+        return f'PlayState(plyid={self.plyid})'
+
+    @property
+    def plyid(self) -> int | None:
+        return self.prev['plyid'] if self.prev is not None else None
+
+
+def _shot_chart(gid: int, pkg: dict) -> dict:
+    if not pkg.get('shtChrt'):
+        return dict()
+    return {int(play['id'].removeprefix(str(gid))): play['coordinate'] for play in pkg['shtChrt']['plays']}
+
+
+def _play_rows(gid: int, pbp_j: list, shot_chart: dict,
+               state: PlayState | None = None) -> tuple[list[dict], float]:
+    """
+    Parses the rows of the plays from the play-by-play data, only those after `state.plyid` if a state is given,
+    which is then advanced past them, returning them with the seconds spent classifying their descriptions.
+
+    Players are named rather than identified, in `plyr_name` and `ast_name`, and teams by `ha` ('home' or 'away'),
+    since resolving them takes the database.
+    """
+    state = state if state is not None else PlayState()
+    after = state.plyid
+    plays = []
+    prev = state.prev  # last play parsed
+    last = state.last  # cache for last play of a given type
+    classifying = 0.  # seconds spent classifying descriptions
+    for pd in pbp_j:
+        for play in pd:
+            # these fields are not always present
+            type_ = None
+            subtype = None
+            pts_scored = None
+            plyr_name = None
+            ast_name = None
+            rel_ply = None
+            x_coord = None
+            y_coord = None
+
+            # these fields are provided directly
+            plyid = int(play['id'].removeprefix(str(gid)))
+            # TODO: plyid = int(play['id'])
+            if after is not None and plyid <= after:
+                continue
+            time_min, time_sec = play['clock']['displayValue'].split(':')
+            period = play['period']['number']
+            away_score = play['awayScore']
+            home_score = play['homeScore']
+            ha = play.get('homeAway', None)
+            if plyid in shot_chart:
+                x_coord = shot_chart[plyid]['x']
+                y_coord = shot_chart[plyid]['y']
+            desc = play.get('text', None)
+            if desc is None:  # desc not provided
+                # check if play was scoring play
+                if play['scoringPlay']:
+                    # check who scored and how many points
+                    type_ = 'SHT'
+                    if prev is not None:
+                        pts_scored = _get_pts_scored(away_score, home_score, prev)
+            else:
+                # remaining fields must be parsed from play description
+                start = time.perf_counter()
+                type_, g = classify(desc)
+                classifying += time.perf_counter() - start
+                match type_:
+                    case 'SHT':
+                        plyr_name, sht_result, sht_sub, ast_name = g
+                        if sht_sub is not None:  # some missed shots do not have encoded subtype
+                            subtype = _get_abb(ABBREV_SHOT_SUBTYPES, sht_sub)  # encode subtype
+
+                        pts_scored = 0  # default 0 points
+                        if sht_result == 'made':
+                            if sht_sub is not None:
+                                pts_scored = int(subtype[0])  # if made, determine points from subtype
+                            else:
+                                pts_scored = _get_pts_scored(away_score, home_score, prev)
+                                subtype = '3FG' if pts_scored == 3 else '2FG'
+                        else:
+                            ast_name = None
+
+                        # link free throws to related play (last foul)
+                        if subtype == '1FT':
+                            rel_ply = last['FL']
+
+                    case 'REB':
+                        # can be attributed to team or individual
+                        plyr_name = g[0]
+
+                        # encode subtype
+                        reb_sub = g[1]
+                        subtype = _get_abb(ABBREV_REB_SUBTYPES, reb_sub)
+
+                        # link to related play (last [missed?] shot)
+                        # note: blocks are only recorded when the shot is missed
+                        rel_ply = last['SHT']
+
+                    case 'TOV':
+                        plyr_name = g[0]
+
+                    case 'FL':
+                        tech, plyr_name = g
+                        if tech:
+                            subtype = 'TCH'
+
+                    case 'STL' | 'BLK':
+                        plyr_name = g[0]
+
+                        if type_ == 'STL':
+                            rel_ply = last['TOV']
+                        else:
+                            rel_ply = last['SHT']
+
+                    case 'TO' | 'EOP' | 'INV':
+                        # TO: just encode TV timeouts as neutral timeouts
+                        pass
+            last[type_] = plyid
+
+            plays.append({'plyid': plyid, 'gid': gid, 'ha': ha, 'period': period,
+                          'time_min': time_min, 'time_sec': time_sec, 'type': type_,
+                          'subtype': subtype, 'away_score': away_score,
+                          'home_score': home_score, 'pts_scored': pts_scored,
+                          'desc': desc,
+                          # always exclude periods from player names
+                          'plyr_name': plyr_name.replace('.', '') if plyr_name is not None else None,
+                          'ast_name': ast_name.replace('.', '') if ast_name is not None else None,
+                          'rel_ply': rel_ply, 'x_coord': x_coord, 'y_coord': y_coord})
+            prev = plays[-1]
+    state.prev = prev
+    return plays, classifying
+
+
+def record_plays(n_plays: int, classify_seconds: float):
+    """
+    Records the metrics of parsing plays, in the process that reports them rather than in the crawl's worker process
+    that parsed them (see `parse_game`).
+    """
+    instrument.observe('classify_seconds', classify_seconds)
+    instrument.inc('plays_parsed_total', n_plays)
+
+
+def parse_plays(gid: int, content: bytes, state: PlayState) -> tuple[list[dict], bool] | None:
+    """
+    Parses the rows of the plays after `state` from a play-by-play page (see `_play_rows`), advancing the state, and
+    whether the game has ended (only if its game strip says so), or returns None if play by play data is not
+    available.
+    """
+    pkg = extract.game_package(content)
+    if pkg is None or pkg.get('pbp') is None:
+        return None
+    plays, classifying = _play_rows(int(gid), pkg['pbp']['playGrps'], _shot_chart(int(gid), pkg), state)
+    record_plays(len(plays), classifying)  # parsed in a thread of this process
+    gm_strp = pkg.get('gmStrp')
+    return plays, gm_strp is not None and extract.strip_state(gm_strp) == extract.FINAL_STATE
+
+
+def _game_date(dt: str) -> tuple[str, int]:
+    """The date (in UTC, as ESPN dates every game) and season of a game's start time"""
+    dt = datetime.strptime(dt, '%Y-%m-%dT%H:%MZ')
+    season = dt.year + int(datetime(dt.year, 7, 1) < dt)  # add 1 to year if dt is in the fall semester
+    return dt.strftime('%Y-%m-%d'), season
+
+
+def scoreboard_games(content: bytes) -> list[dict] | None:
+    """
+    Parses the Games rows of the games on a scoreboard page, each with its status `state` (`post` once final), or
+    None if the page has no scoreboard. Games without both teams known are left out.
+    """
+    evts = extract.scoreboard_events(content)
+    if evts is None:
+        return None
+    games = []
+    for evt in evts:
+        tids = dict()
+        for tm in evt.get('competitors') or evt.get('tms') or []:
+            tids['home' if tm.get('isHome') or tm.get('homeAway') == 'home' else 'away'] = int(tm['id'])
+        if len(tids) < 2 or 'date' not in evt:
+            continue
+        date, season = _game_date(evt['date'])
+        games.append({'gid': int(evt['id']), 'neutral': int(evt.get('neutralSite', 0)),
+                      'isconf': int(evt['isConferenceGame']) if 'isConferenceGame' in evt else None,
+                      'home': tids['home'], 'away': tids['away'], 'season': season, 'date': date,
+                      'state': (evt.get('status') or {}).get('state')})
+    return games
+
+
+def player_rows(plyr_htmls: dict[int, bytes | None]) -> dict[int, dict | None]:
+    """Parses the Players rows from player pages, by pid"""
+    return {pid: player_row(pid, html) if html is not None else None for pid, html in plyr_htmls.items()}
+
+
+def parse_game(gid: int, plays_content: bytes, box: dict[str, list[int]],
+               players: dict[int, dict | None]) -> dict | None:
+    """
+    Parses everything needed to ingest a game from its raw play-by-play page, the pid's of its box score (see
+    `box_pids`) and the Players rows of its unregistered players (see `player_rows`), returning None if play by play
+    data is not available.
+
+    The result only holds plain rows, so that it is cheap to send back from a worker process:
+
+        game: the Games row
+        tids: the tid's for the away[0] and home[1] teams, or an empty list if either is missing
+        box: the box score pid's, as given
+        players: the Players rows of its unregistered players that could be parsed, by pid
+        plays: the Plays rows, see `_play_rows`
+        has_shot_chart: whether the plays have shot coordinates
+        final: whether the game has ended, so that no plays are to come (taken as ended if its state is unknown)
+        classify_seconds: the time spent classifying the play descriptions, to be recorded with `record_plays`
+    """
+    gid = int(gid)
+    pkg = extract.game_package(plays_content) if plays_content is not None else None
+    if pkg is None or pkg.get('pbp') is None or pkg.get('gmStrp') is None:
+        return None
+
+    # grab shot chart data from game page
+    shot_chart = _shot_chart(gid, pkg)
+
+    # note: this data also stores whether a game is a conference game
+    gm_j = pkg['gmStrp']
+    date, season = _game_date(gm_j['dt'])
+    neutral = 0 if 'neutralSite' not in gm_j else int(gm_j['neutralSite'])
+    isconf = int(gm_j['isConferenceGame']) if 'isConferenceGame' in gm_j else None  # unknown, as on scoreboards
+    for tm in gm_j['tms']:
+        if tm['isHome']:
+            home = tm['id']
+        else:
+            away = tm['id']
+    plays, classifying = _play_rows(gid, pkg['pbp']['playGrps'], shot_chart)
+
+    return {
+        'game': {'gid': gid, 'neutral': neutral, 'isconf': isconf, 'home': home, 'away': away,
+                 'season': season, 'date': date},
+        'tids': extract.game_tids(gm_j),
+        'box': box,
+        'players': {pid: row for pid, row in players.items() if row is not None},
+        'plays': plays,
+        'has_shot_chart': bool(shot_chart),
+        'final': extract.strip_state(gm_j) in (extract.FINAL_STATE, None),
+        'classify_seconds': classifying,
+    }
@@ -1,64 +1,32 @@
 """pbp.py: Module for parsing play-by-play data by webscraping ESPN pages."""
 
 import asyncio
-import re
 import logging
-import json
 import sqlite3
 import aiohttp
-import async_retrying
-from bs4 import BeautifulSoup
-from datetime import datetime
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Iterable
 from .database import with_cursor
-from .webscraper import Page, GamePage
+from .webscraper import ByteBudget, Page, GamePage, get_page, get_game_page
+from .stats import update_game_stats
+from . import client, extract, instrument, jobs, metadata, parse
 
 logging.basicConfig(filename='pbp.log', format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
 ESPN_HOME = 'https://www.espn.com/mens-college-basketball'
-RE_PLAY_TYPES = (
-    ('SHT',
-     r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+(made|missed)\s+(Three Point Jumper|Jumper|Layup|Dunk|Free Throw|Hook Shot|Two Point Tip Shot)?\.?(?:\s+Assisted by\s+((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\.)?"),
-    ('REB', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+(Offensive|Defensive|Deadball Team)\s+Rebound\."),
-    ('FL', r"(Technical )?Foul on\s+((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\."),
-    ('TOV', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+Turnover\."),
-    ('STL', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+Steal\."),
-    ('BLK', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+Block\."),
-    ('TO', r"((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)\s+Timeout"),
-    ('JMP', r"Jump Ball won by\s+((?:[A-Za-z0-9.'-]+ )*[A-Za-z0-9.'-]+)"),
-    ('EOP', r"End of\s+[A-Za-z0-9]+"),
-    ('INV', r".*")
-)
-ABBREV_SHOT_SUBTYPES = (
-    ('3PJ', 'Three Point Jumper'),
-    ('3FG', ''),  # fall-through for generic 3-pointer
-    ('2PJ', 'Jumper'),
-    ('2PL', 'Layup'),
-    ('2PD', 'Dunk'),
-    ('2PT', 'Two Point Tip Shot'),
-    ('2PH', 'Hook Shot'),
-    ('2FG', ''),  # fall-through for generic 2-pointer
-    ('1FT', 'Free Throw'),
-)
-
-ABBREV_REB_SUBTYPES = (
-    ('OFF', 'Offensive'),
-    ('DEF', 'Defensive'),
-    ('DBT', 'Deadball Team')
-)
-
-ABBREV_POS = (
-    ('G', 'Guard'),
-    ('F', 'Forward'),
-    ('C', 'Center')
-)
+# a game strip is authoritative, so it updates a Games row prefilled from the scoreboard (see `discover.prefill`),
+# except for an isconf the strip leaves out; rows it would not change are left as they are
+GAMES_UPSERT = '''ON CONFLICT (gid) DO UPDATE
+                  SET neutral = excluded.neutral, isconf = coalesce(excluded.isconf, Games.isconf),
+                      home = excluded.home, away = excluded.away, season = excluded.season, date = excluded.date
+                  WHERE (Games.neutral, Games.isconf, Games.home, Games.away, Games.season, Games.date)
+                        IS NOT (excluded.neutral, coalesce(excluded.isconf, Games.isconf), excluded.home,
+                                excluded.away, excluded.season, excluded.date)'''
+
 
 def get_game_tids(gid: int) -> list[int]:
     """Retrieves the tid's for the away[0] and home[1] teams from the given game"""
-    url = f'{ESPN_HOME}/playbyplay/_/gameId/{gid}'
-    page = Page(url)
-    selector = page.soup.select('div[class="Gamestrip__TeamContainer flex items-center"]')
-    out = [re.search(r'/mens-college-basketball/team/_/id/(\d+)', str(g)) for g in selector]
-    out = [e[1] for e in out if e is not None]
+    out = get_game_page(gid).tids
     if len(out) < 2:
         # TODO: provide an alternative to encode with a new team id that doesn't collide with ESPN's
         #       -- this is part of a larger issue where we need to be able to handle data that simply
@@ -69,394 +37,441 @@ def get_game_tids(gid: int) -> list[int]:
     return out
 
 
+def _team_url(tid: int) -> str:
+    return f'{ESPN_HOME}/team/_/id/{tid}'
+
+
+def _team_schedule_url(tid: int) -> str:
+    return f'{ESPN_HOME}/team/schedule/_/id/{tid}'
+
+
+def _standings_url(tp: Page) -> str:
+    # idk if this is the best way to do it but it should work every time
+    return tp.soup.find('a', string='Full Standings')['href']
+
+
+async def fetch_team_pages(tid: int, session: aiohttp.ClientSession | None = None) -> list[Page]:
+    """
+    Loads the pages `fetch_team_data` scrapes for a new team ahead of time, so that registering the team takes no
+    blocking requests, returning them to keep them registered until then
+    """
+    pages = [get_page(_team_url(tid)), get_page(_team_schedule_url(tid))]
+    await asyncio.gather(*(page.fetch(session) for page in pages))
+    if pages[0].content is not None:
+        pages.append(get_page(_standings_url(pages[0])))
+        await pages[-1].fetch(session)
+    return pages
+
+
 @with_cursor
 def fetch_cid_from_tid(cursor: sqlite3.Cursor, tid: int) -> int:
     """Fetches cid from team id"""
     # TODO: as teams can switch conferences, we should probably add a TeamSeasons table to register
     #       teams in conferences by year
-    # this function assumes that the team is new and does not yet store its own `cid`
-    tp_url = f'{ESPN_HOME}/team/_/id/{tid}'
-    tp = Page(tp_url)
-    # idk if this is the best way to do it but it should work every time
-    conf_url = tp.soup.find('a', string='Full Standings')['href']
+    meta = metadata.warmed(cursor)
+    team = meta.team(tid)
+    if team is not None:
+        return team['cid']
+
+    tp = get_page(_team_url(tid))
+    conf_url = _standings_url(tp)
     cid = int(conf_url.split('/')[-1])
-    res = cursor.execute('SELECT cid FROM Conferences WHERE cid=:cid LIMIT 1', {'cid': cid}).fetchone()
+    if meta.conference(cid) is None:
+        meta.once(('conference', cid), lambda: _insert_conference(cursor, cid, conf_url))
+    return cid
 
-    if res is None:
-        conf = Page(conf_url)
-        s1 = conf.soup.select('h1[class="headline headline__h1 dib"]')
-        abbrev = s1[0].text.removesuffix("Men's College Basketball Standings - 2023-24").strip()
 
-        s2 = conf.soup.select('div[class="Table__Title"]')
-        name = s2[0].text
+def _insert_conference(cursor: sqlite3.Cursor, cid: int, conf_url: str):
+    """Scrapes a conference's standings page for its names and registers it, if another lookup has not already"""
+    meta = metadata.metadata()
+    if meta.conference(cid) is not None:
+        return
+    conf = get_page(conf_url)
+    s1 = conf.soup.select('h1[class="headline headline__h1 dib"]')
+    abbrev = s1[0].text.removesuffix("Men's College Basketball Standings - 2023-24").strip()
 
-        cursor.execute(
-            'INSERT INTO Conferences (cid, name, abbrev) VALUES (:cid, :name, :abbrev) ON CONFLICT DO NOTHING',
-            {'cid': cid, 'name': name, 'abbrev': abbrev})
+    s2 = conf.soup.select('div[class="Table__Title"]')
+    name = s2[0].text
 
-    return cid
+    res = {'cid': cid, 'name': name, 'abbrev': abbrev}
+    cursor.execute(
+        'INSERT INTO Conferences (cid, name, abbrev) VALUES (:cid, :name, :abbrev) ON CONFLICT DO NOTHING', res)
+    meta.put_conference(res)
 
 
 @with_cursor
 def fetch_team_data(cursor: sqlite3.Cursor, tid: int) -> dict:
     """Fetches team data and populates the database if it does not already exist"""
-    res = cursor.execute('SELECT * FROM Teams WHERE tid=:tid LIMIT 1',
-                         {'tid': tid}).fetchone()
-
+    meta = metadata.warmed(cursor)
+    res = meta.team(tid)
     if res is None:
-        cid = fetch_cid_from_tid(tid)
-
-        # access team page for naming
-        url = f'{ESPN_HOME}/team/schedule/_/id/{tid}'
-        tp = Page(url)
-        selector = tp.soup.select('span[class="flex flex-wrap"] span')
-        name, mascot = (g.text for g in selector)
-
-        res = {
-            'tid': tid,
-            'cid': cid,
-            'name': name,
-            'mascot': mascot
-        }
-
-        # create new record for team
-        cursor.execute(
-            'INSERT INTO Teams (tid, cid, name, mascot) VALUES (:tid, :cid, :name, :mascot) ON CONFLICT DO NOTHING',
-            res)
-
+        res = meta.once(('team', int(tid)), lambda: _insert_team(cursor, tid))
     return dict(res)
 
 
+def _insert_team(cursor: sqlite3.Cursor, tid: int) -> dict:
+    """Scrapes a new team's pages and registers it, if another lookup has not already"""
+    meta = metadata.metadata()
+    res = meta.team(tid)
+    if res is not None:
+        return res
+    cid = fetch_cid_from_tid(tid)
+
+    # access team page for naming
+    tp = get_page(_team_schedule_url(tid))
+    selector = tp.soup.select('span[class="flex flex-wrap"] span')
+    name, mascot = (g.text for g in selector)
+
+    res = {
+        'tid': int(tid),
+        'cid': cid,
+        'name': name,
+        'mascot': mascot
+    }
+
+    # create new record for team
+    cursor.execute(
+        'INSERT INTO Teams (tid, cid, name, mascot) VALUES (:tid, :cid, :name, :mascot) ON CONFLICT DO NOTHING',
+        res)
+    meta.put_team(res)
+    return res
+
+
 @with_cursor
 def fetch_rid(cursor: sqlite3.Cursor, tid: int, season: int) -> int:
+    meta = metadata.warmed(cursor)
+    rid = meta.rid(tid, season)
+    if rid is not None:
+        return rid
+
+    # roster does not exist
+    cursor.execute('INSERT INTO Rosters (tid, season) VALUES (:tid, :season) ON CONFLICT DO NOTHING',
+                   {'tid': tid, 'season': season})
     res = cursor.execute('SELECT rid FROM Rosters WHERE tid=:tid AND season=:season LIMIT 1',
                          {'tid': tid, 'season': season}).fetchone()
 
-    if res is None:
-        # roster does not exist
-        cursor.execute('INSERT INTO Rosters (tid, season) VALUES (:tid, :season) ON CONFLICT DO NOTHING',
-                       {'tid': tid, 'season': season})
-        res = cursor.execute('SELECT rid FROM Rosters WHERE tid=:tid AND season=:season LIMIT 1',
-                             {'tid': tid, 'season': season}).fetchone()
-
     rid = res['rid']
+    meta.put_rid(tid, season, rid)
     return rid
 
 
-def _get_abb(table, value) -> str | None:
-    for abb, l in table:
-        if value == l:
-            return abb
+def get_box_pids(bs: Page) -> dict[str, list[int]]:
+    """Retrieves the pid's of the away and home athletes from a game's box score page"""
+    return parse.box_pids(bs.content)
 
 
-@with_cursor
-def parse_pbp(cursor, gid: int, assume_gid_from_pbp: bool = False) -> None:
+@with_cursor(write=False)
+def filter_unknown_pids(cursor: sqlite3.Cursor, pids: Iterable[int]) -> list[int]:
+    """Filters out the pid's of players already registered in Players"""
+    pids = list(pids)
+    if not pids:
+        return []
+    known = {row['pid'] for row in cursor.execute(
+        f'SELECT pid FROM Players WHERE pid IN ({", ".join("?" * len(pids))})', pids)}
+    return [pid for pid in pids if pid not in known]
+
+
+def _select_box_players(cursor: sqlite3.Cursor, box_pids: dict[str, list[int]],
+                        rids: dict[str, int]) -> list[sqlite3.Row]:
+    """Looks up every box score player's name and whether they are on the game's roster in one query"""
+    params = [v for ha, pids in box_pids.items() for pid in pids for v in (pid, rids[ha])]
+    if not params:
+        return []
+    values = ', '.join(['(?, ?)'] * (len(params) // 2))
+    return cursor.execute(f'''WITH Box (pid, rid) AS (VALUES {values})
+                              SELECT Box.pid, Box.rid, P.fname, P.lname, PS.pid IS NOT NULL AS rostered
+                              FROM Box LEFT JOIN Players P ON P.pid = Box.pid
+                                       LEFT JOIN PlayerSeasons PS ON PS.pid = Box.pid AND PS.rid = Box.rid''',
+                          params).fetchall()
+
+
+def _player_url(pid: int) -> str:
+    return f'{ESPN_HOME}/player/_/id/{pid}'
+
+
+def _player_page(pid: int) -> Page:
+    """The page of a player, read only up to the end of its header (see `parse.player_row`)"""
+    return get_page(_player_url(pid), until=extract.has_player_header)
+
+
+async def fetch_players(pids: Iterable[int], session: aiohttp.ClientSession | None = None) -> dict[int, dict | None]:
+    """
+    Fetches the Players rows for the given pid's from their pages, through the shared session if none is given, each
+    page parsed as soon as it arrives and released right after, so no more than a few are held at once
+    """
+    async def fetch_player(pid: int) -> dict | None:
+        page = _player_page(pid)
+        html = await page.fetch(session)
+        page.release()
+        return parse.player_row(pid, html) if html is not None else None
+
+    pids = list(pids)
+    with instrument.timed('player_fetch_seconds'):
+        rows = await asyncio.gather(*map(fetch_player, pids))
+    instrument.inc('player_pages_total', len(pids))
+    return dict(zip(pids, rows))
+
+
+def get_players(pids: Iterable[int]) -> dict[int, dict | None]:
+    """Synchronously fetches the Players rows for the given pid's like `fetch_players`, over the shared client"""
+    def get_player(pid: int) -> dict | None:
+        page = _player_page(pid)
+        html = page.content
+        page.release()
+        return parse.player_row(pid, html) if html is not None else None
+
+    pids = list(pids)
+    if not pids:
+        return dict()
+    with (instrument.timed('player_fetch_seconds'),
+          ThreadPoolExecutor(max_workers=min(client.MAX_CONNECTIONS_PER_HOST, len(pids))) as executor):
+        rows = list(executor.map(get_player, pids))
+    instrument.inc('player_pages_total', len(pids))
+    return dict(zip(pids, rows))
+
+
+async def fetch_game(gid: int, session: aiohttp.ClientSession | None = None, pool: Executor | None = None,
+                     budget: ByteBudget | None = None) -> tuple[dict, list[Page]] | None:
+    """
+    Fetches every page needed to ingest a game and parses them in the pool (or threads of this process by default),
+    returning the parsed game (see `parse.parse_game`) with the pages of its new teams, or None if the game cannot be
+    resolved, which fails its ingest job
+
+    The game's pages are held within the byte budget, if any, and released once parsed.
+    """
+    loop = asyncio.get_running_loop()
+    async with (budget or ByteBudget()).hold() as holder:
+        gp = get_game_page(gid)
+        try:
+            if not await gp.load(session):
+                return _fail(gid, 'Pages could not be resolved')
+            holder.size = len(gp.plays.content) + len(gp.boxscore.content)
+            instrument.observe('game_bytes', holder.size, instrument.BYTES_BUCKETS)
+            try:
+                with instrument.timed('parse_seconds', what='box'):
+                    box_pids = await loop.run_in_executor(pool, parse.box_pids, gp.boxscore.content)
+            except IndexError:
+                return _fail(gid, 'Box score data is not available')
+            players = await fetch_players(filter_unknown_pids(box_pids['away'] + box_pids['home']), session)
+            jobs.mark(gid, jobs.FETCHED)
+            # timed from here, so this includes waiting on the pool, whose processes cannot report to this one
+            with instrument.timed('parse_seconds', what='game'):
+                parsed = await loop.run_in_executor(pool, parse.parse_game, gid, gp.plays.content, box_pids, players)
+        finally:
+            gp.release()
+    if parsed is None:
+        return _fail(gid, 'Play by play data is not available')
+    parse.record_plays(len(parsed['plays']), parsed['classify_seconds'])
+    jobs.mark(gid, jobs.PARSED)
+    new_tids = [tid for tid in parsed['tids'] if metadata.metadata().team(tid) is None]
+    team_pages = await asyncio.gather(*(fetch_team_pages(tid, session) for tid in new_tids))
+    return parsed, [page for pages in team_pages for page in pages]
+
+
+@with_cursor(write=False)
+def game_exists(cursor: sqlite3.Cursor, gid: int) -> bool:
+    """Checks whether a game has already been registered in Games"""
+    cursor.execute('SELECT gid FROM Games WHERE gid=:gid LIMIT 1', {'gid': gid})
+    return cursor.fetchone() is not None
+
+
+def _fail(gid: int, reason: str) -> None:
+    logging.warning(f'{reason} for {gid=}')
+    jobs.fail(gid, reason)
+
+
+def parse_pbp(gid: int, assume_gid_from_pbp: bool = False, gp: GamePage | None = None,
+              plyr_htmls: dict[int, bytes] | None = None) -> None:
     """
     Parses plays from a given game and inserts them into the database, along with any other missing game data.
+
+    Pages already loaded may be passed in as `gp` and `plyr_htmls` to skip fetching them again, where `plyr_htmls`
+    only needs the pages of players that are not yet registered in Players.
+
+    The game's ingest job is committed along with its rows, or failed with the error that stopped it, and games
+    whose job is committed are skipped if `assume_gid_from_pbp`.
     """
-    if assume_gid_from_pbp:
-        cursor.execute('SELECT gid FROM Games WHERE gid=:gid LIMIT 1', {'gid': gid})
-        if cursor.fetchone():
-            return
+    jobs.discover([gid])
+    if assume_gid_from_pbp and jobs.state(gid) == jobs.COMMITTED:
+        return
+    try:
+        _ingest_game(gid, gp, plyr_htmls)
+    except Exception as e:
+        jobs.fail(gid, e)  # the game's rows were rolled back
+        raise
+
 
+@with_cursor
+def _ingest_game(cursor, gid: int, gp: GamePage | None, plyr_htmls: dict[int, bytes] | None):
     # grab play-by-play data from game page
-    # TODO: this part can be awaited
-    # TODO: all of my function calls that write to the DB can be made async
-    gp = GamePage(gid)
-    pbp = gp.plays
-    pbp_m = re.search(r'\"pbp\":\s*\{\"playGrps\":(.+\]\]),\"tms\".*\}', str(pbp.soup), flags=re.DOTALL)
-    if not pbp_m:
-        logging.warning(f'Play by play data is not available for {gid=}')
-        return
-    pbp_j = json.loads(pbp_m[1].replace('\\', ''))
+    if gp is None:
+        gp = get_game_page(gid)
+    if gp.plays.content is None:
+        return _fail(gid, 'Play by play data is not available')
+    box = get_box_pids(gp.boxscore)
+    if plyr_htmls is None:
+        players = get_players(filter_unknown_pids(box['away'] + box['home']))
+    else:
+        players = parse.player_rows(plyr_htmls)
+    jobs.mark(gid, jobs.FETCHED)
+    parsed = parse.parse_game(gid, gp.plays.content, box, players)
+    gp.release()
+    if parsed is not None:
+        parse.record_plays(len(parsed['plays']), parsed['classify_seconds'])
+    write_game(parsed, gid)
 
-    # grab shot chart data from game page
-    shots_m = re.search(r'\"shtChrt\":\s*\{\"plays\":(\[.+\]),\s*\"tms\"', str(pbp.soup), flags=re.DOTALL)
-    shot_chart = dict()
-    if not shots_m:
+
+@with_cursor
+def write_game(cursor, parsed: dict | None, gid: int | None = None) -> None:
+    """
+    Inserts a game parsed by `parse.parse_game` into the database, along with any other missing game data.
+
+    Teams and players are resolved here, from the database and metadata cache (fetching pages of new teams), and the
+    game's ingest job is committed in the same transaction, unless the game is still in progress, whose job is left
+    parsed until its last plays are stored (see `live.LiveGame.poll`).
+    """
+    if parsed is None:
+        if gid is not None:
+            _fail(gid, 'Play by play data is not available')
+        return
+    game = parsed['game']
+    gid = game['gid']
+    season = game['season']
+    if not parsed['has_shot_chart']:
         logging.info(f'Shot chart data is not available for {gid=}')
-    else:
-        shots_j = json.loads(shots_m[1].replace('\\', ''))
-        shot_chart = {int(play['id'].removeprefix(str(gid))): play['coordinate'] for play in shots_j}
-
-    # fetch game data
-    # note: this data also stores whether a game is a conference game
-    gm_m = re.search(r'\"gmStrp\":(\{.+\}),\"gpLinks\"', str(pbp.soup), flags=re.DOTALL)
-    gm_j = json.loads(gm_m[1].replace('\\', ''))
-    dt = datetime.strptime(gm_j['dt'], '%Y-%m-%dT%H:%MZ')
-    date = dt.strftime('%Y-%m-%d')
-    season = dt.year + int(datetime(dt.year, 7, 1) < dt)  # add 1 to year if dt is in the fall semester
-    neutral = 0 if 'neutralSite' not in gm_j else int(gm_j['neutralSite'])
-    isconf = 0 if 'isConferenceGame' not in gm_j else int(gm_j['isConferenceGame'])
-    for tm in gm_j['tms']:
-        if tm['isHome']:
-            home = tm['id']
-        else:
-            away = tm['id']
-
-    cursor.execute('''INSERT INTO Games (gid, neutral, isconf, home, away, season, date) 
-                      VALUES (:gid, :neutral, :isconf, :home, :away, :season, :date) ON CONFLICT DO NOTHING''',
-                   {
-                       'gid': gid,
-                       'neutral': neutral,
-                       'isconf': isconf,
-                       'home': home,
-                       'away': away,
-                       'season': season,
-                       'date': date
-                   })
-
-    tids = get_game_tids(gid)
+
+    with instrument.timed('db_write_seconds', table='Games'):
+        cursor.execute(f'''INSERT INTO Games (gid, neutral, isconf, home, away, season, date)
+                           VALUES (:gid, :neutral, :isconf, :home, :away, :season, :date) {GAMES_UPSERT}''',
+                       game)
+    instrument.rows('Games', cursor.rowcount)
+
+    tids = parsed['tids']
     if not tids:
-        logging.warning('One or more tids could not be found')
-        return
+        return _fail(gid, 'One or more tids could not be found')
     a_tid, h_tid = tids
 
-    team_data = {
-        'away': {**fetch_team_data(a_tid), **{'rid': fetch_rid(a_tid, season)}},
-        'home': {**fetch_team_data(h_tid), **{'rid': fetch_rid(h_tid, season)}}
-    }
-
-    # insert all players from box score if it exists
-    # TODO: while almost all box score participants also appear in the play-by-play,
-    #       it is possible for players to be parsed here without ever appearing in
-    #       Plays, making it impossible to reliably determine whether a player played
-    #       in a game and how many they've played in only from play-by-play
-    #
-    #       Ideally, we should also grab their minutes played from here and probably
-    #       cache the box score data somewhere
-    bs = gp.boxscore
-    team_dumps_raw = []
-    for tab in bs.soup.select('tbody[class="Table__TBODY"]'):
-        box_dumps = tab.select('a[class="AnchorLink truncate db Boxscore__AthleteName"]')
-        if box_dumps:
-            team_dumps_raw.append(box_dumps)
-    team_dumps = {
-        'away': team_dumps_raw[0],
-        'home': team_dumps_raw[1]
-    }
+    team_data = _team_data(a_tid, h_tid, season)
 
-    @async_retrying.retry
-    async def _fetch(session: aiohttp.ClientSession, url: str):
-        async with session.get(url) as resp:
-            logging.info(f'Reading text from {url}, response code {resp.status}')
-            return str(await resp.text())
-
-    async def _get_plyr_pages(dumps) -> tuple[bytes]:
-        pids = [re.search(r'.*:(\d+)', dump['data-player-uid'])[1] for dump in dumps]
-        urls = [f'{ESPN_HOME}/player/_/id/{pid}' for pid in pids]
-        async with aiohttp.ClientSession() as session:
-            tasks = [asyncio.create_task(_fetch(session, url)) for url in urls]
-            htmls = await asyncio.gather(*tasks)
-            return htmls
-
-    async def _get_all_plyr_pages(team_dumps: dict[str, list[dict]]) -> dict[str, tuple[bytes]]:
-        plyr_htmls = dict()
-        plyr_htmls['away'] = await _get_plyr_pages(team_dumps['away'])
-        plyr_htmls['home'] = await _get_plyr_pages(team_dumps['home'])
-        return plyr_htmls
-
-    # asynchronously grab the player pages -- each page ~400KB * ~22 players = 8.8 MB in memory
-    plyr_htmls = asyncio.run(_get_all_plyr_pages(team_dumps))
+    # look up the box score players, whose pages were only fetched if they were not yet registered
+    box_players = _select_box_players(cursor, parsed['box'], {ha: data['rid'] for ha, data in team_data.items()})
 
     # process acquired player data
     players = {
         team_data['away']['tid']: dict(),
         team_data['home']['tid']: dict()
     }
+    tids_by_rid = {data['rid']: data['tid'] for data in team_data.values()}
     plyr_d_add = []
     plyrseason_d_add = []
-    for ha, team_htmls in plyr_htmls.items():
-        tid = team_data[ha]['tid']
-        for html in team_htmls:
-            bs = BeautifulSoup(str(html), 'html.parser')
-            url = bs.select('meta[property="og:url"]')[0]['content']
-            pid = re.search(r'\d+', url)[0]
-
-            res = cursor.execute('SELECT fname, lname FROM Players WHERE pid=:pid', {'pid': pid}).fetchone()
+    for row in box_players:
+        pid = row['pid']
+        res = row
+        if row['fname'] is None:
+            res = parsed['players'].get(pid)
             if res is None:
-                # m2 contains player info (hardcoded with ending for now)
-                m2 = re.search(r'"plyrHdr":\{"ath":(\{.*\}),"statsBlck".*\}', str(html))
-                j2 = json.loads(m2[1].replace('\\\\', '\\').replace('\\\'', '\''))
-                fname = j2['fNm']
-                lname = j2['lNm']
-                pos = j2.get('posAbv', None)  # TODO: may need to test this for possible multiple position listing
-                if pos is not None:
-                    pos = pos[-1]  # remove any leading characters (e.g., SG, SF, PF)
-                htft, htin, wt = None, None, None
-                htwt_raw = j2.get('htwt', None)
-                if htwt_raw is not None:
-                    htft, htin, wt = re.search(r'''(\d+)' (\d+)", (\d+) lbs''', htwt_raw).groups()
-                # brthpl = j2.get('brthpl', None)
-
-                res = {
-                    'pid': pid,
-                    'fname': fname,
-                    'lname': lname,
-                    'pos': pos,
-                    'htft': htft,
-                    'htin': htin,
-                    'wt': wt,
-                }
-
-                plyr_d_add.append(res)
-                plyrseason_d_add.append({'pid': pid, 'rid': team_data[ha]['rid']})
-
-            plyr_name = f'{res["fname"]} {res["lname"]}'
-            try:
-                players[tid][plyr_name] = pid
-            except KeyError:
-                print(players.keys())
+                logging.warning(f'Player data could not be resolved for {pid=}')
+                continue
+            plyr_d_add.append(res)
+        if not row['rostered']:
+            plyrseason_d_add.append({'pid': pid, 'rid': row['rid']})
+
+        plyr_name = f'{res["fname"]} {res["lname"]}'
+        players[tids_by_rid[row['rid']]][plyr_name] = pid
 
     # insert missing Players and PlayerSeasons to appropriate tables
-    cursor.executemany(
-        'INSERT INTO Players (pid, fname, lname, pos, htft, htin, wt) VALUES (:pid, :fname, :lname, :pos, :htft, :htin, :wt) ON CONFLICT DO NOTHING',
-        plyr_d_add)
-    cursor.executemany('INSERT INTO PlayerSeasons (pid, rid) VALUES (:pid, :rid) ON CONFLICT DO NOTHING',
-                       plyrseason_d_add)
+    with instrument.timed('db_write_seconds', table='Players'):
+        cursor.executemany(
+            'INSERT INTO Players (pid, fname, lname, pos, htft, htin, wt) VALUES (:pid, :fname, :lname, :pos, :htft, :htin, :wt) ON CONFLICT DO NOTHING',
+            plyr_d_add)
+    instrument.rows('Players', cursor.rowcount)
+    with instrument.timed('db_write_seconds', table='PlayerSeasons'):
+        cursor.executemany('INSERT INTO PlayerSeasons (pid, rid) VALUES (:pid, :rid) ON CONFLICT DO NOTHING',
+                           plyrseason_d_add)
+    instrument.rows('PlayerSeasons', cursor.rowcount)
+
+    # skip the plays already stored for this game, so that a partially ingested game resumes after them
+    stored = {row['plyid'] for row in cursor.execute('SELECT plyid FROM Plays WHERE gid=:gid', {'gid': gid})}
+    _insert_plays(cursor, gid, _play_records((play for play in parsed['plays'] if play['plyid'] not in stored),
+                                             team_data, players))
+    jobs.mark(gid, jobs.COMMITTED if parsed['final'] else jobs.PARSED)
+
+
+def _team_data(a_tid: int, h_tid: int, season: int) -> dict[str, dict]:
+    """The Teams row and season rid of the away and home teams, registering them if they are new"""
+    return {
+        'away': {**fetch_team_data(a_tid), **{'rid': fetch_rid(a_tid, season)}},
+        'home': {**fetch_team_data(h_tid), **{'rid': fetch_rid(h_tid, season)}}
+    }
+
 
+def _play_records(plays: Iterable[dict], team_data: dict[str, dict],
+                  players: dict[int, dict[str, int]]) -> list[dict]:
+    """Resolves the teams and named players of parsed plays (see `parse._play_rows`) into Plays rows"""
     team_names = (team_data['home']['name'], team_data['away']['name'])
+    records = []
+    for play in plays:
+        play = dict(play)
+        ha = play.pop('ha')
+        plyr_name = play.pop('plyr_name')
+        ast_name = play.pop('ast_name')
+        tid = team_data[ha]['tid'] if ha is not None else None
+        # team rebounds and turnovers are credited to the team name
+        plyr = players[tid].get(plyr_name) if plyr_name is not None and plyr_name not in team_names else None
+        plyr_ast = players[tid].get(ast_name) if ast_name is not None else None
+        records.append({**play, 'tid': tid, 'plyr': plyr, 'plyr_ast': plyr_ast})
+    return records
+
+
+def _insert_plays(cursor: sqlite3.Cursor, gid: int, plays: list[dict]) -> int:
+    with instrument.timed('db_write_seconds', table='Plays'):
+        inserted = cursor.executemany('''INSERT INTO Plays (plyid, gid, tid, period, time_min, time_sec, type, 
+                                 subtype, away_score, home_score, pts_scored, desc, plyr, plyr_ast, 
+                                 rel_ply, x_coord, y_coord)
+                              VALUES (:plyid, :gid, :tid, :period, :time_min, :time_sec, :type, 
+                                 :subtype, :away_score, :home_score, :pts_scored, :desc, :plyr, :plyr_ast, 
+                                 :rel_ply, :x_coord, :y_coord) ON CONFLICT DO NOTHING''',
+                           plays).rowcount
+    instrument.rows('Plays', inserted)
+    # keep the game's box scores in step with its plays
+    with instrument.timed('db_write_seconds', table='PlayerGameStats'):
+        update_game_stats(cursor, gid)
+    return inserted
 
-    # pbp convenience functions
-    def _is_team_name(s: str) -> bool:
-        return s in team_names
 
-    def _get_pts_scored(away_score: int, home_score: int, last_play: dict) -> int:
-        try:
-            if last_play['away_score'] != away_score:
-                # away team scored
-                return away_score - last_play['away_score']
-            else:
-                # home team scored
-                return home_score - last_play['home_score']
-        except IndexError:
-            pass
-
-    # parse play-by-play
-    plays = []
-    last = dict()  # cache for last play of a given type
-    for pd in pbp_j:
-        for play in pd:
-            # TODO: I could pull this section out to make it more readable (but need to pass in more variables)
-            # these fields are not always present
-            tid = None
-            type_ = None
-            subtype = None
-            pts_scored = None
-            plyr = None
-            plyr_ast = None
-            rel_ply = None
-            x_coord = None
-            y_coord = None
-
-            # these fields are provided directly
-            plyid = int(play['id'].removeprefix(str(gid)))
-            # TODO: plyid = int(play['id'])
-            cursor.execute('SELECT plyid FROM Plays WHERE plyid=:plyid AND gid=:gid', {'plyid': plyid, 'gid': gid})
-            if cursor.fetchone():
-                continue
-            time_min, time_sec = play['clock']['displayValue'].split(':')
-            period = play['period']['number']
-            away_score = play['awayScore']
-            home_score = play['homeScore']
-            ha = play.get('homeAway', None)
-            if ha is not None:
-                data = team_data[ha]
-                tid = data['tid']
-                # rid = data['rid']
-            if plyid in shot_chart:
-                x_coord = shot_chart[plyid]['x']
-                y_coord = shot_chart[plyid]['y']
-            desc = play.get('text', None)
-            if desc is None:  # desc not provided
-                # check if play was scoring play
-                if play['scoringPlay']:
-                    # check who scored and how many points
-                    type_ = 'SHT'
-                    if plays:
-                        pts_scored = _get_pts_scored(away_score, home_score, plays[-1])
-            else:
-                # remaining fields must be parsed from play description
-                for t, r in RE_PLAY_TYPES:
-                    m = re.search(r, desc)
-                    if m is not None:
-                        type_ = t
-                        break
-
-                g = m.groups()
-                match type_:
-                    case 'SHT':
-                        plyr_name, sht_result, sht_sub, ast_name = g
-                        plyr_name = plyr_name.replace('.', '')  # always exclude periods from player names
-                        plyr = players[tid].get(plyr_name, None)  # get pid of shooter
-                        if sht_sub is not None:  # some missed shots do not have encoded subtype
-                            subtype = _get_abb(ABBREV_SHOT_SUBTYPES, sht_sub)  # encode subtype
-
-                        pts_scored = 0  # default 0 points
-                        if sht_result == 'made':
-                            if sht_sub is not None:
-                                pts_scored = int(subtype[0])  # if made, determine points from subtype
-                            else:
-                                pts_scored = _get_pts_scored(away_score, home_score, plays[-1])
-                                subtype = '3FG' if pts_scored == 3 else '2FG'
-                            if ast_name is not None:
-                                ast_name = ast_name.replace('.', '')
-                                plyr_ast = players[tid].get(ast_name)  # get pid of assister
-
-                        # link free throws to related play (last foul)
-                        if subtype == '1FT':
-                            rel_ply = last['FL']
-
-                    case 'REB':
-                        # can be attributed to team or individual
-                        plyr_name = g[0].replace('.', '')
-                        if not _is_team_name(plyr_name):
-                            plyr = players[tid].get(plyr_name, None)
-
-                        # encode subtype
-                        reb_sub = g[1]
-                        subtype = _get_abb(ABBREV_REB_SUBTYPES, reb_sub)
-
-                        # link to related play (last [missed?] shot)
-                        # note: blocks are only recorded when the shot is missed
-                        rel_ply = last['SHT']
-
-                    case 'TOV':
-                        plyr_name = g[0].replace('.', '')
-                        if not _is_team_name(plyr_name):
-                            plyr = players[tid].get(plyr_name, None)
-
-                    case 'FL':
-                        tech, plyr_name = g
-                        if tech:
-                            subtype = 'TCH'
-                        plyr_name = plyr_name.replace('.', '')
-                        plyr = players[tid].get(plyr_name, None)
-
-                    case 'STL' | 'BLK':
-                        plyr_name = g[0].replace('.', '')
-                        plyr = players[tid].get(plyr_name, None)
-
-                        if type_ == 'STL':
-                            rel_ply = last['TOV']
-                        else:
-                            rel_ply = last['SHT']
-
-                    case 'TO' | 'EOP' | 'INV':
-                        # TO: just encode TV timeouts as neutral timeouts
-                        pass
-            last[type_] = plyid
-
-            plays.append({'plyid': plyid, 'gid': gid, 'tid': tid, 'period': period,
-                          'time_min': time_min, 'time_sec': time_sec, 'type': type_,
-                          'subtype': subtype, 'away_score': away_score,
-                          'home_score': home_score, 'pts_scored': pts_scored,
-                          'desc': desc, 'plyr': plyr, 'plyr_ast': plyr_ast, 'rel_ply': rel_ply,
-                          'x_coord': x_coord, 'y_coord': y_coord})
-    cursor.executemany('''INSERT INTO Plays (plyid, gid, tid, period, time_min, time_sec, type, 
-                             subtype, away_score, home_score, pts_scored, desc, plyr, plyr_ast, 
-                             rel_ply, x_coord, y_coord)
-                          VALUES (:plyid, :gid, :tid, :period, :time_min, :time_sec, :type, 
-                             :subtype, :away_score, :home_score, :pts_scored, :desc, :plyr, :plyr_ast, 
-                             :rel_ply, :x_coord, :y_coord) ON CONFLICT DO NOTHING''',
-                       plays)
+@with_cursor
+def game_context(cursor: sqlite3.Cursor, gid: int) -> tuple[dict[str, dict], dict[int, dict[str, int]]] | None:
+    """
+    The team data and the pid's of rostered players by name for a stored game, which resolve its plays (see
+    `append_plays`), or None if the game or its teams are not registered
+    """
+    game = cursor.execute('SELECT home, away, season FROM Games WHERE gid=:gid', {'gid': gid}).fetchone()
+    meta = metadata.warmed(cursor)
+    if game is None or meta.team(game['away']) is None or meta.team(game['home']) is None:
+        return None
+    team_data = _team_data(game['away'], game['home'], game['season'])
+    players = {data['tid']: dict() for data in team_data.values()}
+    tids_by_rid = {data['rid']: data['tid'] for data in team_data.values()}
+    for row in cursor.execute('''SELECT PS.rid, P.pid, P.fname, P.lname
+                                 FROM PlayerSeasons PS JOIN Players P ON P.pid = PS.pid
+                                 WHERE PS.rid IN (?, ?)''', tuple(tids_by_rid)):
+        players[tids_by_rid[row['rid']]][f'{row["fname"]} {row["lname"]}'] = row['pid']
+    return team_data, players
+
+
+@with_cursor(write=False)
+def play_state(cursor: sqlite3.Cursor, gid: int) -> parse.PlayState:
+    """The parsing state after the plays stored for a game, to parse only the plays after them"""
+    state = parse.PlayState()
+    for row in cursor.execute('SELECT plyid, type, away_score, home_score FROM Plays WHERE gid=:gid ORDER BY plyid',
+                              {'gid': gid}):
+        state.prev = dict(row)
+        state.last[row['type']] = row['plyid']
+    return state
+
+
+@with_cursor
+def append_plays(cursor: sqlite3.Cursor, gid: int, plays: list[dict],
+                 context: tuple[dict[str, dict], dict[int, dict[str, int]]]) -> int:
+    """Inserts parsed plays of a stored game, resolved with its `game_context`, returning how many were new"""
+    return _insert_plays(cursor, gid, _play_records(plays, *context))
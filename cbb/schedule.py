@@ -3,14 +3,14 @@
 import re
 import logging
 from typing import Union
-from .webscraper import Page
+from .webscraper import get_page
 
 
 def get_schedule_gids(tid: Union[str, int], year: int):
     """Retrieves the gid's for a team's games in the given athletic year"""
     tid = str(tid)
     url = f'https://www.espn.com/mens-college-basketball/team/schedule/_/id/{tid}/season/{year}'
-    page = Page(url)
+    page = get_page(url)
     selector = page.soup.select('tr[data-idx] a[class=AnchorLink][href*=\/game\/]')  # filters html data for game urls
     out = [re.search(r'\d+', str(g))[0] for g in selector]
     if len(out) == 0:
@@ -0,0 +1,160 @@
+"""shard.py: Module for ingesting games in parallel processes, each into its own shard database, and merging them."""
+
+import os
+import sys
+import logging
+import multiprocessing
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable
+from .webscraper import GamePage
+from . import crawl, database, instrument, pbp, throttle
+
+SHARD_DIR = database.MODULE_DIR / 'shards'  # default directory of shard databases
+DEFAULT_PROCESSES = os.cpu_count() or 1
+
+# tables whose rows are keyed by ESPN ids, so that shards never disagree on a key, only on what is known of it
+GAME_TABLES = ('Plays', 'PlayerGameStats')  # one game is only ever ingested in one shard
+MERGE_STATEMENTS = (
+    # (table, statement), in dependency order, where `{cols}` is every column of the table
+    ('Conferences', 'INSERT INTO main.Conferences ({cols}) SELECT {cols} FROM shard.Conferences WHERE true '
+                    'ON CONFLICT DO NOTHING'),
+    ('Teams', 'INSERT INTO main.Teams ({cols}) SELECT {cols} FROM shard.Teams WHERE true '
+              'ON CONFLICT (tid) DO UPDATE SET cid = excluded.cid WHERE Teams.cid IS NULL'),
+    ('Players', 'INSERT INTO main.Players ({cols}) SELECT {cols} FROM shard.Players WHERE true '
+                'ON CONFLICT (pid) DO UPDATE SET pos = coalesce(Players.pos, excluded.pos), '
+                'htft = coalesce(Players.htft, excluded.htft), htin = coalesce(Players.htin, excluded.htin), '
+                'wt = coalesce(Players.wt, excluded.wt) '
+                'WHERE Players.pos IS NULL OR Players.htft IS NULL OR Players.htin IS NULL OR Players.wt IS NULL'),
+    # rid's are assigned per database, so rosters are matched on (tid, season) and player seasons are remapped
+    ('Rosters', 'INSERT INTO main.Rosters (tid, season) SELECT tid, season FROM shard.Rosters WHERE true '
+                'ON CONFLICT DO NOTHING'),
+    ('PlayerSeasons', 'INSERT INTO main.PlayerSeasons (pid, rid) '
+                      'SELECT PS.pid, R.rid FROM shard.PlayerSeasons PS '
+                      'JOIN shard.Rosters SR ON SR.rid = PS.rid '
+                      'JOIN main.Rosters R ON R.tid = SR.tid AND R.season = SR.season WHERE true '
+                      'ON CONFLICT DO NOTHING'),
+    # a shard's games come from their game strips, so they update rows prefilled in the main database as ingest does
+    ('Games', 'INSERT INTO main.Games ({cols}) SELECT {cols} FROM shard.Games WHERE true ' + pbp.GAMES_UPSERT),
+    *((table, f'INSERT INTO main.{table} ({{cols}}) SELECT {{cols}} FROM shard.{table} WHERE true '
+              f'ON CONFLICT DO NOTHING') for table in GAME_TABLES),
+    # a job committed anywhere stays committed, otherwise the shard's attempt is the latest; the larger count of
+    # attempts is kept, so that merging a shard again does not count its attempts twice
+    ('IngestJobs', 'INSERT INTO main.IngestJobs ({cols}) SELECT {cols} FROM shard.IngestJobs WHERE true '
+                   'ON CONFLICT (gid) DO UPDATE SET state = excluded.state, error = excluded.error, '
+                   'attempts = max(IngestJobs.attempts, excluded.attempts), updated = excluded.updated '
+                   "WHERE IngestJobs.state != 'committed'"),
+)
+
+
+def shard_path(shard: str, directory: str | Path = SHARD_DIR) -> Path:
+    return Path(directory) / f'{shard}.db'
+
+
+def by_date(games: dict[int, dict], n: int) -> dict[str, list[int]]:
+    """
+    Splits discovered games (see `discover.season_games`) into `n` shards of consecutive dates with about as many
+    games each, named after their first and last dates
+    """
+    gids = sorted(games, key=lambda gid: (games[gid]['date'], gid))
+    size = -(-len(gids) // n) if gids else 1  # rounded up
+    shards = dict()
+    for start in range(0, len(gids), size):
+        chunk = gids[start:start + size]
+        shards[f'{games[chunk[0]]["date"]}_{games[chunk[-1]]["date"]}'] = chunk
+    return shards
+
+
+def _configure(home: str, url_template: str, budgets: dict[str, float], rates: dict[str, float], processes: int):
+    """Points a worker process at the parent's site, with an even share of the parent's rate and budget per host"""
+    pbp.ESPN_HOME = home
+    GamePage.URL_TEMPLATE = url_template
+    throttle._limiter = throttle.RateLimiter({host: budget / processes for host, budget in budgets.items()})
+    for host, rate in rates.items():
+        throttle._limiter.host(f'http://{host}/').rate = rate / processes
+
+
+def ingest_shard(path: str | Path, gids: list[int], **kwargs) -> crawl.CrawlStats:
+    """
+    Crawls the games into a shard database with the full schema but no secondary indexes, which only the merged
+    database needs, in a worker process of its own (see `crawl_sharded`)
+    """
+    database.open_db(path)
+    database.init_schema()
+    database.drop_indexes()
+    return crawl.crawl(gids, assume_gid_from_pbp=True, **kwargs)
+
+
+def crawl_sharded(shards: dict[str, list[int]], directory: str | Path = SHARD_DIR,
+                  processes: int = DEFAULT_PROCESSES, **kwargs) -> dict[str, crawl.CrawlStats]:
+    """
+    Crawls each shard's games into its own database, in up to `processes` processes at once, returning the crawl
+    stats by shard. Shards are kept on disk, so a failed shard can be crawled again before they are `merge`d.
+
+    Each process fetches, parses (in threads, see `crawl.crawl`'s `workers`) and writes its own games, so writes no
+    longer serialize on a single database, at the cost of teams shared by shards being scraped once per shard.
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    processes = max(1, min(processes, len(shards)))
+    limiter = throttle.limiter()
+    config = pbp.ESPN_HOME, GamePage.URL_TEMPLATE, dict(limiter.budgets), limiter.rates(), processes
+    kwargs.setdefault('workers', 0)
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context(crawl.POOL_START_METHOD),
+                             initializer=_configure, initargs=config) as pool:
+        futures = {shard: pool.submit(ingest_shard, shard_path(shard, directory), gids, **kwargs)
+                   for shard, gids in shards.items()}
+        stats = {shard: future.result() for shard, future in futures.items()}
+    for shard, s in stats.items():
+        logging.info(f'Shard {shard}: {s}')
+    return stats
+
+
+def _columns(cursor: sqlite3.Cursor, table: str) -> str:
+    return ', '.join(row['name'] for row in cursor.execute(f'PRAGMA main.table_info({table})'))
+
+
+def merge(shards: Iterable[str | Path]) -> dict[str, int]:
+    """
+    Merges shard databases into the main database, returning the rows inserted or updated per table.
+
+    Each shard is attached and copied table by table with one `INSERT ... SELECT` each, keeping rows already in the
+    main database and filling in what they miss. Secondary indexes are dropped first and rebuilt once at the end,
+    rather than maintained row by row.
+    """
+    counts = dict.fromkeys((table for table, _ in MERGE_STATEMENTS), 0)
+    database.init_schema()
+    dropped = database.drop_indexes()
+    with database.conn() as c:
+        cursor = c.cursor()
+        statements = [(table, sql.format(cols=_columns(cursor, table))) for table, sql in MERGE_STATEMENTS]
+        for path in shards:
+            cursor.execute('ATTACH DATABASE ? AS shard', (str(path),))
+            try:
+                with instrument.timed('merge_seconds'):
+                    for table, sql in statements:
+                        n = cursor.execute(sql).rowcount
+                        counts[table] += n
+                        instrument.rows(table, n)
+                    c.commit()
+            except BaseException:
+                c.rollback()  # so that the shard can be detached
+                raise
+            finally:
+                cursor.execute('DETACH DATABASE shard')
+            logging.info(f'Merged {path}')
+    database.create_indexes()
+    logging.info(f'Rebuilt {len(dropped)} indexes after merging: {counts}')
+    return counts
+
+
+def crawl_and_merge(shards: dict[str, list[int]], directory: str | Path = SHARD_DIR,
+                    processes: int = DEFAULT_PROCESSES, **kwargs) -> dict[str, int]:
+    """Crawls every shard (see `crawl_sharded`) and merges them into the main database, returning the merged rows"""
+    crawl_sharded(shards, directory, processes, **kwargs)
+    return merge(shard_path(shard, directory) for shard in shards)
+
+
+if __name__ == '__main__':
+    # merges the given shard databases, or every one in the default directory
+    print(merge(sys.argv[1:] or sorted(SHARD_DIR.glob('*.db'))))
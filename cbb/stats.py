@@ -0,0 +1,83 @@
+"""stats.py: Module for maintaining the PlayerGameStats box score table from Plays."""
+
+import sqlite3
+from .database import with_cursor
+from . import instrument
+
+FG_SUBTYPES = ('3PJ', '3FG', '2PJ', '2PL', '2PD', '2PT', '2PH', '2FG')  # field goal subtypes in Plays
+STAT_COLUMNS = ('fgm', 'fga', *(f'fg{ma}_{s.lower()}' for s in FG_SUBTYPES for ma in 'ma'),
+                'ftm', 'fta', 'oreb', 'dreb', 'ast', 'stl', 'blk', 'tov', 'pf', 'pts')
+
+# aggregate of each stat over a player's credited plays (see `_CREDITS_SQL`)
+_STAT_EXPRS = {
+    'fgm': "SUM(type = 'SHT' AND ifnull(subtype, '') != '1FT' AND pts > 0)",
+    'fga': "SUM(type = 'SHT' AND ifnull(subtype, '') != '1FT')",
+    **{f'fgm_{s.lower()}': f"SUM(type = 'SHT' AND subtype = '{s}' AND pts > 0)" for s in FG_SUBTYPES},
+    **{f'fga_{s.lower()}': f"SUM(type = 'SHT' AND subtype = '{s}')" for s in FG_SUBTYPES},
+    'ftm': "SUM(type = 'SHT' AND subtype = '1FT' AND pts > 0)",
+    'fta': "SUM(type = 'SHT' AND subtype = '1FT')",
+    'oreb': "SUM(type = 'REB' AND subtype = 'OFF')",
+    'dreb': "SUM(type = 'REB' AND subtype = 'DEF')",
+    'ast': "SUM(type = 'AST')",
+    'stl': "SUM(type = 'STL')",
+    'blk': "SUM(type = 'BLK')",
+    'tov': "SUM(type = 'TOV')",
+    'pf': "SUM(type = 'FL')",
+    'pts': "SUM(CASE WHEN type = 'SHT' THEN ifnull(pts, 0) ELSE 0 END)",
+}
+
+# every play credited to a player, with assists credited as their own plays
+_CREDITS_SQL = '''
+    WITH Credits (pid, gid, tid, type, subtype, pts) AS (
+        SELECT plyr, gid, tid, type, subtype, pts_scored FROM Plays WHERE plyr IS NOT NULL {filter}
+        UNION ALL
+        SELECT plyr_ast, gid, tid, 'AST', NULL, 0 FROM Plays WHERE plyr_ast IS NOT NULL {filter})
+    INSERT INTO PlayerGameStats (pid, gid, tid, {columns})
+    SELECT pid, gid, max(tid), {exprs}
+    FROM Credits
+    GROUP BY pid, gid
+    ON CONFLICT (pid, gid) DO UPDATE SET tid = excluded.tid, {updates}'''
+
+
+def _stats_sql(filter_: str = '') -> str:
+    return _CREDITS_SQL.format(filter=filter_,
+                               columns=', '.join(STAT_COLUMNS),
+                               exprs=', '.join(_STAT_EXPRS[c] for c in STAT_COLUMNS),
+                               updates=', '.join(f'{c} = excluded.{c}' for c in STAT_COLUMNS))
+
+
+_GAME_STATS_SQL = _stats_sql('AND gid = :gid')
+_ALL_STATS_SQL = _stats_sql()
+
+
+def update_game_stats(cursor: sqlite3.Cursor, gid: int):
+    """Recomputes the box score of every player in a game from its plays, within the caller's transaction."""
+    cursor.execute(_GAME_STATS_SQL, {'gid': gid})
+    instrument.rows('PlayerGameStats', cursor.rowcount)
+
+
+@with_cursor
+def rebuild_game_stats(cursor: sqlite3.Cursor) -> int:
+    """Recomputes PlayerGameStats from scratch, returning the number of rows written."""
+    cursor.execute('DELETE FROM PlayerGameStats')
+    cursor.execute(_ALL_STATS_SQL)
+    return cursor.execute('SELECT count(*) FROM PlayerGameStats').fetchone()[0]
+
+
+@with_cursor(write=False)
+def leaders(cursor: sqlite3.Cursor, stat: str, season: int | None = None, limit: int = 10) -> list[sqlite3.Row]:
+    """Lists the leaders in a stat's total for a season, or for their careers if no season is given."""
+    if stat not in STAT_COLUMNS:
+        raise ValueError(f'unknown stat {stat!r}, expected one of {STAT_COLUMNS}')
+    season_filter = 'WHERE G.season = :season' if season is not None else ''
+    return cursor.execute(f'''SELECT P.fname || ' ' || P.lname AS Name, SUM(S.{stat}) AS Total
+                              FROM PlayerGameStats S JOIN Games G ON S.gid = G.gid
+                                                     JOIN Players P ON S.pid = P.pid
+                              {season_filter}
+                              GROUP BY S.pid
+                              ORDER BY Total DESC
+                              LIMIT :limit''', {'season': season, 'limit': limit}).fetchall()
+
+
+if __name__ == '__main__':
+    print(f'Rebuilt {rebuild_game_stats()} PlayerGameStats rows')
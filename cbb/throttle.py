@@ -0,0 +1,161 @@
+"""throttle.py: Module with the adaptive per-host rate limiter and retry backoff shared by every fetch path."""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+import email.utils
+import urllib.parse
+
+MAX_TRIES = 8  # attempts per request before giving up
+BACKOFF_BASE = 0.25  # seconds, doubled on every retry
+BACKOFF_CAP = 30.  # seconds
+THROTTLE_STATUSES = (429, 503)  # the server is asking us to slow down
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+INITIAL_RATE = 5.  # requests per second
+MIN_RATE = 0.5
+DEFAULT_MAX_RATE = 50.
+ADDITIVE_INCREASE = 1.  # requests per second gained per second of successful requests
+MULTIPLICATIVE_DECREASE = 0.5
+DECREASE_COOLDOWN = 1.  # seconds, throttles within this window of the last decrease count once
+BURST = 2.  # tokens the bucket holds at most
+INITIAL_WINDOW = 4.  # requests in flight per host
+MAX_WINDOW = 8.
+POLL_INTERVAL = 0.01  # seconds between checks while the in-flight window is full
+
+# per-host budgets: the most requests per second the limiter will ever grow to
+HOST_BUDGETS = {
+    'www.espn.com': 20.,
+}
+
+
+def retry_after(value: str | None) -> float | None:
+    """Parses a `Retry-After` header, given in seconds or as an HTTP date, into seconds from now."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0., when.timestamp() - time.time())
+
+
+def backoff(attempt: int, retry_after_: float | None = None) -> float:
+    """Seconds to wait before retry number `attempt`: full jitter exponential backoff, or longer if asked to."""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    return max(delay, retry_after_ or 0.)
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class HostLimiter:
+    """
+    Token bucket for one host with additive-increase/multiplicative-decrease control of both its rate and its window
+    of requests in flight.
+
+    Every successful request grows the rate by about `ADDITIVE_INCREASE` per second and the window by one per window
+    of requests, while a throttle (429/503) halves both and pauses the host for its `Retry-After`, so the request rate
+    settles just under what the server accepts.
+    """
+
+    def __init__(self, host: str, max_rate: float = DEFAULT_MAX_RATE):
+        self.host = host
+        self.max_rate = max_rate
+        self.rate = min(INITIAL_RATE, max_rate)
+        self.window = INITIAL_WINDOW
+        self.in_flight = 0
+        self._tokens = BURST
+        self._refilled = time.monotonic()
+        self._resume_at = 0.
+        self._decreased_at = 0.
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (f'HostLimiter(host={self.host}, rate={self.rate:.2f}/s, window={self.window:.1f}, '
+                f'in_flight={self.in_flight})')
+
+    def _reserve(self, window: bool = True) -> float:
+        """Takes a token and a slot in the window if both are free, otherwise returns how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._resume_at:
+                return self._resume_at - now
+            self._tokens = min(BURST, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if window and self.in_flight >= int(self.window):
+                return POLL_INTERVAL
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+            self.in_flight += 1
+            return 0.
+
+    def acquire(self):
+        # a blocking request made from a running event loop's thread would wait forever on async requests holding
+        # the window, since they cannot complete until it returns, so it only waits for a token
+        window = not _in_event_loop()
+        while (delay := self._reserve(window)) > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        while (delay := self._reserve()) > 0:
+            await asyncio.sleep(delay)
+
+    def release(self, status: int | None, retry_after_: float | None = None):
+        """Returns a slot in the window, adapting to the response status (None for a failed connection)."""
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status in THROTTLE_STATUSES:
+                if retry_after_:
+                    self._resume_at = max(self._resume_at, now + retry_after_)
+                if now - self._decreased_at >= DECREASE_COOLDOWN:
+                    self._decreased_at = now
+                    self.rate = max(MIN_RATE, self.rate * MULTIPLICATIVE_DECREASE)
+                    self.window = max(1., self.window * MULTIPLICATIVE_DECREASE)
+                    logging.info(f'Throttled by {self.host} ({status}), slowing to {self.rate:.2f} requests/s')
+            elif status is not None and status < 500:
+                self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE / self.rate)
+                self.window = min(MAX_WINDOW, self.window + 1 / self.window)
+
+
+class RateLimiter:
+    """The `HostLimiter`s of every host requested, created on first use with the host's budget."""
+
+    def __init__(self, budgets: dict[str, float] | None = None):
+        self.budgets = HOST_BUDGETS if budgets is None else budgets
+        self._hosts: dict[str, HostLimiter] = dict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'RateLimiter(hosts={list(self._hosts.values())})'
+
+    def rates(self) -> dict[str, float]:
+        """The current rate of every host requested so far"""
+        with self._lock:
+            return {host: limiter.rate for host, limiter in self._hosts.items()}
+
+    def host(self, url: str) -> HostLimiter:
+        host = urllib.parse.urlsplit(url).hostname or ''
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = HostLimiter(host, self.budgets.get(host, DEFAULT_MAX_RATE))
+            return self._hosts[host]
+
+
+_limiter = RateLimiter()  # singular global rate limiter
+
+
+def limiter() -> RateLimiter:
+    return _limiter
@@ -1,24 +1,51 @@
 """webscraper.py: Module with utility classes for webscraping."""
 
 import re
-import logging
-import urllib.request
-import urllib.error
 import time
-from http.client import HTTPResponse
+import asyncio
+import logging
+import aiohttp
+import threading
+import weakref
 from bs4 import BeautifulSoup
 from enum import Enum, auto
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 from typing import Union
+from . import cache, client, extract, instrument
+
+RECENT_PAGES = 64  # pages the registry keeps after they are no longer used
+DEFAULT_HOLD_BYTES = 2 * 1024 * 1024  # bytes reserved for a holder of a byte budget until it knows its size
+RE_PAGE_KIND = re.compile(r'/(playbyplay|boxscore|game|recap|player|standings|scoreboard|team/schedule|team)/')
+
 
-MAX_HTTP_TRIES = 10
+def page_kind(url: str) -> str:
+    """The kind of ESPN page at a URL (e.g., playbyplay or player), which labels its metrics"""
+    match = RE_PAGE_KIND.search(url)
+    return match[1].replace('/', '_') if match else 'other'
 
 
 class Page:
-    def __init__(self, url: str):
+    """
+    A page fetched on first use, holding only its raw content and (once used) its parsed HTML.
+
+    Once released (see `release`), a page holds nothing, and is fetched again if it is used again.
+
+    A page with an `until` predicate only reads its document up to where the predicate holds for the prefix read so
+    far (e.g., once the one embedded object needed of it is complete), and its content is that prefix.
+    """
+
+    __slots__ = ('_url', '_until', '_key', '_content', '_soup', '_invalid', '_lock', '_task', '__weakref__')
+
+    def __init__(self, url: str, until: client.Until | None = None):
         self._url: str = url
-        self._response: HTTPResponse = None
+        self._until = until
+        self._key = url if until is None else f'{url}#head'  # so that a prefix is never cached as the whole page
+        self._content: bytes = None
         self._soup: BeautifulSoup = None
         self._invalid: bool | None = None
+        self._lock = threading.Lock()  # one sync request at a time
+        self._task: asyncio.Future | None = None  # the async request in flight, awaited by every caller
 
     def __repr__(self):
         return f'Page(url={self.url})'
@@ -31,38 +58,81 @@ class Page:
     def invalid(self):
         return self._invalid
 
+    def _resolve(self, resp: client.Response):
+        """Keeps the content of a successful response, and none of the response itself"""
+        if resp.status == 200:
+            self._invalid = False
+            self._content = resp.content
+            cache.put(self._key, self._content)
+        else:
+            self._invalid = True
+            logging.warning(f'Page(url={self.url}) could not be resolved ({resp.status}: {resp.reason})')
+
+    def _observe(self, start: float, resp: client.Response):
+        kind = page_kind(self._url)
+        instrument.observe('page_fetch_seconds', time.perf_counter() - start, kind=kind)
+        instrument.observe('page_bytes', len(resp.content), instrument.BYTES_BUCKETS, kind=kind)
+
+    def _load_cached(self) -> bool:
+        if self._content is None:
+            self._content = cache.get(self._key)
+            if self._content is not None:
+                self._invalid = False
+                instrument.inc('page_cache_hits_total', kind=page_kind(self._url))
+        return self._content is not None
+
     @property
-    def response(self):
-        if self._response is None:
-            finished = False
-            tries = 0
-            while not finished and tries <= MAX_HTTP_TRIES:
-                try:
-                    self._response = urllib.request.urlopen(self._url)
-                    finished = True
-                except urllib.error.HTTPError as e:
-                    match e.code:
-                        case 503:
-                            # 503: Service Unavailable, should resolve by executing again
-                            time.sleep(0.01)
-                        case _:
-                            self._invalid = True
-                            logging.warning(f'Page(url={self.url}) could not be resolved ({e.code}: {e.reason})')
-                            finished = True
-                else:
-                    self._invalid = False
-                finally:
-                    tries += 1
-        return self._response
+    def content(self) -> bytes | None:
+        """The page content, read over the shared client (which retries throttled requests with backoff) if needed"""
+        if not self._load_cached():
+            with self._lock:
+                if self._content is None and self._invalid is None:
+                    start = time.perf_counter()
+                    resp = client.get(self._url, until=self._until)
+                    self._observe(start, resp)
+                    self._resolve(resp)
+        return self._content
+
+    async def _fetch(self, session: aiohttp.ClientSession | None) -> bytes | None:
+        try:
+            start = time.perf_counter()
+            resp = await client.fetch(self._url, session, until=self._until)
+            self._observe(start, resp)
+            self._resolve(resp)
+            return self._content
+        finally:
+            self._task = None
+
+    async def fetch(self, session: aiohttp.ClientSession | None = None) -> bytes | None:
+        """
+        Asynchronously loads the page content through the given session, or the shared session by default.
+
+        Concurrent calls share a single request.
+        """
+        if self._load_cached() or self._invalid is not None:
+            return self._content
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._fetch(session))
+        return await self._task  # rather than the content after it, which the first caller may have released
+
+    def release(self):
+        """
+        Drops the content and parsed HTML once they are consumed. A page used again after being released is read
+        again, from the response cache if it is enabled and holds the page, or over the network otherwise.
+        """
+        self._content = self._soup = None
+        if not self._invalid:
+            self._invalid = None
 
     @property
     def soup(self):
-        if self.invalid:
-            logging.warning('Page could not be resolved, can\'t parse HTML')
-            return None
         if self._soup is None:
-            html = str(self.response.read())
-            self._soup = BeautifulSoup(html, 'html.parser')
+            content = self.content
+            if self.invalid:
+                logging.warning('Page could not be resolved, can\'t parse HTML')
+                return None
+            with instrument.timed('extract_seconds', what='soup'):
+                self._soup = BeautifulSoup(content, 'html.parser')
         return self._soup
 
 
@@ -75,6 +145,8 @@ class GamePage(Page):
         BOX = auto()
         PLAYS = auto()
 
+    __slots__ = ('_gid', '_recap', '_box', '_plays', '_package')
+
     def __init__(self, gid: Union[str, int]):
         gid = str(gid)
         assert (re.match(r'^\d*$', gid))
@@ -82,6 +154,7 @@ class GamePage(Page):
         self._recap = None
         self._box = None
         self._plays = None
+        self._package = None
         Page.__init__(self, GamePage.URL_TEMPLATE.format('game', self.gid))
 
     def __repr__(self):
@@ -109,17 +182,178 @@ class GamePage(Page):
     @property
     def recap(self):
         if self._recap is None:
-            self._recap = Page(self._get_url(category=GamePage.Category.RECAP))
+            self._recap = get_page(self._get_url(category=GamePage.Category.RECAP))
         return self._recap
 
     @property
     def boxscore(self):
         if self._box is None:
-            self._box = Page(self._get_url(category=GamePage.Category.BOX))
+            self._box = get_page(self._get_url(category=GamePage.Category.BOX))
         return self._box
 
     @property
     def plays(self):
         if self._plays is None:
-            self._plays = Page(self._get_url(category=GamePage.Category.PLAYS))
+            self._plays = get_page(self._get_url(category=GamePage.Category.PLAYS))
         return self._plays
+
+    @property
+    def package(self) -> dict | None:
+        """The game package embedded in the play-by-play page, see `extract.game_package`"""
+        if self._package is None and self.plays.content is not None:
+            self._package = extract.game_package(self.plays.content)
+        return self._package
+
+    @property
+    def tids(self) -> list[str]:
+        """The tid's for the away[0] and home[1] teams, or an empty list if either is missing"""
+        if self.package is None or self.package.get('gmStrp') is None:
+            return []
+        return extract.game_tids(self.package['gmStrp'])
+
+    def release(self):
+        """Releases the game's pages and its decoded package (see `Page.release`)."""
+        Page.release(self)
+        self._package = None
+        for page in (self._recap, self._box, self._plays):
+            if page is not None:
+                page.release()
+
+    async def load(self, session: aiohttp.ClientSession | None = None) -> bool:
+        """Concurrently fetches the play-by-play and box score pages, returning whether both resolved."""
+        await asyncio.gather(self.plays.fetch(session), self.boxscore.fetch(session))
+        return not (self.plays.invalid or self.boxscore.invalid)
+
+
+class PageRegistry:
+    """
+    The pages of a run by URL, so that every lookup of a URL returns the same page object, and users of a page at the
+    same time share one request for it.
+
+    Pages stay registered while anything still uses them, and the last `recent` pages looked up are kept regardless,
+    which covers pages shared by games in flight together while bounding memory over a long crawl (teams and players,
+    once ingested, are resolved from the database and metadata cache instead). A page is fetched again if it is used
+    after being released or dropped from the registry, e.g., a team page once a rollback clears the metadata cache.
+    Keeping every page so that none is fetched twice would hold a whole crawl in memory; the response cache (see
+    `cache`) is what serves such pages again without a request.
+    """
+
+    def __init__(self, recent: int = RECENT_PAGES):
+        self.recent = recent
+        self._pages: weakref.WeakValueDictionary[str, Page] = weakref.WeakValueDictionary()
+        self._recent: OrderedDict[str, Page] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'PageRegistry(pages={len(self._pages)})'
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key: str, factory):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                page = self._pages[key] = factory()
+            self._recent[key] = page
+            self._recent.move_to_end(key)
+            if len(self._recent) > self.recent:
+                self._recent.popitem(last=False)
+            return page
+
+
+class ByteBudget:
+    """
+    A ceiling on the bytes of page content held at once by concurrent holders, e.g., the games a crawl has in flight.
+
+    Each holder is admitted with a reservation of the mean size of the holders before it, and then accounts for what
+    it actually holds as it reads pages, until it is done with them. Holders wait for admission while the bytes held
+    and reserved would exceed `max_bytes`, except that one is always admitted when none are in flight, so a holder
+    larger than the ceiling still proceeds on its own.
+    """
+
+    def __init__(self, max_bytes: int | None = None):
+        self.max_bytes = max_bytes  # or None for no ceiling
+        self.held = 0
+        self.peak = 0
+        self.holders = 0
+        self._sizes = [0, 0]  # total bytes and number of released holders, for the reservation of new ones
+        self._cond: asyncio.Condition | None = None
+
+    def __repr__(self):
+        return f'ByteBudget(held={self.held}, max_bytes={self.max_bytes}, holders={self.holders})'
+
+    @property
+    def reservation(self) -> int:
+        total, n = self._sizes
+        return total // n if n else DEFAULT_HOLD_BYTES
+
+    def _admits(self, n: int) -> bool:
+        return self.max_bytes is None or not self.holders or self.held + n <= self.max_bytes
+
+    @asynccontextmanager
+    async def hold(self):
+        """Waits for admission, and yields the holder, whose `size` is set to the bytes it holds"""
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        holder = _Holder(self, self.reservation)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._admits(holder.size))
+            self.holders += 1
+            self._add(holder.size)
+        try:
+            yield holder
+        finally:
+            self._sizes[0] += holder.peak
+            self._sizes[1] += 1
+            async with self._cond:
+                self.holders -= 1
+                self._add(-holder.size)
+                self._cond.notify_all()
+
+    def _add(self, n: int):
+        self.held += n
+        self.peak = max(self.peak, self.held)
+
+
+class _Holder:
+    __slots__ = ('_budget', '_size', 'peak')
+
+    def __init__(self, budget: ByteBudget, size: int):
+        self._budget = budget
+        self._size = size
+        self.peak = 0  # the most bytes it held, which excludes its reservation
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @size.setter
+    def size(self, n: int):
+        self._budget._add(n - self._size)
+        self._size = n
+        self.peak = max(self.peak, n)
+
+
+_registry = PageRegistry()  # registry of the current run
+
+
+@contextmanager
+def registry():
+    """Starts a fresh page registry for a run (e.g., a crawl), restoring the previous one afterwards."""
+    global _registry
+    prev, _registry = _registry, PageRegistry()
+    try:
+        yield _registry
+    finally:
+        _registry = prev
+
+
+def get_page(url: str, until: client.Until | None = None) -> Page:
+    """The registered page for a URL, created on first use, which only reads up to `until` if given (see `Page`)."""
+    return _registry.get(url if until is None else f'head:{url}', lambda: Page(url, until))
+
+
+def get_game_page(gid: Union[str, int]) -> GamePage:
+    """The registered game page for a gid, created on first use."""
+    return _registry.get(f'game:{gid}', lambda: GamePage(gid))
@@ -0,0 +1,382 @@
+import context
+import gzip
+import json
+import random
+import threading
+import time
+import http.server
+import urllib.parse
+from bs4 import BeautifulSoup
+from contextlib import contextmanager
+from pathlib import Path
+from cbb import client, discover, extract, parse, pbp, throttle
+from cbb.webscraper import GamePage
+
+CORPUS_DIR = Path(__file__).parent / 'corpus'  # recorded or synthesized pages, one gzip file per URL path
+ESPN_ORIGIN = 'https://www.espn.com'
+ESPN_PREFIX = '/mens-college-basketball'
+WRITE_SIZE = 16 * 1024  # bytes of a body the server writes at a time
+
+SYNTHETIC_TEAMS = 12
+SYNTHETIC_PLAYERS = 8  # per team
+SYNTHETIC_FIRST_GID = 401000
+SYNTHETIC_SEASON = 2024
+SYNTHETIC_GAME_LOG = 2000  # rows of the game log after a player's header, the bulk of the page as on ESPN
+
+
+class Corpus:
+    """Pages by URL path (e.g., `/mens-college-basketball/playbyplay/_/gameId/401000`), stored gzipped on disk."""
+
+    def __init__(self, directory: str | Path = CORPUS_DIR):
+        self.directory = Path(directory)
+
+    def __repr__(self):
+        return f'Corpus(directory={self.directory})'
+
+    def _file(self, path: str) -> Path:
+        return self.directory / f'{path.strip("/")}.gz'
+
+    def get(self, path: str) -> bytes | None:
+        try:
+            return gzip.decompress(self._file(path).read_bytes())
+        except FileNotFoundError:
+            return None
+
+    def put(self, path: str, content: bytes):
+        file = self._file(path)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(gzip.compress(content))
+
+    def paths(self) -> list[str]:
+        return sorted('/' + str(file.relative_to(self.directory))[:-len('.gz')]
+                      for file in self.directory.rglob('*.gz'))
+
+    def gids(self) -> list[int]:
+        return [int(path.rsplit('/', 1)[1]) for path in self.paths() if '/playbyplay/_/gameId/' in path]
+
+
+def record(urls: list[str], corpus: Corpus) -> int:
+    """Records the pages at the given ESPN URLs into a corpus, returning how many were found."""
+    found = 0
+    for url, resp in zip(urls, client.client().get_many(urls)):
+        if resp.status == 200:
+            corpus.put(urllib.parse.urlsplit(url).path, resp.content)
+            found += 1
+    return found
+
+
+def record_games(gids: list[int], corpus: Corpus) -> int:
+    """Records every page ingesting the given games reads, i.e., those of the games, their players and teams."""
+    game_urls = [GamePage.URL_TEMPLATE.format(category, gid) for gid in gids for category in ('playbyplay', 'boxscore')]
+    record(game_urls, corpus)
+    pids, tids = set(), set()
+    for gid in gids:
+        box = corpus.get(urllib.parse.urlsplit(GamePage.URL_TEMPLATE.format('boxscore', gid)).path)
+        if box is not None:
+            pids.update(pid for pids_ in parse.box_pids(box).values() for pid in pids_)
+        plays = corpus.get(urllib.parse.urlsplit(GamePage.URL_TEMPLATE.format('playbyplay', gid)).path)
+        pkg = extract.game_package(plays) if plays is not None else None
+        if pkg is not None and pkg.get('gmStrp') is not None:
+            tids.update(extract.game_tids(pkg['gmStrp']))
+    record([f'{ESPN_ORIGIN}{ESPN_PREFIX}/player/_/id/{pid}' for pid in pids], corpus)
+    record([url for tid in tids for url in (f'{ESPN_ORIGIN}{ESPN_PREFIX}/team/_/id/{tid}',
+                                            f'{ESPN_ORIGIN}{ESPN_PREFIX}/team/schedule/_/id/{tid}')], corpus)
+    standings = set()
+    for tid in tids:
+        team = corpus.get(f'{ESPN_PREFIX}/team/_/id/{tid}')
+        link = BeautifulSoup(team, 'html.parser').find('a', string='Full Standings') if team is not None else None
+        if link is not None:
+            standings.add(link['href'])
+    record(sorted(standings), corpus)
+    return len(corpus.paths())
+
+
+def _state(doc: dict) -> bytes:
+    return (b"<html><body><script>window['__espnfitt__']=" + json.dumps(doc, separators=(',', ':')).encode()
+            + b";</script></body></html>")
+
+
+def _game_teams(gid: int) -> tuple[int, int]:
+    """The home and away tid of a synthetic game"""
+    home, away = random.Random(gid).sample(range(1, SYNTHETIC_TEAMS + 1), 2)
+    return home, away
+
+
+def _game_start(gid: int) -> str:
+    return f'{SYNTHETIC_SEASON - 1}-12-{gid % 28 + 1:02d}T19:00Z'
+
+
+def _scoreboard_page(gids: list[int]) -> bytes:
+    evts = [{'id': str(gid), 'date': _game_start(gid), 'neutralSite': False, 'isConferenceGame': True,
+             'status': {'state': 'post'},
+             'competitors': [{'id': str(tid), 'isHome': ha == 'home'} for ha, tid in zip(('home', 'away'),
+                                                                                        _game_teams(gid))]}
+            for gid in gids]
+    return _state({'page': {'content': {'scoreboard': {'evts': evts}}}})
+
+
+def _player_name(pid: int) -> str:
+    return f'First{pid} Last{pid}'
+
+
+def _plays_page(gid: int) -> bytes:
+    r = random.Random(gid)
+    home, away = _game_teams(gid)
+    tids = {'home': home, 'away': away}
+    other = {'home': 'away', 'away': 'home'}
+    plays, shots, groups = [], [], []
+    score = {'home': 0, 'away': 0}
+
+    def player(ha):
+        return _player_name(tids[ha] * 100 + r.randrange(SYNTHETIC_PLAYERS))
+
+    def add(text, ha, period, scoring=False, shot=False):
+        plyid = f'{gid}{len(plays) + 1}'
+        play = {'id': plyid, 'clock': {'displayValue': f'{19 - len(plays) % 20}:{len(plays) % 60:02d}'},
+                'period': {'number': period}, 'awayScore': score['away'], 'homeScore': score['home'],
+                'text': text, 'scoringPlay': scoring}
+        if ha is not None:
+            play['homeAway'] = ha
+        plays.append(play)
+        if shot:
+            shots.append({'id': plyid, 'coordinate': {'x': r.randrange(50), 'y': r.randrange(47)}})
+
+    for period in (1, 2):
+        start = len(plays)
+        for _ in range(150):
+            ha = r.choice(('home', 'away'))
+            k = r.randrange(10)
+            if k < 4:
+                name = player(ha)
+                sub = r.choice(('Three Point Jumper', 'Jumper', 'Layup', 'Dunk'))
+                made = r.random() < 0.5
+                if made:
+                    score[ha] += 3 if sub.startswith('Three') else 2
+                    add(f'{name} made {sub}.' + (f' Assisted by {player(ha)}.' if r.random() < 0.5 else ''),
+                        ha, period, True, True)
+                else:
+                    add(f'{name} missed {sub}.', ha, period, False, True)
+                    reb = r.choice(('home', 'away'))
+                    who = f'Team{tids[reb]}' if r.random() < 0.1 else player(reb)
+                    add(f'{who} {"Offensive" if reb == ha else "Defensive"} Rebound.', reb, period)
+            elif k < 6:
+                add(f'Foul on {player(ha)}.', ha, period)
+                shooter = player(other[ha])
+                for _ in range(2):
+                    made = r.random() < 0.7
+                    score[other[ha]] += made
+                    add(f'{shooter} {"made" if made else "missed"} Free Throw.', other[ha], period, made)
+            elif k < 8:
+                add(f'{player(ha)} Turnover.' if r.random() < 0.9 else f'Team{tids[ha]} Turnover.', ha, period)
+                add(f'{player(other[ha])} Steal.', other[ha], period)
+            elif k < 9:
+                add(f'Team{tids[ha]} Timeout', ha, period)
+            else:
+                add('Official TV Timeout', None, period)
+        add(f'End of {period}{"st" if period == 1 else "nd"} Half', None, period)
+        groups.append(plays[start:])
+    game_strip = {'dt': _game_start(gid), 'neutralSite': False,
+                  'isConferenceGame': True, 'status': {'state': 'post'},
+                  'tms': [{'id': str(tid), 'isHome': ha == 'home',
+                           'links': f'{ESPN_ORIGIN}{ESPN_PREFIX}/team/_/id/{tid}'} for ha, tid in tids.items()]}
+    return _state({'page': {'content': {'gamepackage': {'gmStrp': game_strip, 'pbp': {'playGrps': groups},
+                                                        'shtChrt': {'plays': shots}}}}})
+
+
+def _box_page(gid: int) -> bytes:
+    home, away = _game_teams(gid)
+    return b'<html><table>' + b''.join(
+        b'<tbody class="Table__TBODY">' + b''.join(
+            f'<tr><td><a class="AnchorLink truncate db Boxscore__AthleteName" '
+            f'data-player-uid="s:40~l:41~a:{tid * 100 + k}">x</a></td></tr>'.encode()
+            for k in range(SYNTHETIC_PLAYERS)) + b'</tbody>'
+        for tid in (away, home)) + b'</table></html>'
+
+
+def _player_page(pid: int) -> bytes:
+    fname, lname = _player_name(pid).split()
+    game_log = [{'gid': str(SYNTHETIC_FIRST_GID + k), 'min': (pid + 7 * k) % 40, 'pts': (pid + 11 * k) % 30,
+                 'reb': (pid + 5 * k) % 12, 'ast': (pid + 3 * k) % 10, 'fg': f'{k % 10}-{(pid + k) % 10 + 10}'}
+                for k in range(SYNTHETIC_GAME_LOG)]
+    return _state({'page': {'content': {'player': {
+        'plyrHdr': {'ath': {'fNm': fname, 'lNm': lname, 'posAbv': 'SG', 'htwt': '6\' 3", 190 lbs'}},
+        'gmlog': {'events': game_log}}}}})
+
+
+def synthesize(corpus: Corpus, n_games: int) -> list[int]:
+    """Writes the pages of `n_games` synthetic games, with their players, teams and season scoreboard, into a corpus."""
+    gids = list(range(SYNTHETIC_FIRST_GID, SYNTHETIC_FIRST_GID + n_games))
+    schedules = {tid: [] for tid in range(1, SYNTHETIC_TEAMS + 1)}
+    for gid in gids:
+        corpus.put(f'{ESPN_PREFIX}/playbyplay/_/gameId/{gid}', _plays_page(gid))
+        corpus.put(f'{ESPN_PREFIX}/boxscore/_/gameId/{gid}', _box_page(gid))
+        for tid in _game_teams(gid):
+            schedules[tid].append(gid)
+    for tid, team_gids in schedules.items():
+        group = tid % 3 + 1
+        corpus.put(f'{ESPN_PREFIX}/team/_/id/{tid}',
+                   f'<html><a href="{ESPN_ORIGIN}{ESPN_PREFIX}/standings/_/group/{group}">Full Standings</a>'
+                   f'</html>'.encode())
+        corpus.put(f'{ESPN_PREFIX}/team/schedule/_/id/{tid}',
+                   f'<html><span class="flex flex-wrap"><span>Team{tid}</span><span>Mascot{tid}</span></span>'
+                   f'</html>'.encode())
+        corpus.put(f'{ESPN_PREFIX}/team/schedule/_/id/{tid}/season/{SYNTHETIC_SEASON}', (
+            '<html><table>' + ''.join(f'<tr data-idx="{i}"><td><a class="AnchorLink" '
+                                      f'href="{ESPN_ORIGIN}{ESPN_PREFIX}/game/_/gameId/{gid}">W</a></td></tr>'
+                                      for i, gid in enumerate(team_gids)) + '</table></html>').encode())
+        for pid in range(tid * 100, tid * 100 + SYNTHETIC_PLAYERS):
+            corpus.put(f'{ESPN_PREFIX}/player/_/id/{pid}', _player_page(pid))
+    for day in discover.season_dates(SYNTHETIC_SEASON):
+        corpus.put(f'{ESPN_PREFIX}/scoreboard/_/date/{day:%Y%m%d}/group/{discover.DIVISION_I}',
+                   _scoreboard_page([gid for gid in gids if _game_start(gid).startswith(day.isoformat())]))
+    for group in (1, 2, 3):
+        corpus.put(f'{ESPN_PREFIX}/standings/_/group/{group}', (
+            f'<html><h1 class="headline headline__h1 dib">C{group} Men\'s College Basketball Standings - '
+            f'{SYNTHETIC_SEASON - 1}-{SYNTHETIC_SEASON % 100}</h1>'
+            f'<div class="Table__Title">Conference {group}</div></html>').encode())
+    return gids
+
+
+class EspnServer:
+    """
+    Local stand-in for espn.com serving a corpus, with links to ESPN rewritten to the server, gzip encoding and
+    ETag validation like the real site, and optional latency and throttling (503) injected into its responses.
+    """
+
+    def __init__(self, corpus: Corpus, latency: float = 0., error_rate: float = 0., retry_after: int | None = None,
+                 seed: int = 0):
+        self.corpus = corpus
+        self.latency = latency  # seconds added to every response
+        self.error_rate = error_rate  # fraction of requests answered with 503 Service Unavailable
+        self.retry_after = retry_after  # seconds sent with each 503, if any
+        self.counters = dict.fromkeys(('requests', 'bytes', 'throttled', 'not_modified', 'missing'), 0)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pages: dict[str, tuple[bytes, bytes, str]] = dict()  # path -> (content, gzipped content, etag)
+        self._server: http.server.ThreadingHTTPServer | None = None
+
+    def __repr__(self):
+        return f'EspnServer(origin={self.origin}, counters={self.counters})'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def origin(self) -> str | None:
+        return f'http://127.0.0.1:{self._server.server_port}' if self._server is not None else None
+
+    @property
+    def home(self) -> str:
+        return f'{self.origin}{ESPN_PREFIX}'
+
+    def _count(self, counter: str, n: int = 1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def preload(self):
+        """Loads and compresses every page of the corpus ahead of serving it, e.g., to keep it out of measurements."""
+        for path in self.corpus.paths():
+            self._page(path)
+
+    def put(self, path: str, content: bytes):
+        """Replaces a page of the corpus, which is served from then on, e.g., as a game in progress goes on."""
+        self.corpus.put(path, content)
+        with self._lock:
+            self._pages.pop(path, None)
+
+    def _page(self, path: str) -> tuple[bytes, bytes, str] | None:
+        with self._lock:
+            page = self._pages.get(path)
+        if page is None:
+            content = self.corpus.get(path)
+            if content is None:
+                return None
+            content = content.replace(ESPN_ORIGIN.encode(), self.origin.encode())
+            page = content, gzip.compress(content, compresslevel=1), f'"{hash(content) & 0xffffffff:x}"'
+            with self._lock:
+                self._pages[path] = page
+        return page
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    pass  # the client hung up, e.g., once it read as much of a page as it needed
+
+            def _empty(self, status: int, headers: dict[str, str]):
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                server._count('requests')
+                if server.latency:
+                    time.sleep(server.latency)
+                with server._lock:
+                    throttled = server._random.random() < server.error_rate
+                if throttled:
+                    server._count('throttled')
+                    return self._empty(503, {'Retry-After': str(server.retry_after)} if server.retry_after else {})
+                page = server._page(urllib.parse.urlsplit(self.path).path)
+                if page is None:
+                    server._count('missing')
+                    return self._empty(404, {})
+                content, compressed, etag = page
+                if self.headers.get('If-None-Match') == etag:
+                    server._count('not_modified')
+                    return self._empty(304, {'ETag': etag})
+                gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+                body = compressed if gzipped else content
+                self.send_response(200)
+                if gzipped:
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                for start in range(0, len(body), WRITE_SIZE):  # so that a client hanging up stops the transfer
+                    self.wfile.write(body[start:start + WRITE_SIZE])
+                    server._count('bytes', len(body[start:start + WRITE_SIZE]))
+
+        return Handler
+
+    def start(self):
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@contextmanager
+def redirect(server: EspnServer, rate: float | None = None):
+    """
+    Points every ESPN URL of the scraper at a running server, with a rate limiter of its own that starts at `rate`
+    requests per second (or the usual initial rate), restoring both afterwards.
+    """
+    prev = pbp.ESPN_HOME, GamePage.URL_TEMPLATE, throttle._limiter
+    pbp.ESPN_HOME = server.home
+    GamePage.URL_TEMPLATE = f'{server.home}/{{}}/_/gameId/{{}}'
+    throttle._limiter = throttle.RateLimiter({'127.0.0.1': max(rate or 0., throttle.DEFAULT_MAX_RATE)})
+    if rate is not None:
+        throttle._limiter.host(server.origin).rate = rate
+    try:
+        yield server
+    finally:
+        pbp.ESPN_HOME, GamePage.URL_TEMPLATE, throttle._limiter = prev
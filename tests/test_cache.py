@@ -0,0 +1,102 @@
+import context
+import gzip
+import tempfile
+import types
+from contextlib import contextmanager
+from cbb import cache, instrument
+from espn_server import ESPN_ORIGIN, ESPN_PREFIX, SYNTHETIC_FIRST_GID, _plays_page, _state
+
+GID = SYNTHETIC_FIRST_GID
+GAME_URL = f'{ESPN_ORIGIN}{ESPN_PREFIX}/playbyplay/_/gameId/{GID}'
+PLAYER_URL = f'{ESPN_ORIGIN}{ESPN_PREFIX}/player/_/id/101'
+SCOREBOARD_URL = f'{ESPN_ORIGIN}{ESPN_PREFIX}/scoreboard/_/date/20231201/group/50'
+TTLS = {
+    # url -> ttl of its page kind
+    PLAYER_URL: None,
+    SCOREBOARD_URL: 5 * 60,
+    f'{ESPN_ORIGIN}{ESPN_PREFIX}/team/schedule/_/id/1': 60 * 60,
+    f'{ESPN_ORIGIN}{ESPN_PREFIX}/standings/_/group/1': 60 * 60,
+    f'{ESPN_ORIGIN}{ESPN_PREFIX}/team/_/id/1': 24 * 60 * 60,
+    f'{ESPN_ORIGIN}{ESPN_PREFIX}/schedule': cache.DEFAULT_TTL,
+}
+
+
+def in_progress_page() -> bytes:
+    """A game page in progress that embeds another game that is final, as the scoreboard strip of a real page does"""
+    return _state({'page': {'content': {
+        'scoreboard': {'evts': [{'id': str(GID + 1), 'status': {'state': 'post'}}]},
+        'gamepackage': {'gmStrp': {'status': {'state': 'in'}}, 'pbp': {'playGrps': []}},
+    }}})
+
+
+@contextmanager
+def fake_clock(now: float = 1e9):
+    """Points the cache's clock at a settable time, as `clock.now`"""
+    clock = types.SimpleNamespace(now=now)
+    prev, cache.time = cache.time, types.SimpleNamespace(time=lambda: clock.now)
+    try:
+        yield clock
+    finally:
+        cache.time = prev
+
+
+def test_ttl():
+    for url, ttl in TTLS.items():
+        assert cache.ttl_for(url, b'<html></html>') == ttl, url
+    instrument.instruments().reset()
+    assert cache.ttl_for(GAME_URL, _plays_page(GID)) is None, 'final games should never expire'
+    assert cache.ttl_for(GAME_URL, in_progress_page()) == cache.IN_PROGRESS_TTL, \
+        'a game in progress should expire, whatever else its page embeds'
+    assert 'extract_seconds' not in instrument.instruments().histograms, \
+        'only the game strip should be decoded, not the whole page state'
+
+
+def test_expiry():
+    with tempfile.TemporaryDirectory() as directory, fake_clock() as clock:
+        c = cache.ResponseCache(directory)
+        c.put(SCOREBOARD_URL, b'scoreboard')
+        c.put(GAME_URL, _plays_page(GID))
+        clock.now += TTLS[SCOREBOARD_URL] - 1
+        assert c.get(SCOREBOARD_URL) == b'scoreboard'
+        clock.now += 2
+        assert c.get(SCOREBOARD_URL) is None
+        clock.now += 10 * 365 * 24 * 60 * 60
+        assert c.get(GAME_URL) == _plays_page(GID)
+        c.put(GAME_URL, in_progress_page())  # replaces the entry
+        clock.now += cache.IN_PROGRESS_TTL + 1
+        assert c.get(GAME_URL) is None
+
+
+def test_round_trip():
+    content = _plays_page(GID)
+    with tempfile.TemporaryDirectory() as directory:
+        c = cache.ResponseCache(directory)
+        c.put(GAME_URL, content)
+        raw = c._path(GAME_URL).read_bytes()
+        assert len(raw) < len(content), 'entries should be stored compressed'
+        assert gzip.decompress(raw[cache._HEADER.size:]) == content
+        assert c.get(GAME_URL) == content
+        c._path(GAME_URL).write_bytes(raw[:len(raw) // 2])
+        assert c.get(GAME_URL) is None, 'a truncated entry should be a miss'
+
+
+def test_head_key():
+    """A prefix of a page, cached under its `#head` key, never stands in for the whole page."""
+    with tempfile.TemporaryDirectory() as directory:
+        c = cache.ResponseCache(directory)
+        c.put(f'{PLAYER_URL}#head', b'<html><script>prefix')
+        assert c.get(PLAYER_URL) is None
+        assert c.get(f'{PLAYER_URL}#head') == b'<html><script>prefix'
+        c.put(PLAYER_URL, b'<html>whole</html>')
+        assert c.get(f'{PLAYER_URL}#head') == b'<html><script>prefix'
+
+
+def main():
+    test_ttl()
+    test_expiry()
+    test_round_trip()
+    test_head_key()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import context
+import re
+import time
+from pathlib import Path
+from cbb.classify import RE_PLAY_TYPES, classify
+
+CORPUS_FILE = Path(__file__).parent / 'play_descriptions.txt'
+
+
+def load_corpus() -> list[str]:
+    with open(CORPUS_FILE, 'r', encoding='utf-8') as fp:
+        return [line.rstrip('\n') for line in fp if line.strip()]
+
+
+def classify_reference(desc: str) -> tuple[str, tuple]:
+    """Classification as originally done in `parse_pbp`: every pattern searched in order, uncompiled."""
+    for t, r in RE_PLAY_TYPES:
+        m = re.search(r, desc)
+        if m is not None:
+            return t, m.groups()
+
+
+def test_classify_corpus():
+    for desc in load_corpus():
+        assert classify(desc) == classify_reference(desc), desc
+
+
+def bench_classify(rounds: int = 200) -> dict[str, float]:
+    corpus = load_corpus()
+    res = {}
+    for name, func in (('reference', classify_reference), ('classify', classify)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for desc in corpus:
+                func(desc)
+        dur = time.perf_counter() - start
+        res[name] = rounds * len(corpus) / dur
+        print(f'{name}: {res[name]:,.0f} plays/s')
+    return res
+
+
+def main():
+    test_classify_corpus()
+    bench_classify()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import context
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from cbb import database
+from db_examples import EXAMPLES
+from test_db_bench import SYNTHETIC_PARAMS, build_synthetic_db
+
+def read_examples(barrier: threading.Barrier) -> tuple[int, int]:
+    """Runs every example query on the thread's read-only connection, returning the connection's id and the plays"""
+    barrier.wait()  # so that every thread reads at once, each on a connection of its own
+    with database.conn(write=False) as c:
+        n_plays = c.execute('SELECT count(*) FROM Plays').fetchone()[0]
+        for ex in EXAMPLES:
+            sql, params = ex()
+            c.execute(sql, {k: SYNTHETIC_PARAMS[k] for k in params} if params is not None else ()).fetchall()
+        try:
+            c.execute('DELETE FROM Plays')
+        except sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError('a read-only connection should not write')
+        assert c.execute('SELECT sqrt(16)').fetchone()[0] == 4
+    return id(c), n_plays
+
+
+def test_connections(n_threads: int = 4):
+    """Readers in other threads neither wait for nor see the writer's uncommitted rows, while its thread does."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'connections.db'
+        build_synthetic_db(path, n_seasons=1, games_per_season=20).close()
+        prev = database.connections().path
+        try:
+            c = database.open_db(path)
+            n_plays = c.execute('SELECT count(*) FROM Plays').fetchone()[0]
+            with database.Writer() as writer:
+                writer.connection.execute('DELETE FROM Plays WHERE gid = 1')
+                barrier = threading.Barrier(n_threads)
+                with ThreadPoolExecutor(n_threads) as executor:
+                    reads = list(executor.map(read_examples, [barrier] * n_threads))
+                with database.conn(write=False) as r:
+                    assert r is writer.connection, 'reads in the writer\'s thread should see its uncommitted rows'
+                writer.connection.rollback()
+            assert len({conn_id for conn_id, _ in reads}) == n_threads, 'every thread should read on its own connection'
+            assert all(n == n_plays for _, n in reads), 'readers should see the last commit'
+        finally:
+            database.connections().open(prev)
+    print(f'{n_threads} threads ran {len(EXAMPLES)} example queries each while the writer was open')
+
+
+def main():
+    test_connections()
+
+
+if __name__ == '__main__':
+    main()
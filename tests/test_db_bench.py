@@ -0,0 +1,217 @@
+import context
+import json
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from prettytable import PrettyTable
+from cbb import database
+from db_examples import EXAMPLES
+
+BENCH_DB_FILE = Path(__file__).parent / 'bench.db'
+BENCH_RESULTS_FILE = Path(__file__).parent / 'bench_db_results.json'
+SYNTHETIC_PARAMS = {'cid': 1, 'pid': 1, 'plyr': 1, 'tid': 1}  # ids that exist in every synthetic database
+REGRESSION_THRESHOLD = 0.1  # growth of a query's median time since the previous results reported as a regression
+PLAYS_ALIASES = {  # the names Plays goes by in the plan of every example that reads it
+    'ex2': {'Plays'}, 'ex3': {'Plays'}, 'ex4': {'Plays'}, 'ex5': {'Plays'}, 'ex6': {'Plays', 'P'}, 'ex7': {'Plays'},
+    'ex8': {'P'}, 'ex9': {'Y'}, 'ex11': {'P'}, 'ex12': {'L1', 'L2'},
+}
+COVERED = ('ex4', 'ex8', 'ex9')  # leaderboards that read Plays from covering indexes alone
+
+N_CONFERENCES = 32
+N_TEAMS = 360
+PLAYERS_PER_TEAM = 15
+FIRST_SEASON = 2020
+PLAYS_PER_GAME = 370
+SHOT_SUBTYPES = ('3PJ', '2PJ', '2PL', '2PD', '2PT', '2PH', '1FT', '1FT', '3PJ')
+
+
+def _h(salt: int) -> str:
+    """Deterministic pseudo-random hash of a generated play, so synthetic databases are reproducible."""
+    return f'((((S.gid * 7919 + S.n * 104729 + {salt}) * 2654435761) % 1000003))'
+
+
+def build_synthetic_db(path: str | Path = BENCH_DB_FILE, n_seasons: int = 5, games_per_season: int = 5400):
+    """
+    Builds a database with the `cbb.sqlite` schema filled with synthetic data, without any secondary indexes.
+
+    The defaults produce 5 seasons of 5,400 games with 370 plays each, i.e., about 10M plays.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    c = database.connect(str(path))
+    with open(database.SCHEMA_FILE, 'r') as fp:
+        c.executescript(fp.read())
+    n_games = n_seasons * games_per_season
+    seq = 'WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {})'
+    c.execute(f'''INSERT INTO Conferences (cid, name, abbrev)
+                  {seq.format(N_CONFERENCES)}
+                  SELECT n, 'Conference ' || n, 'C' || n FROM seq''')
+    c.execute(f'''INSERT INTO Teams (tid, cid, name, mascot)
+                  {seq.format(N_TEAMS)}
+                  SELECT n, (n - 1) % {N_CONFERENCES} + 1, 'Team ' || n, 'Mascot ' || n FROM seq''')
+    c.execute(f'''INSERT INTO Players (pid, fname, lname, pos, htft, htin, wt)
+                  {seq.format(N_TEAMS * PLAYERS_PER_TEAM)}
+                  SELECT n, 'First' || n, 'Last' || n, substr('GFC', n % 3 + 1, 1), 5 + n % 3, n % 12, 160 + n % 90
+                  FROM seq''')
+    c.execute(f'''INSERT INTO Rosters (rid, tid, season)
+                  {seq.format(N_TEAMS * n_seasons)}
+                  SELECT n, (n - 1) % {N_TEAMS} + 1, {FIRST_SEASON} + (n - 1) / {N_TEAMS} FROM seq''')
+    c.execute(f'''INSERT INTO PlayerSeasons (pid, rid)
+                  SELECT P.pid, R.rid FROM Players P JOIN Rosters R ON R.tid = (P.pid - 1) / {PLAYERS_PER_TEAM} + 1''')
+    c.execute(f'''INSERT INTO Games (gid, neutral, isconf, home, away, date, season)
+                  {seq.format(n_games)}
+                  SELECT n, n % 10 = 0, n % 2,
+                         (n * 7) % {N_TEAMS} + 1,
+                         ((n * 7) % {N_TEAMS} + 1 + n % ({N_TEAMS} - 1)) % {N_TEAMS} + 1,
+                         date('{FIRST_SEASON - 1}-11-01', '+' || ((n - 1) / {games_per_season}) || ' years',
+                              '+' || (((n - 1) % {games_per_season}) * 150 / {games_per_season}) || ' days'),
+                         {FIRST_SEASON} + (n - 1) / {games_per_season}
+                  FROM seq''')
+    subtypes = ' '.join(f"WHEN {i} THEN '{s}'" for i, s in enumerate(SHOT_SUBTYPES))
+    c.execute(f'''INSERT INTO Plays (plyid, gid, tid, period, time_min, time_sec, type, subtype, away_score,
+                                     home_score, pts_scored, desc, plyr, plyr_ast, rel_ply, x_coord, y_coord)
+                  {seq.format(PLAYS_PER_GAME)},
+                  S AS (SELECT G.gid, G.home, G.away, seq.n FROM Games G, seq),
+                  R AS (SELECT S.gid, S.n,
+                               CASE {_h(1)} % 2 WHEN 0 THEN S.home ELSE S.away END AS tid,
+                               {_h(2)} % 100 AS r,
+                               CASE {_h(3)} % {len(SHOT_SUBTYPES)} {subtypes} END AS sht,
+                               {_h(4)} % 2 AS made,
+                               {_h(5)} AS h
+                        FROM S),
+                  T AS (SELECT R.*,
+                               CASE WHEN r < 45 THEN 'SHT' WHEN r < 65 THEN 'REB' WHEN r < 75 THEN 'FL'
+                                    WHEN r < 83 THEN 'TOV' WHEN r < 88 THEN 'STL' WHEN r < 91 THEN 'BLK'
+                                    WHEN r < 96 THEN 'TO' ELSE 'EOP' END AS type,
+                               (R.tid - 1) * {PLAYERS_PER_TEAM} + 1 + h % {PLAYERS_PER_TEAM} AS plyr
+                        FROM R)
+                  SELECT n, gid, tid, 1 + (n > {PLAYS_PER_GAME // 2}), h % 20, h % 60, type,
+                         CASE type WHEN 'SHT' THEN sht WHEN 'REB' THEN substr('OFFDEF', 1 + 3 * (h % 2), 3) END,
+                         n * (60 + gid % 30) / {PLAYS_PER_GAME}, n * (60 + (gid / 7) % 30) / {PLAYS_PER_GAME},
+                         CASE type WHEN 'SHT' THEN made * CAST(substr(sht, 1, 1) AS INTEGER) END,
+                         NULL, plyr,
+                         CASE WHEN type = 'SHT' AND made AND h % 3 = 0 THEN plyr + 1 END,
+                         CASE WHEN type IN ('REB', 'BLK', 'STL') AND n > 1 THEN n - 1 END,
+                         CASE WHEN type = 'SHT' AND sht != '1FT' THEN h % 50 END,
+                         CASE WHEN type = 'SHT' AND sht != '1FT' THEN h % 47 END
+                  FROM T''')
+    c.commit()
+    return c
+
+
+def bench_examples(c, reps: int = 3) -> dict[str, dict]:
+    """Times every example query on a connection and captures its query plan."""
+    res = {}
+    for ex in EXAMPLES:
+        sql, params = ex()
+        if params is not None:
+            params = {k: SYNTHETIC_PARAMS[k] for k in params}
+        else:
+            params = tuple()
+        durs = []
+        for _ in range(reps):
+            start = time.perf_counter()
+            c.execute(sql, params).fetchall()
+            durs.append(time.perf_counter() - start)
+        plan = [row['detail'] for row in c.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+        res[ex.__name__] = {'min': min(durs), 'median': statistics.median(durs), 'plan': plan}
+    return res
+
+
+def plays_steps(res: dict[str, dict], name: str) -> list[str]:
+    """The steps of an example's query plan that read Plays"""
+    return [d for d in res[name]['plan']
+            if d.split()[0] in ('SCAN', 'SEARCH') and d.split()[1] in PLAYS_ALIASES[name]]
+
+
+def full_scans(plan: list[str]) -> list[str]:
+    return [d for d in plan if d.startswith('SCAN') and 'USING' not in d]
+
+
+def compare(prev: dict, res: dict, threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """The example queries whose median time with indexes grew by more than `threshold` since the previous results."""
+    prev = prev.get('with_indexes', dict())
+    return [name for name, r in res['with_indexes'].items()
+            if name in prev and r['median'] > (1 + threshold) * prev[name]['median']]
+
+
+def print_bench(res: dict[str, dict], plans: bool = False, prev: dict[str, dict] | None = None):
+    table = PrettyTable()
+    table.field_names = ('Query', 'Min (ms)', 'Median (ms)', 'Full scans', 'Change')
+    for name, r in res.items():
+        change = ''
+        if prev is not None and name in prev and prev[name]['median']:
+            change = f'{100 * (r["median"] / prev[name]["median"] - 1):+.1f}%'
+        table.add_row((name, f'{1000 * r["min"]:.1f}', f'{1000 * r["median"]:.1f}', len(full_scans(r['plan'])),
+                       change))
+    print(table)
+    if plans:
+        for name, r in res.items():
+            print(f'=== {name} ===')
+            print('\n'.join(r['plan']))
+
+
+def test_db_bench(n_seasons: int = 1, games_per_season: int = 50):
+    """The managed indexes spare every example a full scan of Plays, and the leaderboards read only indexes."""
+    with tempfile.TemporaryDirectory() as directory:
+        c = build_synthetic_db(Path(directory) / 'bench.db', n_seasons, games_per_season)
+        try:
+            without = bench_examples(c, reps=1)
+            with open(database.INDEX_FILE, 'r') as fp:
+                c.executescript(fp.read())
+            c.execute('ANALYZE')
+            indexed = bench_examples(c, reps=1)
+        finally:
+            c.close()
+    assert set(without) == set(indexed) == {ex.__name__ for ex in EXAMPLES}
+    for name in PLAYS_ALIASES:
+        assert full_scans(plays_steps(without, name)), f'{name} should scan Plays without indexes'
+        assert not full_scans(plays_steps(indexed, name)), f'{name} should not scan Plays: {indexed[name]["plan"]}'
+    for name in COVERED:
+        assert all('COVERING INDEX' in d for d in plays_steps(indexed, name)), \
+            f'{name} should read Plays from covering indexes: {indexed[name]["plan"]}'
+    res = {'without_indexes': without, 'with_indexes': indexed}
+    assert not compare(res, res)
+
+
+def main(build: bool = False, out: str | Path = BENCH_RESULTS_FILE):
+    if build or not os.path.exists(BENCH_DB_FILE):
+        print(f'Building synthetic database at {BENCH_DB_FILE}...', end='', flush=True)
+        start = time.perf_counter()
+        c = build_synthetic_db()
+        print(f'done in {time.perf_counter() - start:.1f} seconds')
+    else:
+        c = database.connect(str(BENCH_DB_FILE))
+    n_plays = c.execute('SELECT count(*) FROM Plays').fetchone()[0]
+    print(f'Benchmarking example queries over {n_plays:,} plays')
+
+    results = {}
+    for name in (index['name'] for index in c.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx\\_%' ESCAPE '\\'").fetchall()):
+        c.execute(f'DROP INDEX {name}')
+    print('=== without indexes ===')
+    results['without_indexes'] = bench_examples(c)
+    print_bench(results['without_indexes'])
+
+    with open(database.INDEX_FILE, 'r') as fp:
+        c.executescript(fp.read())
+    c.execute('ANALYZE')
+    prev = None
+    if os.path.exists(out):
+        with open(out, 'r') as fp:
+            prev = json.load(fp)
+    print('=== with indexes ===')
+    results['with_indexes'] = bench_examples(c)
+    print_bench(results['with_indexes'], plans=True, prev=prev['with_indexes'] if prev is not None else None)
+    if prev is not None and (regressions := compare(prev, results)):
+        print(f'Regressions since the previous run: {regressions}')
+
+    with open(out, 'w') as fp:
+        json.dump(results, fp, indent=2)
+    c.close()
+
+
+if __name__ == '__main__':
+    main()
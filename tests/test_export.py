@@ -0,0 +1,68 @@
+import context
+import numpy as np
+from pathlib import Path
+from cbb import crawl, discover, export
+from espn_server import Corpus, SYNTHETIC_SEASON
+from test_utils import synthetic_site
+
+
+def exported_plays(directory: str | Path) -> list[tuple]:
+    plays = export.load_season(SYNTHETIC_SEASON, ('plays',), directory)['plays']
+    return sorted(zip(plays['plyid'].tolist(), plays['gid'].tolist(), plays['pts_scored'].tolist()))
+
+
+def edit_pages(corpus: Corpus, kind: str, old: bytes, new: bytes):
+    """Rewrites every page of a kind (e.g., `scoreboard`) before the server first reads it"""
+    for path in corpus.paths():
+        if f'/{kind}/' in path:
+            corpus.put(path, corpus.get(path).replace(old, new))
+
+
+def test_export(n_games: int = 2):
+    """Games exported before their plays were ingested are exported again once they are."""
+    with synthetic_site(n_games) as site:
+        columns = site.directory / 'columns'
+        discover.prefill(discover.season_games(SYNTHETIC_SEASON).values())
+        assert export.export(columns) == {SYNTHETIC_SEASON: n_games}
+        assert export.export(columns) == {}, 'nothing changed since the last export'
+        for gid in site.gids:
+            crawl.crawl([gid], assume_gid_from_pbp=True, workers=0, progress=lambda _: None)
+            assert export.export(columns) == {SYNTHETIC_SEASON: 1}, f'{gid=} should be exported again'
+            expected = sorted(map(tuple, site.db.execute('SELECT plyid, gid, ifnull(pts_scored, ?) FROM Plays',
+                                                         (export.null_of(np.int8),))))
+            assert expected and exported_plays(columns) == expected
+        assert export.export(columns) == {}
+        games = export.load_season(SYNTHETIC_SEASON, ('games',), columns)['games']
+        assert sorted(games['gid'].tolist()) == site.gids, 'every game should be exported once'
+        assert np.all(games['isconf'] == 1)
+
+
+def test_prefilled_games(n_games: int = 2):
+    """Games prefilled from a scoreboard that left out some of their columns get those of their game strip."""
+    with synthetic_site(n_games) as site:
+        edit_pages(site.corpus, 'scoreboard', b'"neutralSite":false,"isConferenceGame":true,', b'"neutralSite":true,')
+        assert discover.prefill(discover.season_games(SYNTHETIC_SEASON).values()) == site.gids
+        query = 'SELECT gid, neutral, isconf FROM Games ORDER BY gid'
+        assert [tuple(row) for row in site.db.execute(query)] == [(gid, 1, None) for gid in site.gids]
+        crawl.crawl(site.gids, assume_gid_from_pbp=True, workers=0, progress=lambda _: None)
+        assert [tuple(row) for row in site.db.execute(query)] == [(gid, 0, 1) for gid in site.gids]
+
+
+def test_prefilled_conference(n_games: int = 2):
+    """Games whose strip does not say whether they are conference games keep what their scoreboard said."""
+    with synthetic_site(n_games) as site:
+        edit_pages(site.corpus, 'playbyplay', b'"isConferenceGame":true,', b'')
+        discover.prefill(discover.season_games(SYNTHETIC_SEASON).values())
+        crawl.crawl(site.gids, assume_gid_from_pbp=True, workers=0, progress=lambda _: None)
+        assert [tuple(row) for row in site.db.execute('SELECT gid, isconf FROM Games ORDER BY gid')] == \
+            [(gid, 1) for gid in site.gids]
+
+
+def main():
+    test_export()
+    test_prefilled_games()
+    test_prefilled_conference()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import context
+import json
+import os
+import platform
+import tempfile
+import time
+from pathlib import Path
+from prettytable import PrettyTable
+from cbb import client, crawl, database, extract, instrument, metadata, parse, pbp
+from cbb.classify import classify
+from espn_server import Corpus, EspnServer, CORPUS_DIR, ESPN_PREFIX, redirect, synthesize
+from test_utils import synthetic_site, use_db
+
+BENCH_DB_FILE = Path(__file__).parent / 'bench_ingest.db'
+BENCH_RESULTS_FILE = Path(__file__).parent / 'bench_ingest_results.json'
+REGRESSION_THRESHOLD = 0.1  # slowdown of a stage's rate, relative to the previous results, reported as a regression
+
+
+def _stage(seconds: float, items: int, unit: str, **extras) -> dict:
+    return {'seconds': seconds, 'items': items, 'unit': unit, 'rate': items / seconds if seconds > 0 else 0., **extras}
+
+
+def bench_fetch(server: EspnServer) -> tuple[dict, dict[str, bytes]]:
+    """Fetches every page of the corpus over the pooled client, returning the stage and the pages by path."""
+    paths = server.corpus.paths()
+    start = time.perf_counter()
+    responses = client.client().get_many(f'{server.origin}{path}' for path in paths)
+    seconds = time.perf_counter() - start
+    pages = {path: resp.content for path, resp in zip(paths, responses) if resp.status == 200}
+    assert len(pages) == len(paths), 'every page of the corpus should be served'
+    return _stage(seconds, len(pages), 'pages', bytes=sum(map(len, pages.values()))), pages
+
+
+def bench_extract(pages: dict[str, bytes]) -> tuple[dict, dict[str, dict]]:
+    """Extracts the game packages, box score pid's and player headers from the pages."""
+    packages = dict()
+    start = time.perf_counter()
+    for path, content in pages.items():
+        if '/playbyplay/' in path:
+            packages[path] = extract.game_package(content)
+        elif '/boxscore/' in path:
+            parse.box_pids(content)
+        elif '/player/' in path:
+            extract.player_header(content)
+    return _stage(time.perf_counter() - start, len(pages), 'pages'), packages
+
+
+def bench_classify(packages: dict[str, dict]) -> dict:
+    descs = [play['text'] for pkg in packages.values() for group in pkg['pbp']['playGrps'] for play in group
+             if 'text' in play]
+    start = time.perf_counter()
+    for desc in descs:
+        classify(desc)
+    return _stage(time.perf_counter() - start, len(descs), 'plays')
+
+
+def bench_parse(pages: dict[str, bytes], gids: list[int], home: str = ESPN_PREFIX) -> tuple[dict, list[dict]]:
+    """Parses every game from its pages, as the crawl's worker processes do."""
+    games = []
+    start = time.perf_counter()
+    for gid in gids:
+        box = parse.box_pids(pages[f'{home}/boxscore/_/gameId/{gid}'])
+        players = parse.player_rows({pid: pages[f'{home}/player/_/id/{pid}'] for pid in box['away'] + box['home']})
+        games.append(parse.parse_game(gid, pages[f'{home}/playbyplay/_/gameId/{gid}'], box, players))
+    return _stage(time.perf_counter() - start, len(games), 'games'), games
+
+
+def bench_db_write(games: list[dict], path: str | Path = BENCH_DB_FILE) -> dict:
+    """
+    Writes parsed games through the ingest writer, once with every team and player new and once more into the same
+    database after clearing its games, as in a backfill of known teams.
+    """
+    res = dict()
+    with use_db(path) as c:
+        for run in ('cold', 'warm'):
+            start = time.perf_counter()
+            with database.Writer():
+                metadata.warm()
+                for parsed in games:
+                    pbp.write_game(parsed)
+            res[run] = time.perf_counter() - start
+            n_plays = c.execute('SELECT count(*) FROM Plays').fetchone()[0]
+            for table in ('Plays', 'PlayerGameStats', 'Games', 'IngestJobs'):
+                c.execute(f'DELETE FROM {table}')
+            c.commit()
+    return _stage(res['warm'], len(games), 'games', cold_seconds=res['cold'], plays=n_plays)
+
+
+def bench_end_to_end(gids: list[int], workers: int, path: str | Path = BENCH_DB_FILE) -> dict:
+    """Crawls every game into a fresh database, from the server through the writer."""
+    with use_db(path) as c:
+        stats = crawl.crawl(gids, workers=workers, progress=lambda _: None)
+        n_plays = c.execute('SELECT count(*) FROM Plays').fetchone()[0]
+    assert stats.ingested == len(gids), f'every game should be ingested: {stats}'
+    return _stage(stats.elapsed, stats.ingested, 'games', plays=n_plays, failed=stats.failed)
+
+
+def run_bench(corpus: Corpus, latency: float = 0.02, error_rate: float = 0.01, rate: float | None = 100.,
+              workers: int = crawl.DEFAULT_WORKERS, path: str | Path = BENCH_DB_FILE) -> dict:
+    """Benchmarks every ingest stage against a local server for the corpus, writing to the database at `path`."""
+    gids = corpus.gids()
+    stages = dict()
+    with EspnServer(corpus, latency, error_rate) as server:
+        with redirect(server, rate):
+            stages['fetch'], pages = bench_fetch(server)
+            stages['extract'], packages = bench_extract(pages)
+            stages['classify'] = bench_classify(packages)
+            stages['parse'], games = bench_parse(pages, gids)
+            stages['db_write'] = bench_db_write(games, path)
+        server.counters = dict.fromkeys(server.counters, 0)
+        instrument.instruments().reset()  # so that the metrics are those of the end to end run
+        with redirect(server, rate):  # starting over from the initial rate
+            stages['end_to_end'] = bench_end_to_end(gids, workers, path)
+        counters = dict(server.counters)
+        client.client().close()
+    return {
+        'meta': {'games': len(gids), 'latency': latency, 'error_rate': error_rate, 'rate': rate, 'workers': workers,
+                 'python': platform.python_version(), 'cpus': os.cpu_count(), 'time': time.time()},
+        'stages': stages,
+        'server': counters,
+        'metrics': instrument.instruments().snapshot(),
+    }
+
+
+def compare(prev: dict, res: dict, threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """The stages whose rate dropped by more than `threshold` since the previous results."""
+    return [stage for stage, r in res['stages'].items()
+            if stage in prev['stages'] and r['rate'] < (1 - threshold) * prev['stages'][stage]['rate']]
+
+
+def print_bench(res: dict, prev: dict | None = None):
+    table = PrettyTable()
+    table.field_names = ('Stage', 'Seconds', 'Items', 'Rate', 'Change')
+    for stage, r in res['stages'].items():
+        change = ''
+        if prev is not None and stage in prev['stages'] and prev['stages'][stage]['rate']:
+            change = f'{100 * (r["rate"] / prev["stages"][stage]["rate"] - 1):+.1f}%'
+        table.add_row((stage, f'{r["seconds"]:.3f}', r['items'], f'{r["rate"]:,.1f} {r["unit"]}/s', change))
+    print(table)
+    print(f'Server: {res["server"]}')
+
+
+def test_ingest_bench(n_games: int = 3):
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = Corpus(directory)
+        synthesize(corpus, n_games)
+        res = run_bench(corpus, latency=0., error_rate=0.05, rate=1000., workers=0, path=Path(directory) / 'test.db')
+    assert set(res['stages']) == {'fetch', 'extract', 'classify', 'parse', 'db_write', 'end_to_end'}
+    assert res['stages']['end_to_end']['plays'] == res['stages']['db_write']['plays'] > 0
+    assert not compare(res, res)
+    assert res['metrics']['counters']['db_rows_total']
+    assert res['metrics']['counters']['http_truncated_total'], 'player pages should only be read up to their header'
+
+
+def test_worker_metrics(n_games: int = 2):
+    """Metrics of the parsing done in worker processes are recorded in the crawl's process."""
+    with synthetic_site(n_games) as site:
+        instrument.instruments().reset()
+        stats = crawl.crawl(site.gids, workers=1, progress=lambda _: None)
+        n_plays = site.db.execute('SELECT count(*) FROM Plays').fetchone()[0]
+    metrics = instrument.instruments().snapshot()
+    assert stats.ingested == n_games, stats
+    assert metrics['counters']['plays_parsed_total'][0]['value'] == n_plays > 0
+    classifying, = metrics['histograms']['classify_seconds']
+    assert classifying['count'] == n_games and classifying['sum'] > 0
+
+
+def main(n_games: int = 50, corpus_dir: str | Path = CORPUS_DIR, out: str | Path = BENCH_RESULTS_FILE, **kwargs):
+    corpus = Corpus(corpus_dir)
+    if not corpus.gids():
+        print(f'Synthesizing {n_games} games into {corpus}')  # or record real games with `espn_server.record_games`
+        synthesize(corpus, n_games)
+    print(f'Benchmarking ingest of {len(corpus.gids())} games from {corpus}')
+    res = run_bench(corpus, **kwargs)
+
+    prev = None
+    if os.path.exists(out):
+        with open(out, 'r') as fp:
+            prev = json.load(fp)
+    print_bench(res, prev)
+    if prev is not None and (regressions := compare(prev, res)):
+        print(f'Regressions since the previous run: {regressions}')
+    with open(out, 'w') as fp:
+        json.dump(res, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
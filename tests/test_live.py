@@ -0,0 +1,41 @@
+import context
+import asyncio
+from cbb import client, jobs, live
+from cbb.webscraper import registry
+from espn_server import ESPN_PREFIX
+from test_utils import synthetic_site
+
+
+async def run(step):
+    with registry():
+        try:
+            return await step()
+        finally:
+            await client.close_async_session()
+
+
+def test_in_progress():
+    """A game ingested while in progress is committed only once its final page is polled."""
+    with synthetic_site(1) as site:
+        gid, = site.gids
+        path = f'{ESPN_PREFIX}/playbyplay/_/gameId/{gid}'
+        final_page = site.corpus.get(path)
+        site.server.put(path, final_page.replace(b'"state":"post"', b'"state":"in"'))
+        game = live.LiveGame(gid)
+        assert asyncio.run(run(game.start))
+        assert not game.final
+        assert jobs.state(gid) == jobs.PARSED and gid in jobs.incomplete(), \
+            'a game in progress should be left for resume'
+
+        site.server.put(path, final_page)
+        assert asyncio.run(run(game.poll)) == 0, 'every play was stored when the game was started'
+        assert game.final
+        assert jobs.state(gid) == jobs.COMMITTED and not jobs.incomplete()
+
+
+def main():
+    test_in_progress()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import context
+import tracemalloc
+from pathlib import Path
+from cbb import crawl
+from test_utils import synthetic_site, use_db
+
+FLAT_TOLERANCE = 0.5  # growth of the peak from a short crawl to a long one that still counts as flat
+
+
+def peak_memory(gids: list[int], directory: Path, **kwargs) -> int:
+    """The peak of memory allocated by Python while crawling the games into a fresh database in `directory`"""
+    with use_db(directory / 'memory.db'):
+        tracemalloc.start()
+        try:
+            stats = crawl.crawl(gids, progress=lambda _: None, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    assert stats.ingested == len(gids), f'every game should be ingested: {stats}'
+    return peak
+
+
+def test_memory(n_games: int = 50, n_short: int = 20):
+    """Peak memory of a crawl is bounded by how many games are in flight, not by how many are crawled."""
+    with synthetic_site(n_games) as site:
+        site.server.preload()  # so that the server's pages are not counted
+        peak_memory(site.gids[:2], site.directory, workers=0)  # warms up imports and caches
+        # past the first games, the fetchers and the writer's queue are full, so the peak should level off
+        short = peak_memory(site.gids[:n_short], site.directory, workers=0)
+        long = peak_memory(site.gids, site.directory, workers=0)
+    print(f'Peak memory crawling {n_short} games: {short / 1e6:.1f}MB, {n_games} games: {long / 1e6:.1f}MB')
+    assert long <= (1 + FLAT_TOLERANCE) * short, 'peak memory should not grow with the number of games'
+
+
+def main():
+    test_memory()
+
+
+if __name__ == '__main__':
+    main()
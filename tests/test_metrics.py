@@ -0,0 +1,77 @@
+import context
+import tempfile
+import numpy as np
+from pathlib import Path
+from cbb import export, metrics
+from test_utils import use_db
+
+SEASON = 2024
+GID, HOME, AWAY = 1, 10, 20
+
+# (tid, type, subtype, pts_scored, plyr, plyr_ast) of a two-half game
+PLAYS = (
+    (HOME, 'SHT', '3PJ', 3, 101, 102),
+    (HOME, 'SHT', '2PJ', 0, 101, None),
+    (HOME, 'REB', 'OFF', None, 102, None),
+    (HOME, 'SHT', '2PL', 2, 102, None),
+    (HOME, 'TOV', None, None, 101, None),
+    (HOME, 'SHT', '1FT', 1, 101, None),
+    (HOME, 'SHT', '1FT', 0, 101, None),
+    (AWAY, 'SHT', '3PJ', 0, 201, None),
+    (AWAY, 'REB', 'DEF', None, 201, None),
+    (AWAY, 'SHT', '2PD', 2, 201, None),
+    (AWAY, 'TOV', None, None, 201, None),
+    (AWAY, 'TOV', None, None, 201, None),
+)
+
+# by hand: home uses 3 FGA - 1 OREB + 1 TOV + 0.475 * 2 FTA = 3.95 possessions, away 2 - 0 + 2 + 0 = 4
+GAME_POSS = (3.95 + 4) / 2
+TEAMS = {
+    HOME: {'pts': 6, 'poss': 3.95, 'efg': (2 + 0.5 * 1) / 3, 'tov_pct': 1 / 3.95, 'orb_pct': 1 / (1 + 1),
+           'ft_rate': 2 / 3, 'ortg': 100 * 6 / GAME_POSS, 'drtg': 100 * 2 / GAME_POSS, 'pace': GAME_POSS},
+    AWAY: {'pts': 2, 'poss': 4, 'efg': (1 + 0) / 2, 'tov_pct': 2 / 4, 'orb_pct': float('nan'),  # no rebound chances
+           'ft_rate': 0 / 2, 'ortg': 100 * 2 / GAME_POSS, 'drtg': 100 * 6 / GAME_POSS, 'pace': GAME_POSS},
+}
+PLAYERS = {
+    101: {'pts': 4, 'ast': 0, 'poss': 2 + 0.475 * 2 + 1, 'efg': (1 + 0.5 * 1) / 2, 'ortg': 100 * 4 / 3.95},
+    102: {'pts': 2, 'ast': 1, 'poss': 1, 'efg': 1, 'ortg': 200, 'orb_pct': 1 / (1 + 1)},
+    201: {'pts': 2, 'ast': 0, 'poss': 4, 'efg': 0.5, 'ortg': 50, 'tov_pct': 2 / 4},
+}
+
+
+def insert_game(c):
+    c.execute('INSERT INTO Games (gid, neutral, isconf, home, away, date, season) VALUES (?, 0, 1, ?, ?, ?, ?)',
+              (GID, HOME, AWAY, f'{SEASON - 1}-12-01', SEASON))
+    c.executemany('''INSERT INTO Plays (plyid, gid, tid, period, time_min, time_sec, type, subtype, away_score,
+                                        home_score, pts_scored, plyr, plyr_ast)
+                     VALUES (?, ?, ?, ?, 0, 0, ?, ?, 0, 0, ?, ?, ?)''',
+                  [(plyid, GID, tid, 1 + plyid % 2, *play) for plyid, (tid, *play) in enumerate(PLAYS, 1)])
+    c.commit()
+
+
+def check(res: dict[str, np.ndarray], key: str, expected: dict[int, dict[str, float]]):
+    for id_, values in expected.items():
+        i = res[key].tolist().index(id_)
+        for metric, value in values.items():
+            if np.isnan(value):
+                assert np.isnan(res[metric][i]), f'{metric} of {key} {id_}'
+            else:
+                assert np.isclose(res[metric][i], value), f'{metric} of {key} {id_}: {res[metric][i]} != {value}'
+
+
+def test_metrics():
+    """Team and player metrics of a game computed by hand, from the database and from its export."""
+    with tempfile.TemporaryDirectory() as directory, use_db(Path(directory) / 'metrics.db') as c:
+        insert_game(c)
+        export.export(directory)
+        for source in ('db', 'export'):
+            check(metrics.team_metrics(SEASON, source, directory), 'tid', TEAMS)
+            check(metrics.player_metrics(SEASON, source, directory), 'pid', PLAYERS)
+
+
+def main():
+    test_metrics()
+
+
+if __name__ == '__main__':
+    main()
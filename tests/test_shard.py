@@ -0,0 +1,60 @@
+import context
+import contextlib
+import sqlite3
+from cbb import crawl, discover, shard
+from espn_server import SYNTHETIC_SEASON
+from test_utils import synthetic_site, use_db
+
+# every table by rows that do not depend on the database they were written to (rid's are assigned per database)
+TABLE_QUERIES = {
+    'Conferences': 'SELECT * FROM Conferences',
+    'Teams': 'SELECT * FROM Teams',
+    'Players': 'SELECT * FROM Players',
+    'Rosters': 'SELECT tid, season FROM Rosters',
+    'PlayerSeasons': 'SELECT PS.pid, R.tid, R.season FROM PlayerSeasons PS JOIN Rosters R ON R.rid = PS.rid',
+    'Games': 'SELECT * FROM Games',
+    'Plays': 'SELECT * FROM Plays',
+    'PlayerGameStats': 'SELECT * FROM PlayerGameStats',
+    'IngestJobs': 'SELECT gid, state FROM IngestJobs',
+}
+
+
+def tables(c: sqlite3.Connection) -> dict[str, list[tuple]]:
+    return {table: sorted(map(tuple, c.execute(query))) for table, query in TABLE_QUERIES.items()}
+
+
+def test_shard(n_games: int = 6, n_shards: int = 2):
+    """Games crawled into shards and merged end up exactly as if they were crawled into one database."""
+    with synthetic_site(n_games) as site:
+        directory = site.directory
+        games = discover.season_games(SYNTHETIC_SEASON)
+        crawl.crawl(games, workers=0, progress=lambda _: None)
+        expected = tables(site.db)
+        shards = shard.by_date(games, n_shards)
+        with contextlib.chdir(directory):  # where the shards' worker processes write their log
+            stats = shard.crawl_sharded(shards, directory, n_shards)
+        assert sum(s.ingested for s in stats.values()) == n_games, f'every game should be ingested: {stats}'
+        with use_db(directory / 'merged.db') as c:
+            counts = shard.merge(shard.shard_path(name, directory) for name in shards)
+            assert tables(c) == expected
+            assert shard.merge([shard.shard_path(next(iter(shards)), directory)])['Plays'] == 0, \
+                'merging a shard again should not duplicate its rows'
+
+            # as if the games had been prefilled from scoreboards that got them wrong, and their jobs had failed since
+            attempts = sorted(map(tuple, c.execute('SELECT gid, attempts FROM IngestJobs')))
+            c.execute('UPDATE Games SET neutral = 1, isconf = NULL')
+            c.execute("UPDATE IngestJobs SET state = 'failed'")
+            c.commit()
+            shard.merge(shard.shard_path(name, directory) for name in shards)
+            assert tables(c) == expected, 'games from the shards should update the rows already merged'
+            assert sorted(map(tuple, c.execute('SELECT gid, attempts FROM IngestJobs'))) == attempts, \
+                'merging a shard again should not count its attempts again'
+    print(f'Merged {n_shards} shards: {counts}')
+
+
+def main():
+    test_shard()
+
+
+if __name__ == '__main__':
+    main()
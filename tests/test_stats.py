@@ -0,0 +1,68 @@
+import context
+import re
+from collections import Counter
+from cbb import crawl, extract, stats
+from espn_server import ESPN_PREFIX
+from test_utils import synthetic_site
+
+RE_SHOT = re.compile(r'^First(\d+) Last\d+ (made|missed) (Three Point Jumper|Jumper|Layup|Dunk|Free Throw)\.'
+                     r'(?: Assisted by First(\d+) Last\d+\.)?$')
+SHOT_COLUMNS = {'Three Point Jumper': '3pj', 'Jumper': '2pj', 'Layup': '2pl', 'Dunk': '2pd'}
+COLUMNS = ('fgm', 'fga', 'fgm_3pj', 'fga_3pj', 'fgm_2pj', 'fga_2pj', 'fgm_2pl', 'fga_2pl', 'fgm_2pd', 'fga_2pd',
+           'ftm', 'fta', 'ast', 'pts')
+
+
+def box_scores(plays_page: bytes) -> dict[int, Counter]:
+    """Every player's shooting, assists and points in a synthetic game, counted from the descriptions of its plays"""
+    box = dict()
+    for group in extract.game_package(plays_page)['pbp']['playGrps']:
+        for play in group:
+            match = RE_SHOT.match(play['text'])
+            if match is None:
+                continue
+            pid, result, shot, ast = match.groups()
+            made = result == 'made'
+            c = box.setdefault(int(pid), Counter())
+            if shot == 'Free Throw':
+                c['fta'] += 1
+                c['ftm'] += made
+                c['pts'] += made
+            else:
+                col = SHOT_COLUMNS[shot]
+                c['fga'] += 1
+                c[f'fga_{col}'] += 1
+                c['fgm'] += made
+                c[f'fgm_{col}'] += made
+                c['pts'] += made * (3 if col == '3pj' else 2)
+            if ast is not None:
+                box.setdefault(int(ast), Counter())['ast'] += 1
+    return box
+
+
+def test_stats(n_games: int = 2):
+    """PlayerGameStats maintained game by game matches the plays, and a rebuild from scratch matches it."""
+    with synthetic_site(n_games) as site:
+        c = site.db
+        crawl.crawl(site.gids, workers=0, progress=lambda _: None)
+        query = f'SELECT pid, gid, {", ".join(COLUMNS)} FROM PlayerGameStats ORDER BY pid, gid'
+        incremental = [tuple(row) for row in c.execute(query)]
+        for gid in site.gids:
+            expected = box_scores(site.corpus.get(f'{ESPN_PREFIX}/playbyplay/_/gameId/{gid}'))
+            assert expected, f'{gid=} should have shots'
+            rows = {row['pid']: row for row in c.execute(query.replace('ORDER BY', 'WHERE gid = ? ORDER BY'),
+                                                         (gid,))}
+            for pid, counts in expected.items():
+                assert pid in rows, f'{pid=} has no box score in {gid=}'
+                assert {col: rows[pid][col] for col in COLUMNS} == {col: counts[col] for col in COLUMNS}, \
+                    f'box score of {pid=} in {gid=}'
+        stats.rebuild_game_stats()
+        assert [tuple(row) for row in c.execute(query)] == incremental, \
+            'a rebuild should match the box scores maintained game by game'
+
+
+def main():
+    test_stats()
+
+
+if __name__ == '__main__':
+    main()
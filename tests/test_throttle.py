@@ -0,0 +1,113 @@
+import context
+import email.utils
+import types
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from cbb import throttle
+
+
+@contextmanager
+def fake_clock(now: float = 1000.):
+    """Points the throttle's clock at a time that only moves when slept on, as `clock.now`"""
+    clock = types.SimpleNamespace(now=now)
+
+    def sleep(seconds: float):
+        clock.now += max(seconds, 1e-6)  # a real sleep is never shorter than the clock's resolution
+
+    prev, throttle.time = throttle.time, types.SimpleNamespace(time=lambda: clock.now, monotonic=lambda: clock.now,
+                                                               sleep=sleep)
+    try:
+        yield clock
+    finally:
+        throttle.time = prev
+
+
+def request(limiter: throttle.HostLimiter, status: int | None):
+    limiter.acquire()
+    limiter.release(status)
+
+
+def test_bucket_rate(seconds: float = 10.):
+    """Past its burst, the bucket lets requests through at its rate."""
+    with fake_clock() as clock:
+        limiter = throttle.HostLimiter('example.com')
+        start, n = clock.now, 0
+        while clock.now - start < seconds:
+            request(limiter, None)  # a failed connection, which leaves the rate as it is
+            n += 1
+    assert limiter.rate == throttle.INITIAL_RATE
+    assert abs(n - (throttle.BURST + seconds * throttle.INITIAL_RATE)) <= 1, n
+
+
+def test_aimd():
+    """Throttles halve the rate and window once per cooldown, and successes grow them back."""
+    with fake_clock() as clock:
+        limiter = throttle.HostLimiter('example.com')
+        limiter.rate, limiter.window = 8., throttle.MAX_WINDOW
+        request(limiter, 429)
+        assert (limiter.rate, limiter.window) == (4., throttle.MAX_WINDOW / 2)
+        request(limiter, 503)
+        assert (limiter.rate, limiter.window) == (4., throttle.MAX_WINDOW / 2), \
+            'throttles within the cooldown should count once'
+        clock.now += throttle.DECREASE_COOLDOWN
+        request(limiter, 429)
+        assert (limiter.rate, limiter.window) == (2., throttle.MAX_WINDOW / 4)
+
+        rates, windows = [limiter.rate], [limiter.window]
+        for _ in range(50):
+            request(limiter, 200)
+            rates.append(limiter.rate)
+            windows.append(limiter.window)
+        assert rates == sorted(rates) and windows == sorted(windows), 'successes should only grow the rate and window'
+        assert limiter.window == throttle.MAX_WINDOW
+        assert rates[-1] > 8.
+
+        request(limiter, 500)
+        assert (limiter.rate, limiter.window) == (rates[-1], windows[-1]), 'server errors are not throttles'
+
+
+def test_retry_after_pause():
+    with fake_clock() as clock:
+        limiter = throttle.HostLimiter('example.com')
+        request(limiter, 200)
+        start = clock.now
+        limiter.acquire()
+        limiter.release(429, 3.)
+        request(limiter, 200)
+        assert clock.now - start >= 3., 'the host should be paused for its Retry-After'
+
+
+def test_backoff():
+    prev = throttle.random
+    try:
+        throttle.random = types.SimpleNamespace(uniform=lambda a, b: b)  # the most full jitter may wait
+        assert [throttle.backoff(n) for n in range(3)] == [throttle.BACKOFF_BASE * 2 ** n for n in range(3)]
+        assert throttle.backoff(20) == throttle.BACKOFF_CAP
+        throttle.random = types.SimpleNamespace(uniform=lambda a, b: a)  # the least
+        assert throttle.backoff(5) == 0.
+        assert throttle.backoff(5, 7.) == 7., 'a Retry-After should be waited for in full'
+    finally:
+        throttle.random = prev
+
+
+def test_retry_after():
+    with fake_clock(datetime(2024, 3, 1, 12, tzinfo=timezone.utc).timestamp()) as clock:
+        assert throttle.retry_after('120') == 120.
+        assert throttle.retry_after(' 5 ') == 5.
+        assert throttle.retry_after(email.utils.formatdate(clock.now + 30, usegmt=True)) == 30.
+        assert throttle.retry_after('Fri, 01 Mar 2024 12:00:30 GMT') == 30.
+        assert throttle.retry_after('Fri, 01 Mar 2024 11:00:00 GMT') == 0., 'a date past should not wait'
+        for value in (None, '', 'soon'):
+            assert throttle.retry_after(value) is None
+
+
+def main():
+    test_bucket_rate()
+    test_aimd()
+    test_retry_after_pause()
+    test_backoff()
+    test_retry_after()
+
+
+if __name__ == '__main__':
+    main()
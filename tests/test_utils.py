@@ -1,8 +1,15 @@
 import context
+import os
+import sqlite3
+import tempfile
 import time
-from cbb import database
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple
+from cbb import client, database, metadata
 from pprint import pprint
 from prettytable import PrettyTable
+from espn_server import Corpus, EspnServer, redirect, synthesize
 
 
 def timeop(func, display=None, *args, **kwargs):
@@ -89,3 +96,47 @@ def sqlp(sql_exp: str, sql_params=None):
 def reset_db():
     database.delete_db(force=True)
     assert (database.init_schema())
+
+
+@contextmanager
+def use_db(path: str | Path):
+    """Points the module-global connections at a fresh database with the schema, for the duration of a stage."""
+    if os.path.exists(path):
+        os.remove(path)
+    prev = database.connections().path
+    c = database.open_db(path)
+    try:
+        database.init_schema()
+        yield c
+    finally:
+        database.connections().open(prev)
+        metadata.metadata().clear()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(f'{path}{suffix}'):
+                os.remove(f'{path}{suffix}')
+
+
+class Site(NamedTuple):
+    """Synthetic games served by a local ESPN stand-in, with a fresh database, in a temporary directory"""
+    directory: Path
+    corpus: Corpus
+    gids: list[int]
+    server: EspnServer
+    db: sqlite3.Connection
+
+
+@contextmanager
+def synthetic_site(n_games: int, rate: float = 1000.):
+    """
+    Synthesizes `n_games` games into a temporary directory and serves them at `rate` requests per second, with the
+    module-global connections on a fresh database in the same directory, all of which is removed afterwards.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        corpus = Corpus(directory / 'corpus')
+        gids = synthesize(corpus, n_games)
+        with EspnServer(corpus) as server, redirect(server, rate), use_db(directory / 'test.db') as c:
+            try:
+                yield Site(directory, corpus, gids, server, c)
+            finally:
+                client.client().close()
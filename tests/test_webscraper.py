@@ -0,0 +1,52 @@
+import context
+import asyncio
+import tempfile
+from pathlib import Path
+from cbb import cache, client, pbp
+from cbb.webscraper import get_page, registry
+from espn_server import Corpus, EspnServer, redirect, synthesize
+
+
+def test_registry():
+    """Pages are fetched once for all their users at a time, and again only once released."""
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = Corpus(Path(directory) / 'corpus')
+        synthesize(corpus, 1)
+        with EspnServer(corpus) as server, redirect(server, 1000.), registry():
+            def requests() -> int:
+                return server.counters['requests']
+
+            url = f'{pbp.ESPN_HOME}/team/_/id/1'
+            page = get_page(url)
+            assert get_page(url) is page
+            assert page.content and get_page(url).content == page.content
+            assert requests() == 1, 'a page should be fetched once for every lookup of it'
+
+            async def fetch_twice(url_: str):
+                await asyncio.gather(get_page(url_).fetch(), get_page(url_).fetch())
+                await client.close_async_session()
+            asyncio.run(fetch_twice(f'{pbp.ESPN_HOME}/team/_/id/2'))
+            assert requests() == 2, 'concurrent fetches of a page should share one request'
+
+            page.release()
+            assert page.content is not None
+            assert requests() == 3, 'a released page should be read again'
+
+            cache.enable(Path(directory) / 'cache')
+            try:
+                page = get_page(f'{pbp.ESPN_HOME}/team/_/id/3')
+                assert page.content is not None
+                page.release()
+                assert page.content is not None
+                assert requests() == 4, 'a released page should be read again from the cache'
+            finally:
+                cache.disable()
+            client.client().close()
+
+
+def main():
+    test_registry()
+
+
+if __name__ == '__main__':
+    main()